@@ -1,34 +1,182 @@
+import json
 import os
-from typing import Dict, List
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from types import MappingProxyType
+from itertools import batched, islice
+from typing import Dict, Iterable, Iterator, List, Mapping, NamedTuple, Set, Tuple
 from pathlib import Path
 
 import gitlab
+import requests
 import yaml
 from dotenv import load_dotenv
 from argparse import ArgumentParser
 
+from gitlab.v4.objects.groups import Group
 from gitlab.v4.objects.projects import Project
 from gitlab.v4.objects.merge_request_approvals import ProjectApprovalRule
 
-# We only need a single global reference to these
-GROUP_MEMBERS = None
-GROUP_MEMBERS_BY_IDS = None
-GROUP_MEMBERS_BY_USERNAMES = None
-ARGS = None
 
+# GitLab caps GraphQL connections at 100 nodes per page
+USER_BATCH_SIZE = 100
 
-def manage_rule(rule: ProjectApprovalRule, spec: Dict):
+USERS_QUERY = """
+query users($usernames: [String!], $first: Int) {
+  users(usernames: $usernames, first: $first) {
+    nodes {
+      id
+      username
+    }
+  }
+}
+"""
+
+
+class Context(NamedTuple):
+    """Shared by every worker, and never modified once the run has started."""
+
+    fix: bool
+    user_ids: Mapping[str, int]
+    usernames: Mapping[int, str]
+
+
+def make_context(fix: bool, user_ids: Dict[str, int]) -> Context:
+    return Context(
+        fix=fix,
+        user_ids=MappingProxyType(dict(user_ids)),
+        usernames=MappingProxyType(
+            {user_id: username for username, user_id in user_ids.items()}
+        ),
+    )
+
+
+class UserCache:
+    """User ids by username, kept on disk between runs for ``ttl`` seconds.
+
+    Usernames that weren't found are kept too, with an id of None, so they
+    aren't searched for again until they expire. Entries are stored per GitLab
+    URL, so one file can serve several instances.
+    """
+
+    def __init__(self, path: Path, ttl: float, gitlab_url: str):
+        self.path = path
+        self.ttl = ttl
+        self.gitlab_url = gitlab_url
+        self.entries = {}
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                self.entries = json.load(f)
+
+    def get(self, usernames: Iterable[str]) -> Dict[str, int | None]:
+        users = self.entries.get(self.gitlab_url, {})
+        now = time.time()
+        return {
+            username: users[username]["id"]
+            for username in usernames
+            if username in users and now - users[username]["fetched_at"] < self.ttl
+        }
+
+    def save(self, user_ids: Dict[str, int | None]) -> None:
+        if not user_ids:
+            return
+        users = self.entries.setdefault(self.gitlab_url, {})
+        now = time.time()
+        for username, user_id in user_ids.items():
+            users[username] = {"id": user_id, "fetched_at": now}
+
+        # Written to a temporary file first so an interrupted run can't corrupt it
+        temporary_path = f"{self.path}.tmp"
+        with open(temporary_path, "w") as f:
+            json.dump(self.entries, f)
+        os.replace(temporary_path, self.path)
+
+
+def lookup_usernames(gl: gitlab.Gitlab, usernames: List[str]) -> Dict[str, int]:
+    """User ids of the usernames that exist, up to 100 usernames per request."""
+    user_ids = {}
+    for batch in batched(usernames, USER_BATCH_SIZE):
+        result = gl.http_post(
+            f"{gl.url}/api/graphql",
+            post_data={
+                "query": USERS_QUERY,
+                "variables": {"usernames": list(batch), "first": len(batch)},
+            },
+        )
+        if result.get("errors"):
+            messages = "; ".join(error["message"] for error in result["errors"])
+            raise RuntimeError(f"GraphQL query failed: {messages}")
+        for node in result["data"]["users"]["nodes"]:
+            # Global ids look like gid://gitlab/User/123
+            user_ids[node["username"]] = int(node["id"].rsplit("/", 1)[-1])
+    return user_ids
+
+
+def resolve_users(
+    gl: gitlab.Gitlab, group: Group, usernames: Set[str], cache: UserCache
+) -> Dict[str, int]:
+    """User ids of the approvers, from the cache, the group's members or their usernames."""
+    cached = cache.get(usernames)
+    missing = set(usernames) - set(cached)
+    resolved = {}
+
+    if missing:
+        # Inherited members too, stopping as soon as every approver is found
+        for member in group.members_all.list(iterator=True, per_page=100):
+            if member.username in missing:
+                resolved[member.username] = member.id
+                missing.discard(member.username)
+                if not missing:
+                    break
+
+    if missing:
+        outsiders = lookup_usernames(gl, sorted(missing))
+        if outsiders:
+            print(
+                f"Approvers who aren't members of {group.name} and may not be able to approve: {sorted(outsiders)}"
+            )
+        resolved.update(outsiders)
+        missing -= set(outsiders)
+
+    # Misses are cached as well, a misspelt approver would otherwise be
+    # searched for through every member on every run
+    cache.save({**resolved, **{username: None for username in missing}})
+
+    user_ids = {
+        username: user_id
+        for username, user_id in {**cached, **resolved}.items()
+        if user_id is not None
+    }
+    not_found = set(usernames) - set(user_ids)
+    if not_found:
+        print(
+            f"Approvers not found, they will be left out of rules: {sorted(not_found)}"
+        )
+    return user_ids
+
+
+def spec_user_ids(spec: Dict, context: Context) -> Set[int]:
+    # Approvers that couldn't be resolved have already been reported
+    return {
+        context.user_ids[user] for user in spec["users"] if user in context.user_ids
+    }
+
+
+def manage_rule(
+    rule: ProjectApprovalRule, spec: Dict, context: Context, out: List[str]
+):
     actions = []
 
-    print(f"\tManaging Rule: '{rule.name}' ({rule.id})")
-    print(f"\t\tApprovals_required: {rule.approvals_required}")
-    print(
+    out.append(f"\tManaging Rule: '{rule.name}' ({rule.id})")
+    out.append(f"\t\tApprovals_required: {rule.approvals_required}")
+    out.append(
         f"\t\tProtected Branches: {[branch['name'] for branch in rule.protected_branches]}"
     )
 
-    print("\t\tApprovers:")
+    out.append("\t\tApprovers:")
     for user in rule.users:
-        print(f"\t\t\t{user['username']}")
+        out.append(f"\t\t\t{user['username']}")
 
     if rule.approvals_required != spec["approvals_required"]:
         rule.approvals_required = spec["approvals_required"]
@@ -43,10 +191,6 @@ def manage_rule(rule: ProjectApprovalRule, spec: Dict):
         "applies_to_all_protected_branches", True
     )
     if rule.applies_to_all_protected_branches != applies_to_all_protected_branches:
-        print(
-            type(rule.applies_to_all_protected_branches),
-            type(applies_to_all_protected_branches),
-        )
         rule.applies_to_all_protected_branches = applies_to_all_protected_branches
         actions.append(
             (
@@ -55,77 +199,171 @@ def manage_rule(rule: ProjectApprovalRule, spec: Dict):
             )
         )
 
-    spec_users = {GROUP_MEMBERS_BY_USERNAMES[user].id for user in spec["users"]}
-    rule_users = {user["id"] for user in rule.users}
+    spec_users = spec_user_ids(spec, context)
+    rule_users = {user["id"]: user["username"] for user in rule.users}
 
-    if spec_users != rule_users:
-        diff = rule_users - spec_users
-        users_to_remove = [GROUP_MEMBERS_BY_IDS[user].username for user in diff]
+    if spec_users != set(rule_users):
+        diff = set(rule_users) - spec_users
+        users_to_remove = [rule_users[user] for user in diff]
         if users_to_remove:
             actions.append(f"Remove Approvers: {users_to_remove}")
 
-        diff = spec_users - rule_users
-        users_to_add = [GROUP_MEMBERS_BY_IDS[user].username for user in diff]
+        diff = spec_users - set(rule_users)
+        users_to_add = [context.usernames[user] for user in diff]
         if users_to_add:
             actions.append(f"Add Approvers: {users_to_add}")
 
         rule.users = list(spec_users)
 
-    print("\t\tActions:")
+    out.append("\t\tActions:")
     for a in actions:
-        print(f"\t\t\t{a}")
+        out.append(f"\t\t\t{a}")
 
-    if ARGS.fix and len(actions) > 0:
+    if context.fix and len(actions) > 0:
         rule.save()
 
-    pass
+
+DEFAULT_ASSIGNMENT = "default"
 
 
 class RuleSpecManager:
+    """Approval rule specs, compiled once into lookups by name and by key.
+
+    The optional ``projects`` section assigns specs to projects. Entries are
+    keyed by a project id, by a project path, by a group path covering every
+    project below it, or by ``default``. An entry with ``topics`` is a selector
+    instead, covering the projects that have any of the topics, and its key is
+    only a name.
+
+    A project gets the specs of its id, else of its own path, else of the first
+    selector it matches, else of its deepest group, else the default. Without a
+    ``projects`` section every spec applies to every project.
+    """
+
     def __init__(self, config_path: Path):
         self.config_path = config_path
         self.config = None
+        self.specs_by_key: Dict[str, Dict] = {}
+        self.specs_by_name: Dict[str, Dict] = {}
+        self.specs_by_id: Dict[int, Mapping[str, Dict]] = {}
+        self.specs_by_path: Dict[str, Mapping[str, Dict]] = {}
+        self.selectors: List[Tuple[frozenset, Mapping[str, Dict]]] = []
+        self.default_specs: Mapping[str, Dict] = MappingProxyType({})
 
     def load_config(self) -> None:
         with open(self.config_path, "r") as f:
             self.config = yaml.safe_load(f)
+        self.compile()
+
+    def compile(self) -> None:
+        self.specs_by_key = dict(self.config["approval_rules"])
+        self.specs_by_name = {}
+        for key, spec in self.specs_by_key.items():
+            if spec["name"] in self.specs_by_name:
+                raise ValueError(
+                    f"Approval rule '{key}' has the same name as another rule: {spec['name']}"
+                )
+            self.specs_by_name[spec["name"]] = spec
+
+        self.specs_by_id = {}
+        self.specs_by_path = {}
+        self.selectors = []
+        assignments = self.config.get("projects")
+        if assignments is None:
+            self.default_specs = MappingProxyType(dict(self.specs_by_name))
+            return
+
+        self.default_specs = MappingProxyType({})
+        for key, assignment in assignments.items():
+            if not isinstance(assignment, dict):
+                raise ValueError(
+                    f"Projects '{key}' have no settings, list their approval_rules or use [] for none"
+                )
+            specs = self.assigned_specs(key, assignment)
+            if "topics" in assignment:
+                self.selectors.append((frozenset(assignment["topics"]), specs))
+            elif key == DEFAULT_ASSIGNMENT:
+                self.default_specs = specs
+            elif isinstance(key, int):
+                self.specs_by_id[key] = specs
+            else:
+                # Paths are case-insensitive in GitLab
+                self.specs_by_path[key.strip("/").lower()] = specs
+
+    def assigned_specs(self, key: str, assignment: Dict) -> Mapping[str, Dict]:
+        specs = {}
+        for spec_key in assignment.get("approval_rules", []):
+            if spec_key not in self.specs_by_key:
+                raise ValueError(
+                    f"Projects '{key}' use an approval rule that isn't defined: {spec_key}"
+                )
+            spec = self.specs_by_key[spec_key]
+            specs[spec["name"]] = spec
+        return MappingProxyType(specs)
 
     def get_specs(self) -> Dict:
-        return self.config["approval_rules"]
+        return self.specs_by_key
 
     def get_spec_names(self) -> List[str]:
-        return [spec["name"] for spec in self.get_specs().values()]
+        return list(self.specs_by_name)
 
     def get_spec_by_name(self, name: str) -> Dict:
-        for _, spec in self.config["approval_rules"].items():
-            if spec["name"] == name:
-                return spec
-        raise ValueError(f"No spec was found with name matching: {name}")
-
-
-def manage_project_approval_rules(project: Project, rule_spec_manager: RuleSpecManager):
+        if name not in self.specs_by_name:
+            raise ValueError(f"No spec was found with name matching: {name}")
+        return self.specs_by_name[name]
+
+    def get_usernames(self) -> Set[str]:
+        return {user for spec in self.specs_by_key.values() for user in spec["users"]}
+
+    def specs_for_project(self, project) -> Mapping[str, Dict]:
+        """The specs that apply to the project, keyed by rule name."""
+        if project.id in self.specs_by_id:
+            return self.specs_by_id[project.id]
+
+        path = project.path_with_namespace.lower()
+        if path in self.specs_by_path:
+            return self.specs_by_path[path]
+
+        topics = getattr(project, "topics", None) or ()
+        for selector_topics, specs in self.selectors:
+            if not selector_topics.isdisjoint(topics):
+                return specs
+
+        while "/" in path:
+            path = path.rsplit("/", 1)[0]
+            if path in self.specs_by_path:
+                return self.specs_by_path[path]
+        return self.default_specs
+
+
+def manage_project_approval_rules(
+    project: Project,
+    rule_spec_manager: RuleSpecManager,
+    context: Context,
+    out: List[str],
+):
     project_approval_rules = project.approvalrules.list()
-    print(f"{project.name} ({project.id})")
+    out.append(f"{project.name} ({project.id})")
+    specs = rule_spec_manager.specs_for_project(project)
 
     for rule in project_approval_rules:
-        # 1 delete rules that exist that aren't in the spec
-        if rule.name not in rule_spec_manager.get_spec_names():
-            print(f"\tDeleting rule '{rule.name}'")
-            if ARGS.fix:
+        # 1 delete rules that exist that aren't in the project's specs
+        if rule.name not in specs:
+            out.append(f"\tDeleting rule '{rule.name}'")
+            if context.fix:
                 rule.delete()
             continue
 
         # 2 manage the existing rules
-        rule_spec = rule_spec_manager.get_spec_by_name(rule.name)
-        manage_rule(rule, rule_spec)
+        manage_rule(rule, specs[rule.name], context, out)
 
     # 3 create approval rules if they don't exist
-    rule_names = [rule.name for rule in project_approval_rules]
-    for _, spec in rule_spec_manager.get_specs().items():
+    rule_names = {rule.name for rule in project_approval_rules}
+    for spec in specs.values():
         if spec["name"] not in rule_names:
-            print(f"\tCreating rule '{spec['name']}'")
+            out.append(f"\tCreating rule '{spec['name']}'")
 
-            if ARGS.fix:
+            if context.fix:
                 project.approvalrules.create(
                     {
                         "name": spec["name"],
@@ -133,58 +371,143 @@ def manage_project_approval_rules(project: Project, rule_spec_manager: RuleSpecM
                             "applies_to_all_protected_branches", True
                         ),
                         "approvals_required": spec.get("approvals_required", 1),
-                        "user_ids": [
-                            GROUP_MEMBERS_BY_USERNAMES[user].id
-                            for user in spec["users"]
-                        ],
+                        "user_ids": list(spec_user_ids(spec, context)),
                     }
                 )
 
 
-def main():
-    global GROUP_MEMBERS
-    global GROUP_MEMBERS_BY_IDS
-    global GROUP_MEMBERS_BY_USERNAMES
-    global ARGS
+def list_projects(
+    gl: gitlab.Gitlab, group: Group, limit: int | None = None
+) -> Iterator[Project]:
+    """The group's active projects, one page at a time, up to ``limit``.
+
+    Projects are built from the listing as lazy objects. The listing has every
+    attribute that is used, and a lazy project provides the approval rules
+    manager, so no project is fetched again.
+    """
+    group_projects = group.projects.list(
+        iterator=True,
+        archived=False,
+        simple=True,
+        pagination="keyset",
+        order_by="id",
+        sort="asc",
+        per_page=100,
+    )
+    projects = (
+        Project(gl.projects, group_project.attributes, lazy=True)
+        for group_project in group_projects
+    )
+    # Stops paging as soon as the limit is reached
+    return islice(projects, limit)
+
+
+def reconcile_project(
+    project: Project,
+    rule_spec_manager: RuleSpecManager,
+    context: Context,
+) -> List[str]:
+    """Manage one project's rules, returning its output instead of printing it."""
+    out = []
+    try:
+        manage_project_approval_rules(project, rule_spec_manager, context, out)
+    except Exception as e:
+        # One project failing doesn't stop the others
+        out.append(f"Failed to manage project {project.id}: {e!r}")
+    return out
+
+
+def reconcile_projects(
+    projects: Iterable[Project],
+    rule_spec_manager: RuleSpecManager,
+    context: Context,
+    concurrency: int = 1,
+) -> Iterator[List[str]]:
+    """Yield each project's output in the order of projects.
+
+    At most ``concurrency`` projects are managed at once, and no more than
+    twice that are queued, so projects can be a lazy iterator still paging
+    through the API.
+    """
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        pending = deque()
+        for project in projects:
+            pending.append(
+                executor.submit(reconcile_project, project, rule_spec_manager, context)
+            )
+            while pending and (pending[0].done() or len(pending) > 2 * concurrency):
+                yield pending.popleft().result()
+
+        while pending:
+            yield pending.popleft().result()
 
+
+def main():
     parser = ArgumentParser()
     parser.add_argument("--limit", type=int)
     parser.add_argument("--fix", action="store_true", default=False)
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=1,
+        help="Number of projects to manage in parallel. Defaults to 1.",
+    )
+    parser.add_argument(
+        "--user-cache",
+        default="gitlab-approvers-users.json",
+        help="File approvers' user ids are cached in between runs. Defaults to gitlab-approvers-users.json.",
+    )
+    parser.add_argument(
+        "--user-cache-ttl",
+        type=float,
+        default=24 * 60 * 60,
+        help="Seconds a cached user id is reused for, 0 looks every approver up again. Defaults to a day.",
+    )
 
-    ARGS = parser.parse_args()
+    args = parser.parse_args()
+    if args.concurrency < 1:
+        parser.error("--concurrency must be at least 1")
 
     load_dotenv()
     # GitLab private token
-    GITLAB_URL = "https://gitlab.com"
+    GITLAB_URL = os.environ.get("GITLAB_URL", "https://gitlab.com")
     PRIVATE_TOKEN = os.environ.get("GITLAB_TOKEN")
     GROUP_ID = os.environ.get("GITLAB_PROJECT_ID")
 
-    config_path = Path(__file__).parent / "approval_rules.yml"
+    config_path = os.environ.get(
+        "GITLAB_APPROVAL_RULES_FILEPATH", Path(__file__).parent / "approval_rules.yml"
+    )
     rule_spec_manager = RuleSpecManager(config_path=config_path)
     rule_spec_manager.load_config()
 
     gl = gitlab.Gitlab(GITLAB_URL, private_token=PRIVATE_TOKEN)
+    # One connection per worker and one for the main thread listing projects,
+    # so they are reused rather than reopened
+    adapter = requests.adapters.HTTPAdapter(
+        pool_connections=args.concurrency, pool_maxsize=args.concurrency + 1
+    )
+    gl.session.mount("http://", adapter)
+    gl.session.mount("https://", adapter)
     group = gl.groups.get(GROUP_ID)
 
-    # List all projects in the group
-    print(f"Getting projects for {group.name} ({group.id})")
-    group_projects = group.projects.list(get_all=True, archived=False)
-
-    print(f"Getting Group Members for {group.name}")
-    GROUP_MEMBERS = group.members.list(all=True)
-    GROUP_MEMBERS_BY_USERNAMES = {member.username: member for member in GROUP_MEMBERS}
-    GROUP_MEMBERS_BY_IDS = {member.id: member for member in GROUP_MEMBERS}
+    print(f"Resolving approvers for {group.name}")
+    cache = UserCache(args.user_cache, args.user_cache_ttl, GITLAB_URL)
+    user_ids = resolve_users(gl, group, rule_spec_manager.get_usernames(), cache)
+    context = make_context(args.fix, user_ids)
 
+    # Projects are managed as their page of the listing arrives
+    print(f"Managing projects of {group.name} ({group.id})")
+    projects = list_projects(gl, group, limit=args.limit)
     count = 0
-    for group_project in group_projects:
-        project = gl.projects.get(group_project.id)
-        manage_project_approval_rules(project, rule_spec_manager)
-
-        if count == ARGS.limit:
-            print(f"Limit of {ARGS.limit} project(s) checked. Exiting")
-            break
+    for out in reconcile_projects(
+        projects, rule_spec_manager, context, concurrency=args.concurrency
+    ):
+        print("\n".join(out))
         count += 1
 
+    if args.limit is not None and count == args.limit:
+        print(f"Limit of {args.limit} project(s) checked. Exiting")
+
 
 if __name__ == "__main__":
     main()
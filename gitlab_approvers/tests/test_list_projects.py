@@ -0,0 +1,65 @@
+from types import SimpleNamespace
+
+import main
+from main import list_projects
+
+PER_PAGE = 100
+
+
+def make_group(mocker, pages):
+    """A group whose project listing records the pages it fetched."""
+    group = mocker.Mock()
+    fetched = []
+
+    def list_group_projects(**kwargs):
+        for page in range(pages):
+            fetched.append(page)
+            for index in range(PER_PAGE):
+                project_id = page * PER_PAGE + index + 1
+                yield SimpleNamespace(
+                    attributes={
+                        "id": project_id,
+                        "path_with_namespace": f"acme/p{project_id}",
+                    }
+                )
+
+    group.projects.list.side_effect = list_group_projects
+    return group, fetched
+
+
+class TestListProjects:
+    def test_lists_with_keyset_pagination(self, mocker):
+        group, _ = make_group(mocker, pages=1)
+
+        list(list_projects(mocker.Mock(), group))
+
+        group.projects.list.assert_called_once_with(
+            iterator=True,
+            archived=False,
+            simple=True,
+            pagination="keyset",
+            order_by="id",
+            sort="asc",
+            per_page=PER_PAGE,
+        )
+
+    def test_limit_stops_paging(self, mocker):
+        group, fetched = make_group(mocker, pages=3)
+        mock_project = mocker.patch.object(main, "Project", wraps=main.Project)
+
+        projects = list(list_projects(mocker.Mock(), group, limit=5))
+
+        assert [project.id for project in projects] == [1, 2, 3, 4, 5]
+        assert fetched == [0]
+        assert mock_project.call_count == 5
+
+    def test_is_lazy(self, mocker):
+        group, fetched = make_group(mocker, pages=3)
+
+        projects = list_projects(mocker.Mock(), group)
+        assert fetched == []
+
+        assert next(projects).id == 1
+        assert fetched == [0]
+        assert len(list(projects)) == 3 * PER_PAGE - 1
+        assert fetched == [0, 1, 2]
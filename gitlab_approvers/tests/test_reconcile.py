@@ -0,0 +1,92 @@
+import threading
+import time
+
+import pytest
+
+import main
+from main import make_context, reconcile_projects
+
+
+def make_project(mocker, project_id):
+    return mocker.Mock(id=project_id)
+
+
+def fake_manage(project, rule_spec_manager, context, out):
+    # Later projects finish first, so results complete out of order
+    time.sleep(0.01 * (5 - project.id % 5))
+    out.append(f"project {project.id}")
+
+
+def failing_manage(project, rule_spec_manager, context, out):
+    if project.id == 3:
+        raise RuntimeError("boom")
+    fake_manage(project, rule_spec_manager, context, out)
+
+
+class TestReconcileProjects:
+    def test_results_are_in_input_order(self, mocker):
+        mocker.patch.object(main, "manage_project_approval_rules", fake_manage)
+        projects = [make_project(mocker, project_id) for project_id in range(10)]
+
+        outputs = list(
+            reconcile_projects(projects, None, make_context(False, {}), concurrency=4)
+        )
+
+        assert outputs == [[f"project {project_id}"] for project_id in range(10)]
+
+    def test_a_failed_project_does_not_stop_the_others(self, mocker):
+        mocker.patch.object(main, "manage_project_approval_rules", failing_manage)
+        projects = [make_project(mocker, project_id) for project_id in range(6)]
+
+        outputs = list(
+            reconcile_projects(projects, None, make_context(False, {}), concurrency=2)
+        )
+
+        assert len(outputs) == 6
+        assert outputs[3] == ["Failed to manage project 3: RuntimeError('boom')"]
+        assert outputs[4] == ["project 4"]
+
+    def test_in_flight_projects_are_bounded(self, mocker):
+        concurrency = 2
+        lock = threading.Lock()
+        running = 0
+        most_running = 0
+
+        def manage(project, rule_spec_manager, context, out):
+            nonlocal running, most_running
+            with lock:
+                running += 1
+                most_running = max(most_running, running)
+            time.sleep(0.005)
+            with lock:
+                running -= 1
+
+        mocker.patch.object(main, "manage_project_approval_rules", manage)
+        consumed = 0
+
+        def projects():
+            nonlocal consumed
+            for project_id in range(50):
+                consumed += 1
+                yield make_project(mocker, project_id)
+
+        results = reconcile_projects(
+            projects(), None, make_context(False, {}), concurrency=concurrency
+        )
+        for yielded, _ in enumerate(results, start=1):
+            # Projects are only taken from the listing as results are yielded
+            assert consumed - yielded <= 2 * concurrency
+
+        assert yielded == 50
+        assert most_running <= concurrency
+
+
+class TestArguments:
+    @pytest.mark.parametrize("concurrency", ["0", "-1"])
+    def test_concurrency_must_be_positive(self, concurrency, monkeypatch, capsys):
+        monkeypatch.setattr("sys.argv", ["main.py", "--concurrency", concurrency])
+
+        with pytest.raises(SystemExit):
+            main.main()
+
+        assert "--concurrency must be at least 1" in capsys.readouterr().err
@@ -0,0 +1,106 @@
+from types import SimpleNamespace
+
+import pytest
+
+from main import RuleSpecManager
+
+
+def make_spec(name):
+    return {
+        "name": name,
+        "approvals_required": 1,
+        "applies_to_all_protected_branches": True,
+        "users": [],
+    }
+
+
+APPROVAL_RULES = {
+    key: make_spec(key)
+    for key in ("default", "acme", "platform", "topic", "path", "id")
+}
+
+
+def make_manager(projects=None, approval_rules=APPROVAL_RULES):
+    manager = RuleSpecManager(None)
+    manager.config = {"approval_rules": approval_rules}
+    if projects is not None:
+        manager.config["projects"] = projects
+    manager.compile()
+    return manager
+
+
+def make_project(project_id=1, full_path="acme/platform/api", topics=()):
+    return SimpleNamespace(
+        id=project_id, path_with_namespace=full_path, topics=list(topics)
+    )
+
+
+def rule_names(manager, project):
+    return list(manager.specs_for_project(project))
+
+
+class TestRuleSpecManager:
+    def test_every_rule_applies_without_projects(self):
+        manager = make_manager()
+
+        assert rule_names(manager, make_project()) == list(APPROVAL_RULES)
+
+    def test_precedence(self):
+        manager = make_manager(
+            {
+                "default": {"approval_rules": ["default"]},
+                "acme": {"approval_rules": ["acme"]},
+                "acme/platform": {"approval_rules": ["platform"]},
+                "pci": {"topics": ["pci"], "approval_rules": ["topic"]},
+                "acme/platform/api": {"approval_rules": ["path"]},
+                1: {"approval_rules": ["id"]},
+            }
+        )
+
+        assert rule_names(manager, make_project(1, topics=["pci"])) == ["id"]
+        assert rule_names(manager, make_project(2, topics=["pci"])) == ["path"]
+        assert rule_names(manager, make_project(3, "acme/platform/db", ["pci"])) == [
+            "topic"
+        ]
+        assert rule_names(manager, make_project(4, "acme/platform/db")) == ["platform"]
+        assert rule_names(manager, make_project(5, "acme/db")) == ["acme"]
+        assert rule_names(manager, make_project(6, "other/db")) == ["default"]
+
+    def test_paths_are_case_insensitive(self):
+        manager = make_manager({"/Acme/Platform/": {"approval_rules": ["platform"]}})
+
+        assert rule_names(manager, make_project(1, "acme/PLATFORM/api")) == ["platform"]
+        assert rule_names(manager, make_project(2, "other/api")) == []
+
+    def test_first_matching_selector_wins(self):
+        manager = make_manager(
+            {
+                "pci": {"topics": ["pci"], "approval_rules": ["topic"]},
+                "any": {"topics": ["pci", "web"], "approval_rules": ["acme"]},
+            }
+        )
+
+        assert rule_names(manager, make_project(topics=["web", "pci"])) == ["topic"]
+        assert rule_names(manager, make_project(topics=["web"])) == ["acme"]
+
+    def test_empty_rules_remove_every_rule(self):
+        manager = make_manager(
+            {
+                "default": {"approval_rules": ["default"]},
+                "acme/platform/api": {"approval_rules": []},
+            }
+        )
+
+        assert rule_names(manager, make_project()) == []
+
+    def test_empty_entry(self):
+        with pytest.raises(ValueError, match="'acme/api' have no settings"):
+            make_manager({"acme/api": None})
+
+    def test_undefined_rule(self):
+        with pytest.raises(ValueError, match="isn't defined: missing"):
+            make_manager({"acme": {"approval_rules": ["missing"]}})
+
+    def test_duplicate_rule_names(self):
+        with pytest.raises(ValueError, match="same name as another rule"):
+            make_manager(approval_rules={"a": make_spec("x"), "b": make_spec("x")})
@@ -0,0 +1,111 @@
+import main
+from main import UserCache, resolve_users
+
+GITLAB_URL = "https://gitlab.com"
+
+
+def make_gitlab(mocker, users):
+    """A Gitlab whose GraphQL users query knows the given usernames."""
+    mock_gitlab = mocker.Mock(url=GITLAB_URL)
+
+    def http_post(path, post_data):
+        usernames = post_data["variables"]["usernames"]
+        nodes = [
+            {"id": f"gid://gitlab/User/{user_id}", "username": username}
+            for username, user_id in users.items()
+            if username in usernames
+        ]
+        return {"data": {"users": {"nodes": nodes}}}
+
+    mock_gitlab.http_post.side_effect = http_post
+    return mock_gitlab
+
+
+def make_group(mocker, members):
+    group = mocker.Mock()
+    group.name = "acme"
+    group.members_all.list.side_effect = lambda **kwargs: iter(
+        [mocker.Mock(id=user_id, username=username) for username, user_id in members]
+    )
+    return group
+
+
+class TestUserCache:
+    def test_entries_expire_after_the_ttl(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(main.time, "time", lambda: 1000.0)
+        UserCache(tmp_path / "users.json", 60, GITLAB_URL).save(
+            {"jane.doe": 3, "nobody": None}
+        )
+
+        cache = UserCache(tmp_path / "users.json", 60, GITLAB_URL)
+        assert cache.get(["jane.doe", "nobody", "john.smith"]) == {
+            "jane.doe": 3,
+            "nobody": None,
+        }
+
+        monkeypatch.setattr(main.time, "time", lambda: 1060.0)
+        assert cache.get(["jane.doe", "nobody"]) == {}
+
+    def test_entries_are_kept_per_gitlab_url(self, tmp_path):
+        UserCache(tmp_path / "users.json", 60, GITLAB_URL).save({"jane.doe": 3})
+
+        cache = UserCache(tmp_path / "users.json", 60, "https://gitlab.example.com")
+        assert cache.get(["jane.doe"]) == {}
+
+
+class TestResolveUsers:
+    def test_members_then_usernames(self, mocker, tmp_path, capsys):
+        mock_gitlab = make_gitlab(mocker, {"outsider": 9})
+        group = make_group(mocker, [("jane.doe", 3), ("john.smith", 4)])
+        cache = UserCache(tmp_path / "users.json", 60, GITLAB_URL)
+
+        user_ids = resolve_users(
+            mock_gitlab, group, {"jane.doe", "outsider", "nobody"}, cache
+        )
+
+        assert user_ids == {"jane.doe": 3, "outsider": 9}
+        # Only approvers that aren't members are looked up by username
+        (call,) = mock_gitlab.http_post.call_args_list
+        assert call.kwargs["post_data"]["variables"]["usernames"] == [
+            "nobody",
+            "outsider",
+        ]
+        out = capsys.readouterr().out
+        assert "aren't members of acme" in out and "['outsider']" in out
+        assert "not found" in out and "['nobody']" in out
+
+    def test_member_listing_stops_once_everyone_is_found(self, mocker, tmp_path):
+        mock_gitlab = make_gitlab(mocker, {})
+        members = iter([mocker.Mock(id=3, username="jane.doe"), None])
+        group = mocker.Mock()
+        group.members_all.list.return_value = members
+        cache = UserCache(tmp_path / "users.json", 60, GITLAB_URL)
+
+        assert resolve_users(mock_gitlab, group, {"jane.doe"}, cache) == {"jane.doe": 3}
+        # The second member was never read
+        assert next(members) is None
+        mock_gitlab.http_post.assert_not_called()
+
+    def test_cached_users_and_misses_skip_the_lookups(self, mocker, tmp_path):
+        mock_gitlab = make_gitlab(mocker, {})
+        group = make_group(mocker, [("jane.doe", 3)])
+        cache_file = tmp_path / "users.json"
+        resolve_users(
+            mock_gitlab,
+            group,
+            {"jane.doe", "nobody"},
+            UserCache(cache_file, 60, GITLAB_URL),
+        )
+        group.members_all.list.reset_mock()
+        mock_gitlab.http_post.reset_mock()
+
+        user_ids = resolve_users(
+            mock_gitlab,
+            group,
+            {"jane.doe", "nobody"},
+            UserCache(cache_file, 60, GITLAB_URL),
+        )
+
+        assert user_ids == {"jane.doe": 3}
+        group.members_all.list.assert_not_called()
+        mock_gitlab.http_post.assert_not_called()
@@ -0,0 +1,281 @@
+"""End-to-end throughput benchmarks against the local GitLab simulator.
+
+Every scenario runs the real tool in a subprocess against a freshly generated
+namespace and reports wall time, requests per project and the peak RSS of the
+tool. Run from the gitlab_config directory:
+
+    uv run python -m benchmarks.run --projects 10000 --latency 0.01
+    uv run python -m benchmarks.run --json results.json
+    uv run python -m benchmarks.run --baseline results.json
+
+With ``--baseline``, the exit code is 1 when a scenario is slower, makes more
+requests per project or uses more memory than the baseline allows.
+"""
+
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+from pathlib import Path
+from typing import Dict, List
+
+import yaml
+from prettytable import PrettyTable
+
+from benchmarks.simulator import (
+    APPROVAL_RULE_NAME,
+    COMPLIANT_SETTINGS,
+    ROOT_GROUP_ID,
+    ROOT_GROUP_PATH,
+    GitLabSimulator,
+)
+
+REPO_ROOT = Path(__file__).resolve().parents[2]
+
+GITLAB_CONFIG = [sys.executable, "-c", "from gitlab_config.main import app; app()"]
+
+# Scenario name -> (command, arguments). gitlab_config scenarios also get --concurrency.
+SCENARIOS = {
+    "groups-dry-run": (GITLAB_CONFIG, ["groups", "-r", ROOT_GROUP_PATH]),
+    "groups-graphql-dry-run": (
+        GITLAB_CONFIG,
+        ["groups", "-r", ROOT_GROUP_PATH, "--graphql"],
+    ),
+    "groups-fix": (GITLAB_CONFIG, ["groups", "-r", ROOT_GROUP_PATH, "--fix"]),
+    "approvers-dry-run": (
+        [sys.executable, str(REPO_ROOT / "gitlab_approvers" / "main.py")],
+        [],
+    ),
+    "prune-runners": ([sys.executable, str(REPO_ROOT / "prune_gitlab_runners.py")], []),
+}
+
+# Metrics compared against a baseline, all lower is better
+REGRESSION_METRICS = ("wall_time", "requests_per_project", "peak_rss_mb")
+
+
+def write_configs(directory: Path, gitlab_url: str) -> Dict[str, str]:
+    config = {
+        "GITLAB_URL": gitlab_url,
+        "default": {
+            **COMPLIANT_SETTINGS,
+            "merge_access_levels": "Developers + Maintainers",
+        },
+    }
+    config_file = directory / "config.yaml"
+    config_file.write_text(yaml.safe_dump(config))
+
+    approval_rules_file = directory / "approval_rules.yml"
+    approval_rules_file.write_text(
+        yaml.safe_dump(
+            {
+                "approval_rules": {
+                    "approvers": {
+                        "name": APPROVAL_RULE_NAME,
+                        "approvals_required": 1,
+                        "applies_to_all_protected_branches": True,
+                        "users": ["user-1", "user-2"],
+                    }
+                }
+            }
+        )
+    )
+
+    return {
+        "GITLAB_URL": gitlab_url,
+        "GITLAB_TOKEN": "benchmark-token",
+        "GITLAB_CONFIG_YAML_FILEPATH": str(config_file),
+        "GITLAB_APPROVAL_RULES_FILEPATH": str(approval_rules_file),
+        "GITLAB_PROJECT_ID": str(ROOT_GROUP_ID),
+    }
+
+
+def run_scenario(name: str, concurrency: int, args) -> Dict:
+    command, extra_args = SCENARIOS[name]
+    if command is GITLAB_CONFIG:
+        extra_args = [*extra_args, "--concurrency", str(concurrency)]
+
+    simulator = GitLabSimulator(
+        latency=args.latency,
+        rate_limit=args.rate_limit,
+        projects=args.projects,
+        subgroups=args.subgroups,
+        drift=args.drift,
+        seed=args.seed,
+    )
+    with simulator, tempfile.TemporaryDirectory() as directory:
+        env = {**os.environ, **write_configs(Path(directory), simulator.url)}
+
+        started = time.perf_counter()
+        process = subprocess.Popen(
+            [*command, *extra_args],
+            cwd=directory,
+            env=env,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+        )
+        stderr = process.stderr.read()
+        # wait4 reports the resource usage of this child alone
+        _, status, rusage = os.wait4(process.pid, 0)
+        wall_time = time.perf_counter() - started
+        process.returncode = os.waitstatus_to_exitcode(status)
+
+        stats = simulator.stats()
+
+    if process.returncode != 0:
+        print(stderr.decode()[-2000:], file=sys.stderr)
+
+    return {
+        "scenario": name,
+        "concurrency": concurrency,
+        "projects": args.projects,
+        "exit_code": process.returncode,
+        "wall_time": round(wall_time, 2),
+        "requests": stats["requests"],
+        "requests_per_project": round(stats["requests"] / args.projects, 2),
+        "writes": stats["writes"],
+        "throttled": stats["throttled"],
+        "mb_received": round(stats["bytes_sent"] / 1024**2, 1),
+        # ru_maxrss is in kilobytes on Linux
+        "peak_rss_mb": round(rusage.ru_maxrss / 1024, 1),
+        "endpoints": stats["endpoints"],
+    }
+
+
+def find_regressions(
+    results: List[Dict], baseline: List[Dict], tolerance: float
+) -> List[str]:
+    baseline_results = {
+        (result["scenario"], result["concurrency"]): result for result in baseline
+    }
+
+    regressions = []
+    for result in results:
+        previous = baseline_results.get((result["scenario"], result["concurrency"]))
+        if previous is None:
+            continue
+        for metric in REGRESSION_METRICS:
+            if result[metric] > previous[metric] * (1 + tolerance):
+                regressions.append(
+                    f"{result['scenario']} (concurrency {result['concurrency']}): "
+                    f"{metric} {previous[metric]} -> {result[metric]}"
+                )
+    return regressions
+
+
+def print_results(results: List[Dict]) -> None:
+    table = PrettyTable()
+    table.align = "l"
+    table.field_names = [
+        "scenario",
+        "concurrency",
+        "wall time (s)",
+        "requests",
+        "requests/project",
+        "writes",
+        "429s",
+        "MB received",
+        "peak RSS (MB)",
+        "exit code",
+    ]
+    for result in results:
+        table.add_row(
+            [
+                result["scenario"],
+                result["concurrency"],
+                result["wall_time"],
+                result["requests"],
+                result["requests_per_project"],
+                result["writes"],
+                result["throttled"],
+                result["mb_received"],
+                result["peak_rss_mb"],
+                result["exit_code"],
+            ]
+        )
+    print(table)
+
+
+def parse_args(args: List[str]):
+    parser = ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--projects", type=int, default=10_000)
+    parser.add_argument("--subgroups", type=int, default=50)
+    parser.add_argument(
+        "--drift",
+        type=float,
+        default=0.2,
+        help="Share of projects that don't match the config",
+    )
+    parser.add_argument(
+        "--latency",
+        type=float,
+        default=0.005,
+        help="Seconds added to every request",
+    )
+    parser.add_argument(
+        "--rate-limit",
+        type=int,
+        help="Requests per minute before the simulator answers with a 429",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--concurrency",
+        type=lambda value: [int(c) for c in value.split(",")],
+        default=[1, 8],
+        help="Comma separated --concurrency values to run the gitlab-config scenarios with",
+    )
+    parser.add_argument(
+        "--scenario",
+        dest="scenarios",
+        action="append",
+        choices=SCENARIOS,
+        help="Scenario to run, can be repeated. Defaults to all of them.",
+    )
+    parser.add_argument("--json", dest="json_file", help="Write the results to a file")
+    parser.add_argument(
+        "--baseline", help="Results file from a previous run to compare against"
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.2,
+        help="Allowed increase over the baseline before it counts as a regression",
+    )
+    return parser.parse_args(args)
+
+
+def main(args: List[str] | None = None) -> int:
+    args = parse_args(sys.argv[1:] if args is None else args)
+
+    results = []
+    for name in args.scenarios or SCENARIOS:
+        command, _ = SCENARIOS[name]
+        concurrencies = args.concurrency if command is GITLAB_CONFIG else [1]
+        for concurrency in concurrencies:
+            print(f"Running {name} with concurrency {concurrency}", file=sys.stderr)
+            results.append(run_scenario(name, concurrency, args))
+
+    print_results(results)
+
+    if args.json_file:
+        with open(args.json_file, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if any(result["exit_code"] != 0 for result in results):
+        return 1
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = find_regressions(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION: {regression}", file=sys.stderr)
+        if regressions:
+            return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
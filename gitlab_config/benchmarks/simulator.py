@@ -0,0 +1,973 @@
+"""A local stand-in for the subset of the GitLab API used in this repository.
+
+Covers what gitlab_config, gitlab_approvers and prune_gitlab_runners.py call:
+groups and their projects, members and descendants, project settings, push
+rules, protected branches, approval rules, runners, and the GraphQL
+``projects`` and ``users`` queries. The namespace is generated from a seed so
+every run of a benchmark sees the same projects with the same drift.
+
+    with GitLabSimulator(projects=10_000, latency=0.01) as simulator:
+        ...  # point GITLAB_URL at simulator.url
+        print(simulator.stats())
+"""
+
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List
+from urllib.parse import parse_qsl, unquote, urlencode, urlsplit
+
+ROOT_GROUP_ID = 1000
+ROOT_GROUP_PATH = "bench"
+
+# Keys starting with "__" hold a project's sub-resources and are never
+# serialised. Settings every compliant project has. Drifted projects get the values in
+# DRIFTED_SETTINGS instead.
+COMPLIANT_SETTINGS = {
+    "squash_option": "default_on",
+    "remove_source_branch_after_merge": True,
+    "merge_method": "ff",
+    "only_allow_merge_if_pipeline_succeeds": True,
+    "merge_requests_template": "### Objective\n\n### Changes\n",
+    "prevent_secrets": True,
+}
+DRIFTED_SETTINGS = {
+    "squash_option": "default_off",
+    "remove_source_branch_after_merge": False,
+    "merge_method": "merge",
+    "only_allow_merge_if_pipeline_succeeds": False,
+    "merge_requests_template": None,
+    "prevent_secrets": False,
+}
+PUSH_RULE_SETTINGS = {"prevent_secrets"}
+
+ACCESS_LEVEL_DESCRIPTIONS = {
+    0: "No one",
+    30: "Developers + Maintainers",
+    40: "Maintainers",
+    60: "Admins",
+}
+
+APPROVAL_RULE_NAME = "Approvers"
+
+
+def _bool(value: str | None) -> bool | None:
+    if value is None:
+        return None
+    return value.lower() in ("true", "1")
+
+
+def _access_level(level: int, level_id: int) -> Dict:
+    return {
+        "id": level_id,
+        "access_level": level,
+        "access_level_description": ACCESS_LEVEL_DESCRIPTIONS.get(level, str(level)),
+        "user_id": None,
+        "group_id": None,
+    }
+
+
+class SimulatedGitLab:
+    """The data behind the simulator, plus per-endpoint request accounting."""
+
+    def __init__(
+        self,
+        projects: int = 10_000,
+        subgroups: int = 50,
+        drift: float = 0.2,
+        members: int = 200,
+        runners: int = 100,
+        seed: int = 0,
+    ):
+        self.lock = threading.RLock()
+        self.requests = Counter()
+        self.bytes_sent = 0
+        self.throttled = 0
+        self._next_id = 1
+
+        rng = random.Random(seed)
+        now = datetime.now(timezone.utc)
+
+        self.groups = {
+            ROOT_GROUP_ID: self._group(ROOT_GROUP_ID, ROOT_GROUP_PATH, None),
+        }
+        for i in range(1, subgroups + 1):
+            group_id = ROOT_GROUP_ID + i
+            self.groups[group_id] = self._group(
+                group_id, f"{ROOT_GROUP_PATH}/team-{i:03d}", ROOT_GROUP_ID
+            )
+        group_ids = list(self.groups)
+        # Protected branches of top-level groups, inherited by all their projects
+        self.group_protected_branches: Dict[int, Dict[str, Dict]] = {}
+
+        self.projects = {}
+        for project_id in range(1, projects + 1):
+            group = self.groups[group_ids[project_id % len(group_ids)]]
+            drifted = rng.random() < drift
+            settings = DRIFTED_SETTINGS if drifted else COMPLIANT_SETTINGS
+            last_activity_at = now - timedelta(minutes=rng.randrange(60 * 24 * 365))
+            self.projects[project_id] = self._project(
+                project_id, group, settings, last_activity_at
+            )
+            self.projects[project_id]["__protected_branches"] = {
+                "main": self._protected_branch(merge_level=40 if drifted else 30)
+            }
+            self.projects[project_id]["__approval_rules"] = [
+                {
+                    "id": self._id(),
+                    "name": APPROVAL_RULE_NAME,
+                    "rule_type": "regular",
+                    "approvals_required": 0 if drifted else 1,
+                    "applies_to_all_protected_branches": True,
+                    "users": [],
+                    "groups": [],
+                    "protected_branches": [],
+                }
+            ]
+        self.projects_by_path = {
+            project["path_with_namespace"]: project
+            for project in self.projects.values()
+        }
+
+        self.members = [
+            {
+                "id": user_id,
+                "username": f"user-{user_id}",
+                "name": f"User {user_id}",
+                "state": "active",
+                "access_level": 30,
+            }
+            for user_id in range(1, members + 1)
+        ]
+        self.runners = {
+            runner_id: {
+                "id": runner_id,
+                "description": f"runner-{runner_id}",
+                "status": "online" if runner_id % 3 else "offline",
+                "active": True,
+                "is_shared": False,
+            }
+            for runner_id in range(1, runners + 1)
+        }
+
+    def _id(self) -> int:
+        with self.lock:
+            self._next_id += 1
+            return self._next_id
+
+    def _group(self, group_id: int, full_path: str, parent_id: int | None) -> Dict:
+        return {
+            "id": group_id,
+            "name": full_path.rsplit("/", 1)[-1],
+            "path": full_path.rsplit("/", 1)[-1],
+            "full_path": full_path,
+            "full_name": full_path.replace("/", " / "),
+            "parent_id": parent_id,
+            "visibility": "private",
+            "web_url": f"https://gitlab.example.com/groups/{full_path}",
+        }
+
+    def _project(
+        self, project_id: int, group: Dict, settings: Dict, last_activity_at: datetime
+    ) -> Dict:
+        path = f"project-{project_id:05d}"
+        full_path = f"{group['full_path']}/{path}"
+        project = {
+            "id": project_id,
+            "name": path,
+            "path": path,
+            "path_with_namespace": full_path,
+            "name_with_namespace": f"{group['full_name']} / {path}",
+            "description": f"Synthetic project {project_id}",
+            "default_branch": "main",
+            "visibility": ("private", "internal", "public")[project_id % 3],
+            "topics": ["pci"] if project_id % 10 == 0 else [],
+            "archived": project_id % 50 == 0,
+            "merge_requests_enabled": project_id % 20 != 0,
+            "created_at": "2020-01-01T00:00:00.000Z",
+            "last_activity_at": last_activity_at.isoformat(),
+            "web_url": f"https://gitlab.example.com/{full_path}",
+            "http_url_to_repo": f"https://gitlab.example.com/{full_path}.git",
+            "ssh_url_to_repo": f"git@gitlab.example.com:{full_path}.git",
+            "namespace": {
+                "id": group["id"],
+                "name": group["name"],
+                "path": group["path"],
+                "kind": "group",
+                "full_path": group["full_path"],
+                "parent_id": group["parent_id"],
+            },
+            "_links": {
+                "self": f"https://gitlab.example.com/api/v4/projects/{project_id}",
+                "merge_requests": f"https://gitlab.example.com/api/v4/projects/{project_id}/merge_requests",
+                "repo_branches": f"https://gitlab.example.com/api/v4/projects/{project_id}/repository/branches",
+            },
+        }
+        for key, value in settings.items():
+            if key not in PUSH_RULE_SETTINGS:
+                project[key] = value
+        project["__push_rule"] = {
+            "id": project_id,
+            "project_id": project_id,
+            "created_at": "2020-01-01T00:00:00.000Z",
+            "commit_message_regex": None,
+            "deny_delete_tag": False,
+            "member_check": False,
+            "prevent_secrets": settings["prevent_secrets"],
+        }
+        return project
+
+    def _protected_branch(
+        self, merge_level: int, push_level: int = 0, allow_force_push: bool = False
+    ) -> Dict:
+        return {
+            "id": self._id(),
+            "merge_access_levels": [_access_level(merge_level, self._id())],
+            "push_access_levels": [_access_level(push_level, self._id())],
+            "allow_force_push": allow_force_push,
+            "code_owner_approval_required": False,
+        }
+
+    def descendants(self, group_id: int) -> List[Dict]:
+        children = [
+            group for group in self.groups.values() if group["parent_id"] == group_id
+        ]
+        result = []
+        for child in children:
+            result.append(child)
+            result.extend(self.descendants(child["id"]))
+        return result
+
+    def public_project(self, project: Dict, simple: bool = False) -> Dict:
+        if simple:
+            keys = (
+                "id",
+                "name",
+                "path",
+                "path_with_namespace",
+                "name_with_namespace",
+                "description",
+                "default_branch",
+                "topics",
+                "created_at",
+                "last_activity_at",
+                "web_url",
+                "http_url_to_repo",
+                "ssh_url_to_repo",
+                "namespace",
+            )
+            return {key: project[key] for key in keys}
+        return {
+            key: value for key, value in project.items() if not key.startswith("__")
+        }
+
+    def top_level_group_id(self, group_id: int) -> int:
+        while self.groups[group_id]["parent_id"] is not None:
+            group_id = self.groups[group_id]["parent_id"]
+        return group_id
+
+    def protected_branches(self, project: Dict) -> Dict[str, Dict]:
+        """The project's protected branches, group protections taking precedence."""
+        group_id = self.top_level_group_id(project["namespace"]["id"])
+        inherited = {
+            name: {**branch, "inherited": True}
+            for name, branch in self.group_protected_branches.get(group_id, {}).items()
+        }
+        return {**project["__protected_branches"], **inherited}
+
+    def protected_branch(self, project: Dict, name: str) -> Dict:
+        return {"name": name, **self.protected_branches(project)[name]}
+
+    def graphql_node(self, project: Dict) -> Dict:
+        def connection(levels):
+            return {
+                "nodes": [
+                    {
+                        "accessLevel": level["access_level"],
+                        "accessLevelDescription": level["access_level_description"],
+                    }
+                    for level in levels
+                ]
+            }
+
+        return {
+            "id": f"gid://gitlab/Project/{project['id']}",
+            "name": project["name"],
+            "path": project["path"],
+            "fullPath": project["path_with_namespace"],
+            "removeSourceBranchAfterMerge": project["remove_source_branch_after_merge"],
+            "onlyAllowMergeIfPipelineSucceeds": project[
+                "only_allow_merge_if_pipeline_succeeds"
+            ],
+            "repository": {"rootRef": project["default_branch"]},
+            "branchRules": {
+                "nodes": [
+                    {
+                        "name": name,
+                        "branchProtection": {
+                            "allowForcePush": branch["allow_force_push"],
+                            "mergeAccessLevels": connection(
+                                branch["merge_access_levels"]
+                            ),
+                            "pushAccessLevels": connection(
+                                branch["push_access_levels"]
+                            ),
+                        },
+                    }
+                    for name, branch in self.protected_branches(project).items()
+                ]
+            },
+        }
+
+    def drifted_project_ids(self) -> List[int]:
+        """Projects that don't match COMPLIANT_SETTINGS."""
+        drifted = []
+        for project_id, project in self.projects.items():
+            settings = {**project, **project["__push_rule"]}
+            branch = self.protected_branches(project).get(project["default_branch"])
+            if any(
+                settings[key] != value for key, value in COMPLIANT_SETTINGS.items()
+            ) or (
+                branch is None
+                or [level["access_level"] for level in branch["merge_access_levels"]]
+                != [30]
+            ):
+                drifted.append(project_id)
+        return drifted
+
+
+class SimulatorHandler(BaseHTTPRequestHandler):
+    # Keep-alive, like a real GitLab behind a load balancer. Headers and body
+    # are buffered into one write so Nagle doesn't add a delayed-ACK stall.
+    protocol_version = "HTTP/1.1"
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        self.handle_api("GET")
+
+    def do_POST(self):
+        self.handle_api("POST")
+
+    def do_PUT(self):
+        self.handle_api("PUT")
+
+    def do_PATCH(self):
+        self.handle_api("PATCH")
+
+    def do_DELETE(self):
+        self.handle_api("DELETE")
+
+    def log_message(self, format, *args):
+        pass
+
+    def handle_api(self, method: str) -> None:
+        server: GitLabSimulator = self.server
+        gitlab = server.gitlab
+
+        url = urlsplit(self.path)
+        self.query = dict(parse_qsl(url.query))
+        length = int(self.headers.get("Content-Length") or 0)
+        raw_body = self.rfile.read(length) if length else b""
+        try:
+            self.body = json.loads(raw_body) if raw_body else {}
+        except json.JSONDecodeError:
+            self.body = dict(parse_qsl(raw_body.decode()))
+
+        template, handler, params = server.route(method, url.path)
+        with gitlab.lock:
+            gitlab.requests[f"{method} {template}"] += 1
+
+        if server.latency:
+            time.sleep(server.latency)
+
+        if not (self.headers.get("PRIVATE-TOKEN") or self.headers.get("Authorization")):
+            self.respond(401, {"message": "401 Unauthorized"})
+            return
+
+        rate_limit_headers = server.take_rate_limit_token()
+        if rate_limit_headers.get("Retry-After"):
+            with gitlab.lock:
+                gitlab.throttled += 1
+            self.respond(429, {"message": "Retry later"}, rate_limit_headers)
+            return
+
+        if handler is None:
+            self.respond(404, {"message": "404 Not Found"}, rate_limit_headers)
+            return
+
+        with gitlab.lock:
+            try:
+                status, payload, headers = handler(self, gitlab, **params)
+            except KeyError:
+                status, payload, headers = 404, {"message": "404 Not found"}, {}
+        self.respond(status, payload, {**rate_limit_headers, **headers})
+
+    def respond(self, status: int, payload, headers: Dict | None = None) -> None:
+        body = b"" if payload is None else json.dumps(payload).encode()
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, str(value))
+        if payload is not None:
+            self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        with self.server.gitlab.lock:
+            self.server.gitlab.bytes_sent += len(body)
+
+    def paginate(self, items: List, path: str) -> tuple[List, Dict]:
+        """Keyset or offset pagination with the Link headers python-gitlab follows."""
+        query = self.query
+        per_page = min(int(query.get("per_page", 20)), 100)
+        base_url = f"http://{self.headers['Host']}{path}"
+
+        if query.get("pagination") == "keyset":
+            id_after = int(query.get("id_after", 0))
+            items = sorted(items, key=lambda item: item["id"])
+            remaining = [item for item in items if item["id"] > id_after]
+            page = remaining[:per_page]
+            headers = {}
+            if len(remaining) > per_page:
+                next_query = {**query, "id_after": page[-1]["id"]}
+                headers["Link"] = f'<{base_url}?{urlencode(next_query)}>; rel="next"'
+            return page, headers
+
+        page_number = int(query.get("page", 1))
+        start = (page_number - 1) * per_page
+        page = items[start : start + per_page]
+        total_pages = max(1, -(-len(items) // per_page))
+        headers = {
+            "X-Page": page_number,
+            "X-Per-Page": per_page,
+            "X-Total": len(items),
+            "X-Total-Pages": total_pages,
+        }
+        if page_number < total_pages:
+            next_query = {**query, "page": page_number + 1}
+            headers["X-Next-Page"] = page_number + 1
+            headers["Link"] = f'<{base_url}?{urlencode(next_query)}>; rel="next"'
+        return page, headers
+
+    # Groups
+
+    def get_group(self, gitlab, group):
+        return 200, gitlab.groups[self.lookup_group(gitlab, group)], {}
+
+    def list_group_projects(self, gitlab, group):
+        group_id = self.lookup_group(gitlab, group)
+        query = self.query
+        group_ids = {group_id}
+        if _bool(query.get("include_subgroups")):
+            group_ids |= {child["id"] for child in gitlab.descendants(group_id)}
+
+        archived = _bool(query.get("archived"))
+        merge_requests = _bool(query.get("with_merge_requests_enabled"))
+        last_activity_after = query.get("last_activity_after")
+        search = query.get("search", "").lower()
+
+        projects = []
+        for project in gitlab.projects.values():
+            if project["namespace"]["id"] not in group_ids:
+                continue
+            if archived is not None and project["archived"] != archived:
+                continue
+            if merge_requests and not project["merge_requests_enabled"]:
+                continue
+            if "visibility" in query and project["visibility"] != query["visibility"]:
+                continue
+            if "topic" in query and query["topic"] not in project["topics"]:
+                continue
+            if search and search not in project["path"]:
+                continue
+            if last_activity_after and datetime.fromisoformat(
+                project["last_activity_at"]
+            ) <= datetime.fromisoformat(last_activity_after):
+                continue
+            projects.append(project)
+
+        page, headers = self.paginate(projects, urlsplit(self.path).path)
+        simple = _bool(query.get("simple"))
+        return 200, [gitlab.public_project(p, simple) for p in page], headers
+
+    def list_descendant_groups(self, gitlab, group):
+        groups = gitlab.descendants(self.lookup_group(gitlab, group))
+        page, headers = self.paginate(groups, urlsplit(self.path).path)
+        return 200, page, headers
+
+    def list_subgroups(self, gitlab, group):
+        group_id = self.lookup_group(gitlab, group)
+        groups = [g for g in gitlab.groups.values() if g["parent_id"] == group_id]
+        page, headers = self.paginate(groups, urlsplit(self.path).path)
+        return 200, page, headers
+
+    def group_protections(self, gitlab, group) -> Dict[str, Dict]:
+        group_id = self.lookup_group(gitlab, group)
+        if gitlab.groups[group_id]["parent_id"] is not None:
+            # Only top-level groups can protect branches
+            raise KeyError(group)
+        return gitlab.group_protected_branches.setdefault(group_id, {})
+
+    def list_group_protected_branches(self, gitlab, group):
+        branches = [
+            {"name": name, **branch}
+            for name, branch in self.group_protections(gitlab, group).items()
+        ]
+        page, headers = self.paginate(branches, urlsplit(self.path).path)
+        return 200, page, headers
+
+    def get_group_protected_branch(self, gitlab, group, name):
+        return 200, {"name": name, **self.group_protections(gitlab, group)[name]}, {}
+
+    def create_group_protected_branch(self, gitlab, group):
+        status, branch = self.create_protection(
+            gitlab, self.group_protections(gitlab, group)
+        )
+        return status, branch, {}
+
+    def update_group_protected_branch(self, gitlab, group, name):
+        branch = self.group_protections(gitlab, group)[name]
+        self.update_protection(gitlab, branch)
+        return 200, {"name": name, **branch}, {}
+
+    def list_members(self, gitlab, group):
+        self.lookup_group(gitlab, group)
+        page, headers = self.paginate(gitlab.members, urlsplit(self.path).path)
+        return 200, page, headers
+
+    def lookup_group(self, gitlab, group: str) -> int:
+        if group.isdigit():
+            return gitlab.groups[int(group)]["id"]
+        for candidate in gitlab.groups.values():
+            if candidate["full_path"] == group:
+                return candidate["id"]
+        raise KeyError(group)
+
+    # Projects
+
+    def lookup_project(self, gitlab, project: str) -> Dict:
+        if project.isdigit():
+            return gitlab.projects[int(project)]
+        return gitlab.projects_by_path[project]
+
+    def get_project(self, gitlab, project):
+        return 200, gitlab.public_project(self.lookup_project(gitlab, project)), {}
+
+    def update_project(self, gitlab, project):
+        project = self.lookup_project(gitlab, project)
+        for key, value in self.body.items():
+            if key in project and not key.startswith("__"):
+                project[key] = value
+        return 200, gitlab.public_project(project), {}
+
+    def get_push_rule(self, gitlab, project):
+        return 200, self.lookup_project(gitlab, project)["__push_rule"], {}
+
+    def update_push_rule(self, gitlab, project):
+        push_rule = self.lookup_project(gitlab, project)["__push_rule"]
+        push_rule.update(self.body)
+        return 200, push_rule, {}
+
+    def list_protected_branches(self, gitlab, project):
+        project = self.lookup_project(gitlab, project)
+        branches = [
+            gitlab.protected_branch(project, name)
+            for name in gitlab.protected_branches(project)
+        ]
+        page, headers = self.paginate(branches, urlsplit(self.path).path)
+        return 200, page, headers
+
+    def get_protected_branch(self, gitlab, project, name):
+        return (
+            200,
+            gitlab.protected_branch(self.lookup_project(gitlab, project), name),
+            {},
+        )
+
+    def create_protected_branch(self, gitlab, project):
+        project = self.lookup_project(gitlab, project)
+        status, branch = self.create_protection(gitlab, project["__protected_branches"])
+        if status != 201:
+            return status, branch, {}
+        return 201, gitlab.protected_branch(project, self.body["name"]), {}
+
+    def update_protected_branch(self, gitlab, project, name):
+        project = self.lookup_project(gitlab, project)
+        self.update_protection(gitlab, project["__protected_branches"][name])
+        return 200, gitlab.protected_branch(project, name), {}
+
+    def create_protection(self, gitlab, branches: Dict[str, Dict]) -> tuple[int, Dict]:
+        name = self.body["name"]
+        if name in branches:
+            return 409, {"message": "Protected branch already exists"}
+
+        def level(key, allowed_key):
+            if key in self.body:
+                return int(self.body[key])
+            allowed = self.body.get(allowed_key) or []
+            return allowed[0]["access_level"] if allowed else 40
+
+        branches[name] = gitlab._protected_branch(
+            merge_level=level("merge_access_level", "allowed_to_merge"),
+            push_level=level("push_access_level", "allowed_to_push"),
+            allow_force_push=bool(self.body.get("allow_force_push", False)),
+        )
+        return 201, {"name": name, **branches[name]}
+
+    def update_protection(self, gitlab, branch: Dict) -> None:
+        for key, levels_key in (
+            ("allowed_to_merge", "merge_access_levels"),
+            ("allowed_to_push", "push_access_levels"),
+        ):
+            for change in self.body.get(key) or []:
+                if change.get("_destroy"):
+                    branch[levels_key] = [
+                        level
+                        for level in branch[levels_key]
+                        if level["id"] != change["id"]
+                    ]
+                elif "access_level" in change:
+                    branch[levels_key].append(
+                        _access_level(change["access_level"], gitlab._id())
+                    )
+        if "allow_force_push" in self.body:
+            branch["allow_force_push"] = bool(self.body["allow_force_push"])
+
+    def delete_protected_branch(self, gitlab, project, name):
+        del self.lookup_project(gitlab, project)["__protected_branches"][name]
+        return 204, None, {}
+
+    def list_approval_rules(self, gitlab, project):
+        rules = self.lookup_project(gitlab, project)["__approval_rules"]
+        page, headers = self.paginate(rules, urlsplit(self.path).path)
+        return 200, page, headers
+
+    def approval_rule_users(self, gitlab, user_ids: List[int]) -> List[Dict]:
+        members = {member["id"]: member for member in gitlab.members}
+        return [
+            {"id": user_id, "username": members[user_id]["username"]}
+            for user_id in user_ids
+            if user_id in members
+        ]
+
+    def create_approval_rule(self, gitlab, project):
+        project = self.lookup_project(gitlab, project)
+        rule = {
+            "id": gitlab._id(),
+            "name": self.body["name"],
+            "rule_type": "regular",
+            "approvals_required": int(self.body.get("approvals_required", 0)),
+            "applies_to_all_protected_branches": bool(
+                self.body.get("applies_to_all_protected_branches", True)
+            ),
+            "users": self.approval_rule_users(gitlab, self.body.get("user_ids", [])),
+            "groups": [],
+            "protected_branches": [],
+        }
+        project["__approval_rules"].append(rule)
+        return 201, rule, {}
+
+    def update_approval_rule(self, gitlab, project, rule_id):
+        rules = self.lookup_project(gitlab, project)["__approval_rules"]
+        rule = {rule["id"]: rule for rule in rules}[int(rule_id)]
+        for key in ("name", "approvals_required", "applies_to_all_protected_branches"):
+            if key in self.body:
+                rule[key] = self.body[key]
+        user_ids = self.body.get("user_ids", self.body.get("users"))
+        if user_ids is not None:
+            rule["users"] = self.approval_rule_users(
+                gitlab,
+                [user if isinstance(user, int) else user["id"] for user in user_ids],
+            )
+        return 200, rule, {}
+
+    def delete_approval_rule(self, gitlab, project, rule_id):
+        project = self.lookup_project(gitlab, project)
+        project["__approval_rules"] = [
+            rule for rule in project["__approval_rules"] if rule["id"] != int(rule_id)
+        ]
+        return 204, None, {}
+
+    # Runners
+
+    def list_runners(self, gitlab):
+        page, headers = self.paginate(
+            list(gitlab.runners.values()), urlsplit(self.path).path
+        )
+        return 200, page, headers
+
+    def delete_runner(self, gitlab, runner_id):
+        del gitlab.runners[int(runner_id)]
+        return 204, None, {}
+
+    # GraphQL
+
+    def graphql(self, gitlab):
+        variables = self.body.get("variables") or {}
+        if "usernames" in variables:
+            return 200, {"data": {"users": {"nodes": self.graphql_users(gitlab)}}}, {}
+
+        projects = []
+        for gid in variables.get("ids") or []:
+            project = gitlab.projects.get(int(gid.rsplit("/", 1)[-1]))
+            if project is not None:
+                projects.append(project)
+        for full_path in variables.get("fullPaths") or []:
+            project = gitlab.projects_by_path.get(full_path)
+            if project is not None:
+                projects.append(project)
+
+        first = int(variables.get("first") or 100)
+        nodes = [gitlab.graphql_node(project) for project in projects[:first]]
+        return 200, {"data": {"projects": {"nodes": nodes}}}, {}
+
+    def graphql_users(self, gitlab) -> List[Dict]:
+        variables = self.body["variables"]
+        usernames = set(variables["usernames"])
+        first = int(variables.get("first") or 100)
+        return [
+            {"id": f"gid://gitlab/User/{member['id']}", "username": member["username"]}
+            for member in gitlab.members
+            if member["username"] in usernames
+        ][:first]
+
+
+# (method, path pattern, endpoint template, handler). Patterns match the raw
+# path, so URL-encoded full paths stay a single segment.
+ROUTES = [
+    ("GET", r"/api/v4/groups/(?P<group>[^/]+)", "/groups/:id", "get_group"),
+    (
+        "GET",
+        r"/api/v4/groups/(?P<group>[^/]+)/projects",
+        "/groups/:id/projects",
+        "list_group_projects",
+    ),
+    (
+        "GET",
+        r"/api/v4/groups/(?P<group>[^/]+)/descendant_groups",
+        "/groups/:id/descendant_groups",
+        "list_descendant_groups",
+    ),
+    (
+        "GET",
+        r"/api/v4/groups/(?P<group>[^/]+)/subgroups",
+        "/groups/:id/subgroups",
+        "list_subgroups",
+    ),
+    (
+        "GET",
+        r"/api/v4/groups/(?P<group>[^/]+)/protected_branches",
+        "/groups/:id/protected_branches",
+        "list_group_protected_branches",
+    ),
+    (
+        "POST",
+        r"/api/v4/groups/(?P<group>[^/]+)/protected_branches",
+        "/groups/:id/protected_branches",
+        "create_group_protected_branch",
+    ),
+    (
+        "GET",
+        r"/api/v4/groups/(?P<group>[^/]+)/protected_branches/(?P<name>[^/]+)",
+        "/groups/:id/protected_branches/:name",
+        "get_group_protected_branch",
+    ),
+    (
+        "PATCH",
+        r"/api/v4/groups/(?P<group>[^/]+)/protected_branches/(?P<name>[^/]+)",
+        "/groups/:id/protected_branches/:name",
+        "update_group_protected_branch",
+    ),
+    (
+        "GET",
+        r"/api/v4/groups/(?P<group>[^/]+)/members",
+        "/groups/:id/members",
+        "list_members",
+    ),
+    (
+        "GET",
+        r"/api/v4/groups/(?P<group>[^/]+)/members/all",
+        "/groups/:id/members/all",
+        "list_members",
+    ),
+    ("GET", r"/api/v4/projects/(?P<project>[^/]+)", "/projects/:id", "get_project"),
+    ("PUT", r"/api/v4/projects/(?P<project>[^/]+)", "/projects/:id", "update_project"),
+    (
+        "GET",
+        r"/api/v4/projects/(?P<project>[^/]+)/push_rule",
+        "/projects/:id/push_rule",
+        "get_push_rule",
+    ),
+    (
+        "PUT",
+        r"/api/v4/projects/(?P<project>[^/]+)/push_rule",
+        "/projects/:id/push_rule",
+        "update_push_rule",
+    ),
+    (
+        "GET",
+        r"/api/v4/projects/(?P<project>[^/]+)/protected_branches",
+        "/projects/:id/protected_branches",
+        "list_protected_branches",
+    ),
+    (
+        "POST",
+        r"/api/v4/projects/(?P<project>[^/]+)/protected_branches",
+        "/projects/:id/protected_branches",
+        "create_protected_branch",
+    ),
+    (
+        "GET",
+        r"/api/v4/projects/(?P<project>[^/]+)/protected_branches/(?P<name>[^/]+)",
+        "/projects/:id/protected_branches/:name",
+        "get_protected_branch",
+    ),
+    (
+        "PATCH",
+        r"/api/v4/projects/(?P<project>[^/]+)/protected_branches/(?P<name>[^/]+)",
+        "/projects/:id/protected_branches/:name",
+        "update_protected_branch",
+    ),
+    (
+        "DELETE",
+        r"/api/v4/projects/(?P<project>[^/]+)/protected_branches/(?P<name>[^/]+)",
+        "/projects/:id/protected_branches/:name",
+        "delete_protected_branch",
+    ),
+    (
+        "GET",
+        r"/api/v4/projects/(?P<project>[^/]+)/approval_rules",
+        "/projects/:id/approval_rules",
+        "list_approval_rules",
+    ),
+    (
+        "POST",
+        r"/api/v4/projects/(?P<project>[^/]+)/approval_rules",
+        "/projects/:id/approval_rules",
+        "create_approval_rule",
+    ),
+    (
+        "PUT",
+        r"/api/v4/projects/(?P<project>[^/]+)/approval_rules/(?P<rule_id>\d+)",
+        "/projects/:id/approval_rules/:rule_id",
+        "update_approval_rule",
+    ),
+    (
+        "DELETE",
+        r"/api/v4/projects/(?P<project>[^/]+)/approval_rules/(?P<rule_id>\d+)",
+        "/projects/:id/approval_rules/:rule_id",
+        "delete_approval_rule",
+    ),
+    ("GET", r"/api/v4/runners", "/runners", "list_runners"),
+    ("DELETE", r"/api/v4/runners/(?P<runner_id>\d+)", "/runners/:id", "delete_runner"),
+    ("POST", r"/api/graphql", "/graphql", "graphql"),
+]
+
+
+class GitLabSimulator(ThreadingHTTPServer):
+    """Serves a SimulatedGitLab on a local port, in a background thread.
+
+    ``latency`` is added to every request. With ``rate_limit`` set, requests
+    beyond ``rate_limit`` per ``rate_limit_window`` seconds get a 429 and every
+    response carries GitLab's ``RateLimit-*`` headers.
+    """
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        latency: float = 0.0,
+        rate_limit: int | None = None,
+        rate_limit_window: float = 60.0,
+        **namespace,
+    ):
+        super().__init__(("127.0.0.1", 0), SimulatorHandler)
+        self.gitlab = SimulatedGitLab(**namespace)
+        self.latency = latency
+        self.rate_limit = rate_limit
+        self.rate_limit_window = rate_limit_window
+        self._window_started = time.time()
+        self._window_used = 0
+        self._thread = None
+        self._routes = [
+            (
+                method,
+                re.compile(pattern + "$"),
+                template,
+                getattr(SimulatorHandler, name),
+            )
+            for method, pattern, template, name in ROUTES
+        ]
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def route(self, method: str, path: str):
+        for route_method, pattern, template, handler in self._routes:
+            if route_method != method:
+                continue
+            match = pattern.match(path)
+            if match:
+                params = {
+                    key: unquote(value) for key, value in match.groupdict().items()
+                }
+                return template, handler, params
+        return "<unmatched>", None, {}
+
+    def take_rate_limit_token(self) -> Dict:
+        if self.rate_limit is None:
+            return {}
+
+        with self.gitlab.lock:
+            now = time.time()
+            if now - self._window_started >= self.rate_limit_window:
+                self._window_started, self._window_used = now, 0
+            self._window_used += 1
+            remaining = self.rate_limit - self._window_used
+            reset = self._window_started + self.rate_limit_window
+
+        headers = {
+            "RateLimit-Limit": self.rate_limit,
+            "RateLimit-Remaining": max(remaining, 0),
+            "RateLimit-Reset": int(reset),
+        }
+        if remaining < 0:
+            headers["Retry-After"] = max(1, int(reset - now))
+        return headers
+
+    def stats(self) -> Dict:
+        with self.gitlab.lock:
+            requests = dict(self.gitlab.requests)
+            return {
+                "requests": sum(requests.values()),
+                "writes": sum(
+                    count
+                    for endpoint, count in requests.items()
+                    if not endpoint.startswith("GET ") and endpoint != "POST /graphql"
+                ),
+                "throttled": self.gitlab.throttled,
+                "bytes_sent": self.gitlab.bytes_sent,
+                "endpoints": requests,
+            }
+
+    def start(self) -> "GitLabSimulator":
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self) -> "GitLabSimulator":
+        return self.start()
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
@@ -1,10 +1,44 @@
 import argparse
-from argparse import ArgumentParser
+from argparse import ArgumentParser, ArgumentTypeError
+from datetime import datetime
 from typing import List
 
+from gitlab_config.groups import FILTER_OPTIONS
+from gitlab_config.report import OUTPUT_FORMATS
+from gitlab_config.sharding import parse_shard
+
+
+def parse_timestamp(value: str) -> str:
+    try:
+        return datetime.fromisoformat(value).isoformat()
+    except ValueError:
+        raise ArgumentTypeError(
+            f"Expected an ISO 8601 date or time, e.g. 2026-01-31 or 2026-01-31T12:00:00Z, not '{value}'"
+        )
+
+
+def parse_concurrency(value: str) -> int:
+    try:
+        concurrency = int(value)
+    except ValueError:
+        concurrency = 0
+    if concurrency < 1:
+        raise ArgumentTypeError(f"Expected a positive number, not '{value}'")
+    return concurrency
+
 
 def parse_args(args: List[str]) -> argparse.Namespace:
     parser = ArgumentParser()
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Report API calls per endpoint, latency percentiles, bytes transferred, 429s and retries, and time spent per phase.",
+    )
+    parser.add_argument(
+        "--profile-trace",
+        metavar="TRACE_FILE",
+        help="Write requests and phases as a Chrome trace JSON file (chrome://tracing, ui.perfetto.dev). Implies --profile.",
+    )
     subparsers = parser.add_subparsers(dest="command", required=True)
 
     # Groups subcommand
@@ -33,6 +67,97 @@ def parse_args(args: List[str]) -> argparse.Namespace:
         action="store_true",
         help="Script will not make changes unless this flag is passed. E.g. Script is no-op by default.",
     )
+    groups_parser.add_argument(
+        "-c",
+        "--concurrency",
+        type=parse_concurrency,
+        default=1,
+        help="Number of projects to manage in parallel. Defaults to 1.",
+    )
+    groups_parser.add_argument(
+        "--graphql",
+        action="store_true",
+        help="Read project settings in batches of 100 through the GraphQL API. Changes are still written through the REST API. squash_option, merge_method, merge_requests_template, prevent_secrets and approval_rules aren't available through GraphQL and are still read per project.",
+    )
+    groups_parser.add_argument(
+        "--plan-out",
+        metavar="PLAN_FILE",
+        help="Write the changes that would be made to a JSON plan file which can be run later with the apply subcommand. Can't be combined with --fix.",
+    )
+
+    groups_parser.add_argument(
+        "--output",
+        choices=OUTPUT_FORMATS,
+        default="table",
+        help="Report format. jsonl and csv rows are written as each project finishes, with raw values and which fields changed. Defaults to table.",
+    )
+    groups_parser.add_argument(
+        "--output-file",
+        help="Write the jsonl or csv report to a file instead of stdout. When the report goes to stdout, progress output goes to stderr.",
+    )
+
+    groups_parser.add_argument(
+        "--shard",
+        type=parse_shard,
+        metavar="i/N",
+        help="Only manage the i-th of N deterministic shards of the projects, e.g. 2/4. Combine the shards' --output jsonl reports with merge-reports.",
+    )
+
+    groups_journal = groups_parser.add_mutually_exclusive_group()
+    groups_journal.add_argument(
+        "--journal",
+        metavar="JOURNAL_FILE",
+        help="Checkpoint finished projects and applied writes to a new journal file, so an interrupted run can be continued with --resume.",
+    )
+    groups_journal.add_argument(
+        "--resume",
+        metavar="JOURNAL_FILE",
+        help="Continue the run that wrote this journal. Finished projects are skipped and writes already made are never repeated.",
+    )
+
+    groups_parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Only audit projects with activity since the last --incremental run of the same groups and config. Results for the other projects are reused from the state file. Settings changed without any activity aren't noticed, delete the state file now and then for a full audit.",
+    )
+    groups_parser.add_argument(
+        "--state-file",
+        default="gitlab-config-state.db",
+        help="SQLite file the results of --incremental runs are stored in. Defaults to gitlab-config-state.db.",
+    )
+
+    # Filters are passed to the projects API so they are applied server side
+    groups_filters = groups_parser.add_argument_group(
+        "project filters", "Only manage the projects that match every given filter."
+    )
+    groups_filters.add_argument(
+        "--topic",
+        action="append",
+        help="Projects with this topic. Can be repeated, projects must have all of them.",
+    )
+    groups_filters.add_argument(
+        "--visibility", choices=("public", "internal", "private")
+    )
+    groups_filters.add_argument(
+        "--with-merge-requests-enabled",
+        action="store_true",
+        help="Projects with merge requests enabled.",
+    )
+    groups_filters.add_argument(
+        "--search", help="Projects whose path or name contains this text."
+    )
+    groups_filters.add_argument(
+        "--last-activity-after",
+        type=parse_timestamp,
+        metavar="TIMESTAMP",
+        help="Projects with activity after this date or time, e.g. 2026-01-31.",
+    )
+
+    groups_parser.add_argument(
+        "--promote",
+        action="store_true",
+        help="When every project of a top-level group would get the same default branch protection, protect the branch once on the group instead of on each project. Requires --recursive.",
+    )
 
     # Projects subcommand
     projects_parser = subparsers.add_parser(
@@ -41,8 +166,14 @@ def parse_args(args: List[str]) -> argparse.Namespace:
     )
     projects_parser.add_argument(
         "project_ids",
-        nargs="+",
-        help="Projects id of one or more projects for which to manage or report the configuration.",
+        nargs="*",
+        metavar="project_id_or_path",
+        help="Ids or full paths, e.g. acme/platform/api, of the projects for which to manage or report the configuration.",
+    )
+    projects_parser.add_argument(
+        "--from-file",
+        metavar="FILE",
+        help="Read project ids or full paths from a file, one per line, or from stdin with -. Blank lines and lines starting with # are ignored.",
     )
     projects_parser.add_argument(
         "-f",
@@ -50,5 +181,112 @@ def parse_args(args: List[str]) -> argparse.Namespace:
         action="store_true",
         help="Script will not make changes unless this flag is passed. E.g. Script is no-op by default.",
     )
+    projects_parser.add_argument(
+        "-c",
+        "--concurrency",
+        type=parse_concurrency,
+        default=1,
+        help="Number of projects to manage in parallel. Defaults to 1.",
+    )
+    projects_parser.add_argument(
+        "--graphql",
+        action="store_true",
+        help="Read project settings in batches of 100 through the GraphQL API. Changes are still written through the REST API. squash_option, merge_method, merge_requests_template, prevent_secrets and approval_rules aren't available through GraphQL and are still read per project.",
+    )
+    projects_parser.add_argument(
+        "--plan-out",
+        metavar="PLAN_FILE",
+        help="Write the changes that would be made to a JSON plan file which can be run later with the apply subcommand. Can't be combined with --fix.",
+    )
+
+    projects_parser.add_argument(
+        "--output",
+        choices=OUTPUT_FORMATS,
+        default="table",
+        help="Report format. jsonl and csv rows are written as each project finishes, with raw values and which fields changed. Defaults to table.",
+    )
+    projects_parser.add_argument(
+        "--output-file",
+        help="Write the jsonl or csv report to a file instead of stdout. When the report goes to stdout, progress output goes to stderr.",
+    )
+
+    projects_parser.add_argument(
+        "--shard",
+        type=parse_shard,
+        metavar="i/N",
+        help="Only manage the i-th of N deterministic shards of the projects, e.g. 2/4. Combine the shards' --output jsonl reports with merge-reports.",
+    )
+
+    projects_journal = projects_parser.add_mutually_exclusive_group()
+    projects_journal.add_argument(
+        "--journal",
+        metavar="JOURNAL_FILE",
+        help="Checkpoint finished projects and applied writes to a new journal file, so an interrupted run can be continued with --resume.",
+    )
+    projects_journal.add_argument(
+        "--resume",
+        metavar="JOURNAL_FILE",
+        help="Continue the run that wrote this journal. Finished projects are skipped and writes already made are never repeated.",
+    )
+
+    # Apply subcommand
+    apply_parser = subparsers.add_parser(
+        "apply",
+        help="Apply a plan file written by --plan-out. Only the projects in the plan are re-read, to check they haven't changed since.",
+    )
+    apply_parser.add_argument(
+        "plan_file",
+        help="Plan file written by the --plan-out option of the groups or projects subcommands.",
+    )
+    apply_parser.add_argument(
+        "-c",
+        "--concurrency",
+        type=parse_concurrency,
+        default=1,
+        help="Number of projects to apply in parallel. Defaults to 1.",
+    )
+
+    # Merge reports subcommand
+    merge_parser = subparsers.add_parser(
+        "merge-reports",
+        help="Combine the jsonl reports of sharded runs into one table and change count",
+    )
+    merge_parser.add_argument(
+        "report_files",
+        nargs="+",
+        help="Reports written with --output jsonl --output-file by each shard.",
+    )
 
-    return parser.parse_args(args)
+    parsed = parser.parse_args(args)
+    if parsed.command == "projects" and not (parsed.project_ids or parsed.from_file):
+        parser.error("projects needs project ids or paths, or --from-file")
+    if getattr(parsed, "plan_out", None) and parsed.fix:
+        # The plan would be stale as soon as the run had applied it
+        parser.error(
+            "--plan-out can't be combined with --fix, apply the plan with the apply subcommand"
+        )
+    if getattr(parsed, "incremental", False) and parsed.limit:
+        parser.error("--incremental can't be combined with --limit")
+    if getattr(parsed, "incremental", False) and parsed.last_activity_after:
+        parser.error("--incremental can't be combined with --last-activity-after")
+    if getattr(parsed, "incremental", False) and parsed.resume:
+        # The state store only knows the projects audited by this run
+        parser.error("--incremental can't be combined with --resume")
+    if getattr(parsed, "promote", False):
+        # Promotion needs every project of the group to have been planned
+        if not parsed.recursive:
+            parser.error("--promote requires --recursive")
+        for option in (
+            "limit",
+            "shard",
+            "incremental",
+            "journal",
+            "resume",
+            "plan_out",
+            *FILTER_OPTIONS,
+        ):
+            if getattr(parsed, option):
+                parser.error(
+                    f"--promote can't be combined with --{option.replace('_', '-')}"
+                )
+    return parsed
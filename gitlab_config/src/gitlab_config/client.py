@@ -0,0 +1,27 @@
+from typing import Dict
+
+import gitlab
+
+from gitlab_config.ratelimit import AdaptiveRateLimiter, RateLimitedAdapter
+
+
+def get_gitlab_client(config: Dict, concurrency: int = 1) -> gitlab.Gitlab:
+    gl = gitlab.Gitlab(
+        config["GITLAB_URL"],
+        private_token=config["GITLAB_TOKEN"],
+    )
+
+    # Every request made through the client, including GraphQL, shares one
+    # limiter. The connection pool has room for every thread that can make
+    # requests, so connections are reused rather than discarded: the project
+    # workers, as many discovery workers, and the main thread, which pages
+    # through discovery and reads GraphQL batches. A connection is only given
+    # back once its response has been read, after the limiter let the next
+    # request through.
+    adapter = RateLimitedAdapter(
+        AdaptiveRateLimiter(max_concurrency=concurrency),
+        pool_maxsize=2 * concurrency + 1,
+    )
+    gl.session.mount("http://", adapter)
+    gl.session.mount("https://", adapter)
+    return gl
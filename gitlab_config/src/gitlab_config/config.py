@@ -1,5 +1,7 @@
 import os
+from fnmatch import fnmatchcase
 from pathlib import Path
+from typing import Dict, Iterator, List
 
 import yaml
 from dotenv import load_dotenv
@@ -29,3 +31,111 @@ def get_config(filename: Path | None = None):
     config = load_yaml_config(filename)
     config["GITLAB_TOKEN"] = os.environ.get("GITLAB_TOKEN")
     return config
+
+
+# Top-level keys that aren't config for a project or group
+RESERVED_KEYS = {"GITLAB_URL", "GITLAB_TOKEN", "default"}
+MERGE_METHOD_KEY = "config_merge_method"
+MERGE_METHODS = ("replace_default", "merge_with_default")
+GLOB_CHARACTERS = set("*?[")
+
+
+def managed_fields(config: Dict) -> List[str]:
+    """Every field managed by the default or any override, in config order."""
+    entries = [config.get("default") or {}] + [
+        entry
+        for key, entry in config.items()
+        if key not in RESERVED_KEYS and isinstance(entry, dict)
+    ]
+    return list(
+        dict.fromkeys(
+            field for entry in entries for field in entry if field != MERGE_METHOD_KEY
+        )
+    )
+
+
+class ConfigIndex:
+    """Resolves the config for a project from the default and any overrides.
+
+    Keys other than the default are matched against a project, most specific
+    first:
+
+    1. the project id
+    2. the project's full path, e.g. ``acme/platform/api``
+    3. glob patterns on the full path, e.g. ``acme/*/api``, in config order
+    4. the project's groups, deepest first, e.g. ``acme/platform`` then ``acme``
+    5. the bare project name (kept for configs written before paths were supported)
+
+    The most specific match is used as is with ``config_merge_method:
+    replace_default`` (the default). With ``merge_with_default`` it is merged
+    over whatever the next match resolves to, down to the default config.
+
+    The config is compiled once, so a lookup is a few dict lookups per level
+    of the project's path. Resolved configs are cached per set of matches.
+    """
+
+    def __init__(self, config: Dict):
+        self.default = config.get("default", {})
+        self.entries: Dict[str, Dict] = {}
+        self.globs: List[str] = []
+
+        for key, value in config.items():
+            if key in RESERVED_KEYS or not isinstance(value, dict):
+                continue
+            key = str(key)
+            merge_method = value.get(MERGE_METHOD_KEY, "replace_default")
+            if merge_method not in MERGE_METHODS:
+                raise ValueError(
+                    f"Invalid {MERGE_METHOD_KEY} '{merge_method}' for '{key}', expected one of: {', '.join(MERGE_METHODS)}"
+                )
+            self.entries[key] = value
+            if GLOB_CHARACTERS & set(key):
+                self.globs.append(key)
+
+        self._resolved: Dict[tuple, Dict] = {}
+
+    def matches(self, project) -> Iterator[str]:
+        """Keys matching the project, most specific first."""
+        project_id = str(project.id)
+        if project_id in self.entries:
+            yield project_id
+
+        full_path = project.path_with_namespace
+        if full_path in self.entries:
+            yield full_path
+
+        for pattern in self.globs:
+            if fnmatchcase(full_path, pattern):
+                yield pattern
+
+        groups = full_path.split("/")[:-1]
+        for depth in range(len(groups), 0, -1):
+            group_path = "/".join(groups[:depth])
+            if group_path in self.entries:
+                yield group_path
+
+        if project.name in self.entries:
+            yield project.name
+
+    def resolve(self, project) -> Dict:
+        """The managed fields for the project."""
+        chain = []
+        for key in self.matches(project):
+            if key in chain:
+                continue
+            chain.append(key)
+            if self.entries[key].get(MERGE_METHOD_KEY) != "merge_with_default":
+                break
+        else:
+            chain.append("default")
+
+        chain = tuple(chain)
+        resolved = self._resolved.get(chain)
+        if resolved is None:
+            resolved = {}
+            for key in reversed(chain):
+                fields = self.default if key == "default" else self.entries[key]
+                resolved.update(fields)
+            resolved.pop(MERGE_METHOD_KEY, None)
+            self._resolved[chain] = resolved
+        return resolved
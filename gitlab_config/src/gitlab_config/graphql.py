@@ -0,0 +1,244 @@
+import logging
+from types import SimpleNamespace
+from itertools import batched
+from typing import Dict, List
+
+import gitlab
+from gitlab.v4.objects.projects import Project
+
+logger = logging.getLogger(__name__)
+
+# GitLab caps GraphQL connections at 100 nodes per page
+GRAPHQL_BATCH_SIZE = 100
+
+PROJECT_SETTINGS_QUERY = """
+query projectSettings($ids: [ID!], $fullPaths: [String!], $first: Int) {
+  projects(ids: $ids, fullPaths: $fullPaths, first: $first) {
+    nodes {
+      id
+      name
+      path
+      fullPath
+      removeSourceBranchAfterMerge
+      onlyAllowMergeIfPipelineSucceeds
+      repository {
+        rootRef
+      }
+      branchRules {
+        nodes {
+          name
+          branchProtection {
+            allowForcePush
+            mergeAccessLevels {
+              nodes {
+                accessLevel
+                accessLevelDescription
+              }
+            }
+            pushAccessLevels {
+              nodes {
+                accessLevel
+                accessLevelDescription
+              }
+            }
+          }
+        }
+      }
+    }
+  }
+}
+"""
+
+USERS_QUERY = """
+query users($usernames: [String!], $first: Int) {
+  users(usernames: $usernames, first: $first) {
+    nodes {
+      id
+      username
+    }
+  }
+}
+"""
+
+# Managed fields a snapshot can compare without any REST request. GitLab's
+# GraphQL API doesn't expose the others (squash_option, merge_method,
+# merge_requests_template, push rules, approval rules), so each project
+# managing one of them is still read through REST.
+GRAPHQL_FIELDS = {
+    "remove_source_branch_after_merge",
+    "only_allow_merge_if_pipeline_succeeds",
+    "merge_access_levels",
+    "push_access_levels",
+    "allow_force_push",
+}
+
+
+class GraphQLError(Exception):
+    pass
+
+
+def graphql_query(gl: gitlab.Gitlab, query: str, variables: Dict) -> Dict:
+    # Goes through the REST client's session so auth, retries and connection
+    # pooling are shared with every other request.
+    result = gl.http_post(
+        f"{gl.url}/api/graphql",
+        post_data={"query": query, "variables": variables},
+    )
+    if result.get("errors"):
+        messages = "; ".join(error["message"] for error in result["errors"])
+        raise GraphQLError(f"GraphQL query failed: {messages}")
+    return result["data"]
+
+
+def global_id(project_id: int | str) -> str:
+    return f"gid://gitlab/Project/{project_id}"
+
+
+def _access_levels(connection: Dict | None) -> List[Dict]:
+    if not connection:
+        return []
+    return [
+        {
+            "access_level": node["accessLevel"],
+            "access_level_description": node["accessLevelDescription"],
+        }
+        for node in connection["nodes"]
+    ]
+
+
+class ProtectedBranchesSnapshot:
+    """Serves protected branches from the snapshot, writes go to the REST manager."""
+
+    def __init__(self, manager, branches: List[SimpleNamespace]):
+        self._manager = manager
+        self._branches = branches
+
+    def list(self, **kwargs) -> List[SimpleNamespace]:
+        return self._branches
+
+    def __getattr__(self, name: str):
+        return getattr(self._manager, name)
+
+
+class ProjectSnapshot:
+    """Read-only view of a project built from a batched GraphQL query.
+
+    Attributes GitLab's GraphQL API doesn't expose (e.g. ``squash_option``,
+    ``merge_method`` or ``merge_requests_template``) are read from the REST
+    project, which is only fetched the first time one of them is accessed.
+    """
+
+    def __init__(self, gl: gitlab.Gitlab, node: Dict):
+        self._gl = gl
+        self._rest_project = None
+
+        self.id = int(node["id"].rsplit("/", 1)[-1])
+        self.name = node["name"]
+        self.path = node["path"]
+        self.path_with_namespace = node["fullPath"]
+        self.default_branch = (node.get("repository") or {}).get("rootRef")
+        self.remove_source_branch_after_merge = node["removeSourceBranchAfterMerge"]
+        self.only_allow_merge_if_pipeline_succeeds = node[
+            "onlyAllowMergeIfPipelineSucceeds"
+        ]
+
+        # A lazy project only provides the sub-resource managers, it makes no request
+        lazy_project = gl.projects.get(self.id, lazy=True)
+        self.branches = lazy_project.branches
+        self.pushrules = lazy_project.pushrules
+        self.approvalrules = lazy_project.approvalrules
+
+        protected_branches = []
+        for rule in (node.get("branchRules") or {}).get("nodes", []):
+            protection = rule.get("branchProtection")
+            if protection is None:
+                continue
+            protected_branches.append(
+                SimpleNamespace(
+                    name=rule["name"],
+                    allow_force_push=protection["allowForcePush"],
+                    merge_access_levels=_access_levels(
+                        protection.get("mergeAccessLevels")
+                    ),
+                    push_access_levels=_access_levels(
+                        protection.get("pushAccessLevels")
+                    ),
+                )
+            )
+        self.protectedbranches = ProtectedBranchesSnapshot(
+            lazy_project.protectedbranches, protected_branches
+        )
+
+    def rest_project(self) -> Project:
+        if self._rest_project is None:
+            self._rest_project = self._gl.projects.get(self.id)
+        return self._rest_project
+
+    def __getattr__(self, name: str):
+        # Only reached for attributes that weren't part of the GraphQL read
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return getattr(self.rest_project(), name)
+
+
+def get_project_snapshots(
+    gl: gitlab.Gitlab, project_ids: List[int | str]
+) -> Dict[str, ProjectSnapshot]:
+    """Read up to GRAPHQL_BATCH_SIZE projects in a single GraphQL request.
+
+    Returns snapshots keyed by the string project id. Ids that aren't numeric or
+    that the token can't see are left out so callers can fall back to REST.
+    """
+    ids = [
+        global_id(project_id) for project_id in project_ids if str(project_id).isdigit()
+    ]
+    if not ids:
+        return {}
+
+    logger.info(f"Reading settings for {len(ids)} projects through GraphQL")
+    data = graphql_query(
+        gl, PROJECT_SETTINGS_QUERY, {"ids": ids, "first": GRAPHQL_BATCH_SIZE}
+    )
+
+    snapshots = {}
+    for node in data["projects"]["nodes"]:
+        snapshot = ProjectSnapshot(gl, node)
+        snapshots[str(snapshot.id)] = snapshot
+    return snapshots
+
+
+def resolve_project_paths(
+    gl: gitlab.Gitlab, full_paths: List[str]
+) -> Dict[str, ProjectSnapshot]:
+    """Look projects up by full path, GRAPHQL_BATCH_SIZE paths per request.
+
+    Returns snapshots keyed by full path, so they can be managed without
+    reading the project again. Paths the token can't see are left out.
+    """
+    snapshots = {}
+    for batch in batched(full_paths, GRAPHQL_BATCH_SIZE):
+        logger.info(f"Resolving {len(batch)} project paths through GraphQL")
+        data = graphql_query(
+            gl,
+            PROJECT_SETTINGS_QUERY,
+            {"fullPaths": list(batch), "first": GRAPHQL_BATCH_SIZE},
+        )
+        for node in data["projects"]["nodes"]:
+            snapshots[node["fullPath"]] = ProjectSnapshot(gl, node)
+    return snapshots
+
+
+def resolve_usernames(gl: gitlab.Gitlab, usernames: List[str]) -> Dict[str, int]:
+    """User ids by username, GRAPHQL_BATCH_SIZE usernames per request.
+
+    Usernames that don't exist are left out.
+    """
+    user_ids = {}
+    for batch in batched(usernames, GRAPHQL_BATCH_SIZE):
+        logger.info(f"Resolving {len(batch)} usernames through GraphQL")
+        data = graphql_query(
+            gl, USERS_QUERY, {"usernames": list(batch), "first": GRAPHQL_BATCH_SIZE}
+        )
+        for node in data["users"]["nodes"]:
+            user_ids[node["username"]] = int(node["id"].rsplit("/", 1)[-1])
+    return user_ids
@@ -1,73 +1,239 @@
 import logging
-from typing import List
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from itertools import chain, islice
+from typing import Any, Dict, Iterator, List
 
 import gitlab
-from gitlab.v4.objects.projects import GroupProject
+from gitlab.v4.objects.groups import Group
 
 logger = logging.getLogger(__name__)
 
-
-def get_projects_for_group(
-    gl: gitlab.Gitlab,
-    group_id: str,
-    limit: int = None,
-    recurse: bool = False,
-) -> List[GroupProject]:
-    group = gl.groups.get(group_id, simple=True)
-
-    page = 1
-    per_page = 20
-
-    if limit and limit < per_page:
-        per_page = limit
-
-    group_projects = []
-    while True:
-        logger.info(
-            f"Getting projects for group: [{group.id}] {group.full_path}, include_subgroups: {recurse}"
-        )
-        logger.debug(
-            f"page: {page}, per_page: {per_page}, limit: {limit}, include_subgroups: {recurse}"
+# groups subcommand options that filter projects, each is passed to the
+# projects API as the parameter of the same name
+FILTER_OPTIONS = (
+    "topic",
+    "visibility",
+    "with_merge_requests_enabled",
+    "search",
+    "last_activity_after",
+)
+
+
+def project_filters(args) -> Dict[str, Any]:
+    """Projects API parameters for the filter options that were given."""
+    filters = {}
+    for option in FILTER_OPTIONS:
+        value = getattr(args, option, None)
+        if not value:
+            continue
+        if option == "topic":
+            # The API takes a comma separated list and matches all of them
+            value = ",".join(value)
+        filters[option] = value
+    return filters
+
+
+class ProjectRecord:
+    """The attributes of a listed project that are used, and nothing else.
+
+    Discovery can list hundreds of thousands of projects, so records are built
+    straight from the API's JSON instead of keeping full REST objects.
+    """
+
+    __slots__ = (
+        "id",
+        "path_with_namespace",
+        "default_branch",
+        "last_activity_at",
+    )
+
+    def __init__(
+        self,
+        id: int,
+        path_with_namespace: str,
+        default_branch: str | None = None,
+        last_activity_at: str | None = None,
+    ):
+        self.id = id
+        self.path_with_namespace = path_with_namespace
+        self.default_branch = default_branch
+        self.last_activity_at = last_activity_at
+
+    @classmethod
+    def from_json(cls, data: Dict[str, Any]) -> "ProjectRecord":
+        return cls(
+            data["id"],
+            data["path_with_namespace"],
+            data.get("default_branch"),
+            data.get("last_activity_at"),
         )
 
-        projects_page = group.projects.list(
-            page=page,
-            per_page=20,
-            archived=False,
-            order_by="name",
-            sort="asc",
-            include_subgroups=recurse,
-            simple=True,
-        )
+    def __repr__(self) -> str:
+        return f"ProjectRecord({self.id!r}, {self.path_with_namespace!r})"
 
-        if not projects_page:
-            break
 
-        group_projects.extend(projects_page)
-        page += 1
+def list_projects(
+    gl: gitlab.Gitlab,
+    group_id: int,
+    per_page: int,
+    include_subgroups: bool,
+    **filters,
+) -> Iterator[ProjectRecord]:
+    """Lazily list the group's non-archived projects as records.
+
+    Keyset pagination only supports ordering by id. Pages are requested as the
+    iterator is consumed, so stopping early skips the remaining pages.
+    """
+    projects = gl.http_list(
+        f"/groups/{group_id}/projects",
+        query_data={
+            "pagination": "keyset",
+            "per_page": per_page,
+            "archived": False,
+            "order_by": "id",
+            "sort": "asc",
+            "include_subgroups": include_subgroups,
+            "simple": True,
+            **filters,
+        },
+        iterator=True,
+    )
+    for data in projects:
+        yield ProjectRecord.from_json(data)
+
+
+def drop_nested_groups(groups: List[Group]) -> List[Group]:
+    """Drop groups that are repeated or inside another group's subtree."""
+    paths = {group.full_path for group in groups}
+    kept = []
+    seen = set()
+    for group in groups:
+        ancestors = group.full_path.split("/")[:-1]
+        nested = any(
+            "/".join(ancestors[: depth + 1]) in paths for depth in range(len(ancestors))
+        )
+        if group.id in seen or nested:
+            continue
+        seen.add(group.id)
+        kept.append(group)
+    return kept
 
-        if limit and len(group_projects) >= limit:
-            group_projects = group_projects[:limit]
-            break
 
-    return group_projects
+def expand_groups(
+    gl: gitlab.Gitlab,
+    executor: ThreadPoolExecutor,
+    groups_ids: List[str],
+    recurse: bool = False,
+) -> List:
+    """Resolve the groups and, with recurse, all of their subgroups.
+
+    Overlapping subtrees are removed before any subgroups are listed, and each
+    remaining top-level group's descendants are walked in parallel. The result
+    is in the order the groups were given, each followed by its subgroups.
+    """
+    groups = list(
+        executor.map(lambda group_id: gl.groups.get(group_id, simple=True), groups_ids)
+    )
+    if not recurse:
+        return _unique(groups)
+
+    roots = drop_nested_groups(groups)
+    descendants = executor.map(
+        lambda group: sorted(
+            group.descendant_groups.list(iterator=True, per_page=100),
+            key=lambda subgroup: subgroup.full_path,
+        ),
+        roots,
+    )
+
+    expanded = []
+    for root, subgroups in zip(roots, descendants):
+        logger.info(f"Found {len(subgroups)} subgroups in [{root.id}] {root.full_path}")
+        expanded.append(root)
+        expanded.extend(subgroups)
+    return _unique(expanded)
+
+
+def _unique(groups: List) -> List:
+    seen = set()
+    unique = []
+    for group in groups:
+        if group.id not in seen:
+            seen.add(group.id)
+            unique.append(group)
+    return unique
+
+
+def list_group_projects(
+    gl: gitlab.Gitlab, group_id: int, per_page: int, **filters
+) -> Iterator[ProjectRecord]:
+    """The group's own non-archived projects, without those of its subgroups.
+
+    Only the first page is read straight away, so a worker can prefetch it.
+    Later pages are read as the iterator is consumed.
+    """
+    projects = list_projects(gl, group_id, per_page, include_subgroups=False, **filters)
+    first_page = list(islice(projects, per_page))
+    return chain(first_page, projects)
 
 
 def get_projects_for_groups(
     gl: gitlab.Gitlab,
-    groups_ids: list[str],
+    groups_ids: List[str],
     limit: int = None,
     recurse: bool = False,
-) -> List[GroupProject]:
-    unique_projects = dict()
-    for group_id in groups_ids:
-        group_projects = get_projects_for_group(
-            gl, group_id, limit=limit, recurse=recurse
-        )
-        for project in group_projects:
-            unique_projects[project.id] = project
-
-        if limit and len(unique_projects) >= limit:
-            break
+    concurrency: int = 1,
+    **filters,
+) -> Iterator[ProjectRecord]:
+    """Yield the non-archived projects of the groups, each project once.
+
+    Any ``filters`` (e.g. ``last_activity_after``) are passed through to the
+    projects API so that filtering happens server side.
+
+    Projects are yielded group by group in the order of expand_groups, so a
+    project is listed once even when the groups overlap. ``concurrency`` sizes
+    the pool that lists them: the first page of a bounded number of groups is
+    read ahead of the group being yielded, the rest of a group's pages only as
+    its projects are consumed. Once the limit is reached no more groups are
+    listed.
+    """
+    per_page = 100
+    if limit and limit < per_page:
+        per_page = limit
 
-    return list(unique_projects.values())
+    seen = set()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        groups = iter(expand_groups(gl, executor, groups_ids, recurse=recurse))
+        pending: deque[Future] = deque()
+
+        def submit_next() -> None:
+            group = next(groups, None)
+            if group is not None:
+                logger.info(
+                    f"Getting projects for group: [{group.id}] {group.full_path}"
+                )
+                pending.append(
+                    executor.submit(
+                        list_group_projects, gl, group.id, per_page, **filters
+                    )
+                )
+
+        for _ in range(concurrency * 2):
+            submit_next()
+
+        try:
+            while pending:
+                projects = pending.popleft().result()
+                submit_next()
+                for project in projects:
+                    if project.id in seen:
+                        continue
+                    seen.add(project.id)
+                    yield project
+
+                    if limit and len(seen) >= limit:
+                        return
+        finally:
+            for future in pending:
+                future.cancel()
@@ -0,0 +1,133 @@
+import json
+import logging
+import os
+import threading
+from pathlib import Path
+from typing import Any, Dict
+
+from gitlab_config.plan import ProjectPlan
+
+logger = logging.getLogger(__name__)
+
+JOURNAL_VERSION = 1
+
+
+class Journal:
+    """Append-only checkpoint of a run, so an interrupted run can be resumed.
+
+    Every entry is one JSON line, flushed to disk before the run moves on:
+
+    * ``run``: what the run was asked to do, checked when resuming.
+    * ``write``: a resource write to a project that GitLab accepted.
+    * ``project``: a project that is done, with its output row and plan.
+
+    Resuming skips the finished projects and replays their rows. Writes to
+    projects that weren't finished are skipped if the journal already has the
+    same write for them, so nothing is applied twice.
+    """
+
+    def __init__(self, filename: Path, header: Dict):
+        self.filename = filename
+        self.header = header
+        self.completed: Dict[str, Dict] = {}
+        self.writes: Dict[tuple[str, str], Dict] = {}
+        self._lock = threading.Lock()
+        self._file = None
+
+    @classmethod
+    def create(cls, filename: Path, header: Dict) -> "Journal":
+        journal = cls(filename, header)
+        try:
+            # Never overwrite the checkpoint of an unfinished run
+            journal._file = open(filename, "x")
+        except FileExistsError:
+            raise FileExistsError(
+                f"Journal file '{filename}' already exists, continue it with --resume or remove it."
+            )
+        journal._append({"type": "run", "version": JOURNAL_VERSION, **header})
+        return journal
+
+    @classmethod
+    def resume(cls, filename: Path) -> "Journal":
+        try:
+            with open(filename, "r") as f:
+                lines = f.readlines()
+        except FileNotFoundError:
+            raise FileNotFoundError(f"Journal file '{filename}' not found.")
+
+        entries = []
+        for line_number, line in enumerate(lines, start=1):
+            try:
+                entries.append(json.loads(line))
+            except json.JSONDecodeError:
+                # The run was killed halfway through writing its last entry
+                if line_number == len(lines):
+                    logger.warning(f"Ignoring incomplete last entry of '{filename}'")
+                    continue
+                raise ValueError(f"Failed to parse line {line_number} of '{filename}'")
+
+        if not entries or entries[0].get("type") != "run":
+            raise ValueError(f"'{filename}' is not a gitlab-config journal")
+        header = {
+            key: value
+            for key, value in entries[0].items()
+            if key not in ("type", "version")
+        }
+        if entries[0].get("version") != JOURNAL_VERSION:
+            raise ValueError(
+                f"Unsupported journal version '{entries[0].get('version')}' in '{filename}'"
+            )
+
+        journal = cls(filename, header)
+        for entry in entries[1:]:
+            if entry["type"] == "write":
+                journal.writes[(entry["project_id"], entry["resource"])] = entry["data"]
+            elif entry["type"] == "project":
+                journal.completed[entry["project_id"]] = entry
+
+        with open(filename, "rb+") as f:
+            # Drop a partially written last entry before appending to the file
+            f.truncate(sum(len(line.encode()) for line in lines if line.endswith("\n")))
+        journal._file = open(filename, "a")
+        return journal
+
+    def _append(self, entry: Dict) -> None:
+        with self._lock:
+            self._file.write(json.dumps(entry, default=str) + "\n")
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def is_applied(self, project_id: Any, resource: str, data: Dict) -> bool:
+        return self.writes.get((str(project_id), resource)) == data
+
+    def record_write(self, project_id: Any, resource: str, data: Dict) -> None:
+        self.writes[(str(project_id), resource)] = data
+        self._append(
+            {
+                "type": "write",
+                "project_id": str(project_id),
+                "resource": resource,
+                "data": data,
+            }
+        )
+
+    def record_project(self, project_id: Any, row: Dict, plan: ProjectPlan) -> None:
+        entry = {
+            "type": "project",
+            "project_id": str(project_id),
+            "row": row,
+            "plan": plan.to_dict() if plan else None,
+        }
+        self.completed[str(project_id)] = entry
+        self._append(entry)
+
+    def is_completed(self, project_id: Any) -> bool:
+        return str(project_id) in self.completed
+
+    def completed_plan(self, project_id: Any) -> ProjectPlan | None:
+        plan = self.completed[str(project_id)]["plan"]
+        return ProjectPlan.from_dict(plan) if plan else None
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
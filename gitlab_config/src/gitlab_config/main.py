@@ -1,16 +1,46 @@
 import logging
 import os
 import sys
-from typing import Dict, List
+from argparse import Namespace
+from contextlib import nullcontext, redirect_stdout
+from typing import Dict, Iterable, Iterator, List
 
 import gitlab
-from prettytable import PrettyTable
 from rich.console import Console
 
 from gitlab_config.cli import parse_args
-from gitlab_config.config import get_config
-from gitlab_config.groups import get_projects_for_groups
-from gitlab_config.projects import manage_projects
+from gitlab_config.client import get_gitlab_client
+from gitlab_config.config import get_config, managed_fields
+from gitlab_config import profiling
+from gitlab_config.graphql import (
+    GRAPHQL_FIELDS,
+    ProjectSnapshot,
+    resolve_project_paths,
+)
+from gitlab_config.groups import get_projects_for_groups, project_filters
+from gitlab_config.journal import Journal
+from gitlab_config.plan import (
+    ProjectPlan,
+    apply_plans,
+    load_plan_file,
+    write_plan_file,
+)
+from gitlab_config.profiling import Profiler
+from gitlab_config.projects import manage_projects, output_columns
+from gitlab_config.promote import apply_promotion, group_plan_rows, promote_plans
+from gitlab_config.report import (
+    StreamingReport,
+    open_report,
+    print_table,
+    read_reports,
+)
+from gitlab_config.sharding import in_shard
+from gitlab_config.state import (
+    IncrementalAudit,
+    StateStore,
+    config_hash,
+    groups_scope,
+)
 
 log_level = os.environ.get("GITLAB_CONFIG_LOG_LEVEL", "WARNING")
 log_level = getattr(logging, log_level)
@@ -18,6 +48,7 @@ logging.basicConfig(
     level=log_level, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
 )
 logger = logging.getLogger(__name__)
+console = Console()
 
 
 def main(args: List[str] | None = None, config: Dict | None = None) -> None:
@@ -25,54 +56,404 @@ def main(args: List[str] | None = None, config: Dict | None = None) -> None:
         args = sys.argv[1:]
 
     args = parse_args(args)
-    console = Console()
 
     if config is None:
         config = get_config()
 
-    if not args.fix:
+    report = open_report(
+        getattr(args, "output", "table"),
+        getattr(args, "output_file", None),
+        fix=getattr(args, "fix", False),
+        columns=output_columns(config),
+    )
+    # With a streamed report on stdout, progress and summaries go to stderr so
+    # the report can be piped straight into another job
+    if report is not None and report.file is sys.stdout:
+        quiet_stdout = redirect_stdout(sys.stderr)
+    else:
+        quiet_stdout = nullcontext()
+
+    try:
+        with quiet_stdout:
+            run(args, config, report)
+    finally:
+        if report is not None:
+            report.close()
+
+
+def run(args: Namespace, config: Dict, report: StreamingReport | None) -> None:
+    if args.command == "merge-reports":
+        merge_reports(args.report_files)
+        return
+
+    if args.command != "apply" and not args.fix:
         console.print(
             "No changes will be made unless the --fix flag is specified", style="yellow"
         )
 
-    gl = gitlab.Gitlab(
-        config["GITLAB_URL"],
-        private_token=config["GITLAB_TOKEN"],
+    gl = get_gitlab_client(config, concurrency=args.concurrency)
+
+    profiler = None
+    if args.profile or args.profile_trace:
+        profiler = Profiler()
+        profiler.instrument(gl.session)
+        profiling.enable(profiler)
+
+    try:
+        if args.command == "apply":
+            apply_plan_file(gl, args, config)
+        else:
+            audit(gl, args, config, report)
+    finally:
+        if profiler is not None:
+            profiling.enable(None)
+            profiler.print_report()
+            if args.profile_trace:
+                profiler.write_chrome_trace(args.profile_trace)
+                console.print(f"Chrome trace written to {args.profile_trace}")
+
+
+def apply_plan_file(gl: gitlab.Gitlab, args: Namespace, config: Dict) -> None:
+    plan = load_plan_file(args.plan_file)
+    if plan["gitlab_url"] != config["GITLAB_URL"]:
+        console.print(
+            f"Plan was made against {plan['gitlab_url']}, not {config['GITLAB_URL']}",
+            style="red",
+        )
+        sys.exit(1)
+
+    rows, change_count = apply_plans(gl, plan["projects"], concurrency=args.concurrency)
+    with profiling.span("rendering"):
+        print_table(rows, fix=True)
+    console.print(
+        f"Changes have been applied to {change_count}/{len(plan['projects'])} projects",
+        style="green",
+    )
+
+
+def open_journal(args: Namespace, config: Dict) -> Journal | None:
+    if not (args.journal or args.resume):
+        return None
+
+    targets = (
+        args.project_ids if args.command == "projects" else args.group_names_or_ids
+    )
+    # Resuming is only safe for the same run against the same config
+    header = {
+        "command": args.command,
+        "targets": sorted(str(target) for target in targets),
+        "recursive": getattr(args, "recursive", False),
+        "shard": str(args.shard) if args.shard else None,
+        "filters": project_filters(args),
+        "fix": args.fix,
+        "gitlab_url": config["GITLAB_URL"],
+        "config_hash": config_hash(config),
+    }
+
+    if args.journal:
+        return Journal.create(args.journal, header)
+
+    journal = Journal.resume(args.resume)
+    if journal.header != header:
+        console.print(
+            f"Journal {args.resume} was written by a different run, it can't be resumed with these arguments or config",
+            style="red",
+        )
+        sys.exit(1)
+    console.print(
+        f"Resuming {args.resume}: {len(journal.completed)} projects are already done"
     )
+    return journal
+
+
+def merge_reports(report_files: List[str]) -> None:
+    records = read_reports(report_files)
+    fix = any(record["fix"] for record in records)
+    change_count = sum(1 for record in records if record["changed"])
+
+    print_table([record["fields"] for record in records], fix=fix)
+    if fix:
+        console.print(
+            f"Changes have been applied to {change_count}/{len(records)} projects",
+            style="green",
+        )
+    else:
+        console.print(
+            f"Changes would be applied to {change_count}/{len(records)} projects",
+            style="yellow",
+        )
+
+
+def read_project_targets(args: Namespace) -> List[str]:
+    """Project ids or paths from the command line followed by those in --from-file."""
+    targets = list(args.project_ids)
+    if args.from_file:
+        if args.from_file == "-":
+            lines = sys.stdin.read().splitlines()
+        else:
+            with open(args.from_file, "r") as f:
+                lines = f.read().splitlines()
+        targets += [
+            line.strip()
+            for line in lines
+            if line.strip() and not line.strip().startswith("#")
+        ]
+    return targets
+
+
+def resolve_project_targets(
+    gl: gitlab.Gitlab, targets: List[str]
+) -> tuple[List, Dict[str, ProjectSnapshot]]:
+    """Project ids for the targets, in order, resolving full paths through GraphQL.
+
+    Projects found by path come with a snapshot of their settings, so they
+    aren't read again when they are managed.
+    """
+    paths = [target for target in targets if not str(target).isdigit()]
+    if not paths:
+        return (targets, {})
+
+    with profiling.span("resolve_paths"):
+        resolved = resolve_project_paths(gl, list(dict.fromkeys(paths)))
+    # Paths are case-insensitive in GitLab
+    by_path = {path.lower(): snapshot for path, snapshot in resolved.items()}
+
+    missing = [path for path in paths if path.lower() not in by_path]
+    if missing:
+        console.print(f"Projects not found: {', '.join(missing)}", style="red")
+
+    project_ids = []
+    seen = set()
+    for target in targets:
+        if str(target).isdigit():
+            project_id = target
+        elif target.lower() in by_path:
+            project_id = by_path[target.lower()].id
+        else:
+            continue
+        # A project given both by id and by path is only managed once
+        if str(project_id) not in seen:
+            seen.add(str(project_id))
+            project_ids.append(project_id)
+
+    snapshots = {str(snapshot.id): snapshot for snapshot in resolved.values()}
+    return (project_ids, snapshots)
+
+
+def remember_paths(projects: Iterable, project_paths: Dict) -> Iterator:
+    for project in projects:
+        project_paths[project.id] = project.path_with_namespace
+        yield project
+
 
+def audit(
+    gl: gitlab.Gitlab, args: Namespace, config: Dict, report: StreamingReport | None
+) -> None:
+    if args.graphql:
+        rest_fields = [
+            field for field in managed_fields(config) if field not in GRAPHQL_FIELDS
+        ]
+        if rest_fields:
+            console.print(
+                f"{', '.join(rest_fields)} can't be read through GraphQL, projects managing them are still read through REST",
+                style="yellow",
+            )
+
+    incremental = None
+    promote = getattr(args, "promote", False)
+    # Full paths of the discovered projects, for --promote
+    project_paths = {}
+    snapshots = None
     if args.command == "projects":
-        project_ids = args.project_ids
+        # Targets from a file are part of what a journal is resumed against
+        args.project_ids = read_project_targets(args)
+        project_ids, snapshots = resolve_project_targets(gl, args.project_ids)
+        if args.shard is not None:
+            project_ids = [
+                project_id
+                for project_id in project_ids
+                if in_shard(project_id, args.shard)
+            ]
     elif args.command == "groups":
+        filters = project_filters(args)
+        if args.incremental:
+            incremental = IncrementalAudit(
+                StateStore(args.state_file),
+                groups_scope(
+                    args.group_names_or_ids, args.recursive, args.shard, filters
+                ),
+                config,
+                fix=args.fix,
+            )
+            filters = {**filters, **incremental.filters()}
+            if incremental.last_run is None:
+                console.print(
+                    "No previous run with this config, all projects will be audited",
+                    style="yellow",
+                )
+
         projects = get_projects_for_groups(
             gl,
             list(args.group_names_or_ids),
             limit=args.limit,
             recurse=args.recursive,
+            concurrency=args.concurrency,
+            **filters,
+        )
+        # Projects are managed as they are discovered
+        projects = profiling.timed(projects, "discovery")
+        if promote:
+            projects = remember_paths(projects, project_paths)
+        if args.shard is not None:
+            projects = (
+                project for project in projects if in_shard(project.id, args.shard)
+            )
+        if incremental is not None:
+            project_ids = incremental.project_ids(projects)
+        else:
+            project_ids = (project.id for project in projects)
+
+    plans = []
+    # Every project's plan, drifted or not, for --promote
+    planned = {}
+    streamed = 0
+    replayed_rows = []
+    replayed_changes = 0
+
+    journal = open_journal(args, config)
+    if journal is not None:
+        # Projects finished before the run was interrupted keep their results
+        for project_id, entry in journal.completed.items():
+            plan = journal.completed_plan(project_id)
+            if plan:
+                replayed_changes += 1
+                if args.plan_out:
+                    plans.append(plan)
+            if report is not None:
+                report.write(project_id, entry["row"])
+                streamed += 1
+            else:
+                replayed_rows.append(entry["row"])
+
+        if isinstance(project_ids, list):
+            project_ids = [
+                project_id
+                for project_id in project_ids
+                if not journal.is_completed(project_id)
+            ]
+        else:
+            project_ids = (
+                project_id
+                for project_id in project_ids
+                if not journal.is_completed(project_id)
+            )
+
+    def on_result(project_id: str, row: Dict, plan: ProjectPlan) -> None:
+        nonlocal streamed
+        if args.plan_out and plan:
+            plans.append(plan)
+        if promote:
+            planned[project_id] = plan
+        if incremental is not None:
+            incremental.record(project_id, row, plan)
+        if report is not None:
+            report.write(project_id, row)
+            streamed += 1
+        if journal is not None:
+            journal.record_project(project_id, row, plan)
+
+    try:
+        rows, change_count = manage_projects(
+            gl,
+            project_ids,
+            config,
+            fix=args.fix,
+            concurrency=args.concurrency,
+            graphql=args.graphql,
+            on_result=on_result
+            if args.plan_out or incremental or report or journal or promote
+            else None,
+            # Streamed rows have already been written, there's no table to build
+            keep_rows=report is None,
+            journal=journal,
+            # Promoted changes are written once to the group instead
+            apply_changes=not promote,
+            snapshots=snapshots,
         )
-        project_ids = [project.id for project in projects]
+    finally:
+        if journal is not None:
+            journal.close()
+    rows = replayed_rows + rows
+    change_count += replayed_changes
 
-    rows, change_count = manage_projects(gl, project_ids, config, fix=args.fix)
+    if promote:
+        # Projects are counted once, whether their changes end up on the group,
+        # on the project or both
+        drifted_ids = {project_id for project_id, plan in planned.items() if plan}
+        group_plans = promote_plans(gl, args.group_names_or_ids, planned, project_paths)
+        if group_plans:
+            with profiling.span("rendering"):
+                print_table(group_plan_rows(group_plans), fix=args.fix)
+        replaced_writes = sum(group_plan.replaced_writes for group_plan in group_plans)
+        remaining = sum(1 for plan in planned.values() if plan)
+        console.print(
+            f"{len(group_plans)} group-level changes replace {replaced_writes} project writes, "
+            f"{remaining} projects still need project-level changes"
+        )
+        if args.fix:
+            failed_groups = apply_promotion(
+                gl, group_plans, list(planned.values()), concurrency=args.concurrency
+            )
+            for group_plan in failed_groups:
+                console.print(
+                    f"Failed to protect {group_plan.branch_name} on {group_plan.group.full_path}, "
+                    f"its {len(group_plan.plans)} projects weren't changed",
+                    style="red",
+                )
+        change_count = len(drifted_ids)
 
-    table = PrettyTable()
-    table.align = "l"
-    table.field_names = rows[0].keys()
+    if incremental is not None:
+        reused_rows = incremental.reused_rows()
+        console.print(
+            f"Audited {len(rows) + streamed} changed projects, reused results for {len(reused_rows)}"
+        )
+        for project_id, row in reused_rows:
+            if report is not None:
+                report.write(project_id, row)
+                streamed += 1
+            else:
+                rows.append(row)
+        failed = incremental.failed()
+        if failed:
+            console.print(
+                f"{len(failed)} projects couldn't be audited, they will be audited again by the next run",
+                style="red",
+            )
+        incremental.finish()
+        incremental.store.close()
 
-    for row in rows:
-        row_values = [r["value"] for r in row.values()]
-        table.add_row(row_values)
+    if report is None:
+        with profiling.span("rendering"):
+            print_table(rows, fix=args.fix)
+    project_count = len(rows) + streamed
 
-    print(table)
     if args.fix:
         console.print(
-            f"Changes have been applied to {change_count}/{len(project_ids)} projects",
+            f"Changes have been applied to {change_count}/{project_count} projects",
             style="green",
         )
     else:
         console.print(
-            f"Changes would be applied to {change_count}/{len(project_ids)} projects. Use the --fix flag to apply changes",
+            f"Changes would be applied to {change_count}/{project_count} projects. Use the --fix flag to apply changes",
             style="yellow",
         )
 
+    if args.plan_out:
+        write_plan_file(args.plan_out, plans, config["GITLAB_URL"])
+        console.print(
+            f"Plan for {len(plans)} projects written to {args.plan_out}. Run it with: gitlab-config apply {args.plan_out}"
+        )
+
 
 def app() -> None:
     return main(sys.argv[1:], get_config())
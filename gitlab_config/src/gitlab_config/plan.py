@@ -0,0 +1,452 @@
+import hashlib
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Dict, List
+
+import gitlab
+
+from gitlab_config.profiling import span
+
+if TYPE_CHECKING:
+    from gitlab_config.journal import Journal
+
+logger = logging.getLogger(__name__)
+
+# Resources a plan can write to. Protected branches are one resource per branch,
+# keyed as "protected_branches/<branch name>", approval rules one per rule, keyed
+# as "approval_rules/<rule name>".
+PROJECT = "project"
+PUSH_RULE = "push_rule"
+PROTECTED_BRANCHES = "protected_branches"
+APPROVAL_RULES = "approval_rules"
+
+# Version 2 replaced the single protected branch access levels with lists
+PLAN_FILE_VERSION = 2
+
+
+def protected_branch_resource(branch_name: str) -> str:
+    return f"{PROTECTED_BRANCHES}/{branch_name}"
+
+
+# Access levels a protected branch grants a role, as GitLab describes them
+ACCESS_LEVEL_DESCRIPTIONS = {
+    "No one": gitlab.const.AccessLevel.NO_ACCESS.value,
+    "Developers + Maintainers": gitlab.const.AccessLevel.DEVELOPER.value,
+    "Maintainers": gitlab.const.AccessLevel.MAINTAINER.value,
+    "Administrators": gitlab.const.AccessLevel.ADMIN.value,
+}
+
+# Protected branch attributes a plan compares, and the key that updates them
+# through the protected branches PATCH endpoint
+ACCESS_LEVEL_ATTRIBUTES = {
+    "merge_access_levels": "allowed_to_merge",
+    "push_access_levels": "allowed_to_push",
+}
+PROTECTED_BRANCH_ATTRIBUTES = (*ACCESS_LEVEL_ATTRIBUTES, "allow_force_push")
+
+
+def access_levels(levels: List[Dict]) -> List[int]:
+    return sorted(level["access_level"] for level in levels)
+
+
+def access_level_values(expected: Any) -> List[int]:
+    """Access levels from the config, given as descriptions or integers."""
+    if not isinstance(expected, list):
+        expected = [expected]
+
+    values = []
+    for level in expected:
+        if isinstance(level, str) and level in ACCESS_LEVEL_DESCRIPTIONS:
+            values.append(ACCESS_LEVEL_DESCRIPTIONS[level])
+        elif isinstance(level, int):
+            values.append(level)
+        else:
+            raise ValueError(
+                f"Unknown access level '{level}', expected an integer or one of: {', '.join(ACCESS_LEVEL_DESCRIPTIONS)}"
+            )
+    return sorted(values)
+
+
+def access_level_description(level: int) -> str:
+    """The description GitLab shows for an access level."""
+    for description, value in ACCESS_LEVEL_DESCRIPTIONS.items():
+        if value == level:
+            return description
+    return str(level)
+
+
+def access_level_entries(levels: List[Dict]) -> List[Dict]:
+    """The access levels with the ids a PATCH needs to remove them.
+
+    Ids are None when the levels were read through GraphQL.
+    """
+    return [
+        {"id": level.get("id"), "access_level": level["access_level"]}
+        for level in levels
+    ]
+
+
+def protected_branch_state(branch) -> Dict[str, Any]:
+    """The attributes of a protected branch a plan compares, or None if unprotected."""
+    if branch is None:
+        return {attribute: None for attribute in PROTECTED_BRANCH_ATTRIBUTES}
+    return {
+        "merge_access_levels": access_levels(branch.merge_access_levels),
+        "push_access_levels": access_levels(branch.push_access_levels),
+        "allow_force_push": branch.allow_force_push,
+    }
+
+
+def protected_branch_create(branch_name: str, data: Dict[str, Any]) -> Dict:
+    """Data to protect an unprotected branch."""
+    create = {"name": branch_name}
+    for attribute, allowed_key in ACCESS_LEVEL_ATTRIBUTES.items():
+        levels = data.get(attribute)
+        if not levels:
+            continue
+        create[attribute.removesuffix("s")] = levels[0]
+        if len(levels) > 1:
+            create[allowed_key] = [{"access_level": level} for level in levels[1:]]
+    if "allow_force_push" in data:
+        create["allow_force_push"] = data["allow_force_push"]
+    return create
+
+
+def protected_branch_update(changes: Dict[str, Dict[str, Any]]) -> Dict:
+    """PATCH data that adds and removes access levels to reach the desired state."""
+    update = {}
+    for attribute, allowed_key in ACCESS_LEVEL_ATTRIBUTES.items():
+        if attribute not in changes:
+            continue
+        desired = changes[attribute]["desired"]
+
+        kept = set()
+        allowed = []
+        for entry in changes[attribute].get("entries") or []:
+            if entry["access_level"] in desired and entry["access_level"] not in kept:
+                kept.add(entry["access_level"])
+            else:
+                allowed.append({"id": entry["id"], "_destroy": True})
+        allowed += [{"access_level": level} for level in desired if level not in kept]
+        update[allowed_key] = allowed
+
+    if "allow_force_push" in changes:
+        update["allow_force_push"] = changes["allow_force_push"]["desired"]
+    return update
+
+
+def approval_rule_resource(rule_name: str) -> str:
+    return f"{APPROVAL_RULES}/{rule_name}"
+
+
+# Approval rule attributes a plan compares, named as the approval rules API
+# takes them
+APPROVAL_RULE_ATTRIBUTES = (
+    "approvals_required",
+    "applies_to_all_protected_branches",
+    "user_ids",
+)
+
+
+def approval_rule_state(rule) -> Dict[str, Any]:
+    """The attributes of an approval rule a plan compares, or None if it doesn't exist."""
+    if rule is None:
+        return {attribute: None for attribute in APPROVAL_RULE_ATTRIBUTES}
+    return {
+        "approvals_required": rule.approvals_required,
+        "applies_to_all_protected_branches": rule.applies_to_all_protected_branches,
+        "user_ids": sorted(user["id"] for user in rule.users),
+    }
+
+
+def approval_rule_values(spec: Dict, user_ids: Dict[str, int]) -> Dict[str, Any]:
+    """The attributes of an approval rule from the config.
+
+    Approvers are given by username, those missing from ``user_ids`` are left out.
+    """
+    return {
+        "approvals_required": spec.get("approvals_required", 1),
+        "applies_to_all_protected_branches": spec.get(
+            "applies_to_all_protected_branches", True
+        ),
+        "user_ids": sorted(
+            user_ids[username]
+            for username in spec.get("users", [])
+            if username in user_ids
+        ),
+    }
+
+
+def approval_rule_id(changes: Dict[str, Dict[str, Any]]) -> int:
+    """The id of the rule behind the changes, kept as their only entry."""
+    for change in changes.values():
+        if change.get("entries"):
+            return change["entries"][0]["id"]
+    raise ValueError("Approval rule changes don't hold the id of the rule")
+
+
+def fingerprint(state: Dict[str, Dict[str, Any]]) -> str:
+    encoded = json.dumps(state, sort_keys=True, default=str).encode()
+    return hashlib.sha256(encoded).hexdigest()
+
+
+class ProjectPlan:
+    """Every change the reconciler wants to make to one project.
+
+    Changes are grouped by the resource they are written to so that applying the
+    plan issues at most one write per resource, containing only the attributes
+    that drifted.
+    """
+
+    def __init__(self, project_id: int, project_name: str | None = None):
+        self.project_id = project_id
+        self.project_name = project_name
+        self.changes: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        # Desired value of every managed attribute, drifted or not. Only kept
+        # in memory, it isn't part of a plan file.
+        self.expected: Dict[str, Dict[str, Any]] = {}
+
+    def expect(self, resource: str, attribute: str, desired: Any) -> None:
+        self.expected.setdefault(resource, {})[attribute] = desired
+
+    def add(
+        self,
+        resource: str,
+        attribute: str,
+        current: Any,
+        desired: Any,
+        entries: List[Dict] | None = None,
+    ) -> None:
+        """Plan a change. ``entries`` are the ids behind ``current``, the access
+        levels of a protected branch or the approval rule itself, which are kept
+        with the change but aren't part of its fingerprint.
+        """
+        self.expect(resource, attribute, desired)
+        change = {"current": current, "desired": desired}
+        if entries is not None:
+            change["entries"] = entries
+        self.changes.setdefault(resource, {})[attribute] = change
+
+    def desired(self, resource: str) -> Dict[str, Any]:
+        return {
+            attribute: change["desired"]
+            for attribute, change in self.changes.get(resource, {}).items()
+        }
+
+    def current(self) -> Dict[str, Dict[str, Any]]:
+        return {
+            resource: {
+                attribute: change["current"] for attribute, change in changes.items()
+            }
+            for resource, changes in self.changes.items()
+        }
+
+    def fingerprint(self) -> str:
+        return fingerprint(self.current())
+
+    def to_dict(self) -> Dict:
+        return {
+            "project_id": self.project_id,
+            "project": self.project_name,
+            "fingerprint": self.fingerprint(),
+            "changes": self.changes,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "ProjectPlan":
+        plan = cls(data["project_id"], data.get("project"))
+        plan.changes = data["changes"]
+        if plan.fingerprint() != data["fingerprint"]:
+            raise ValueError(
+                f"Plan for project {plan.project_id} doesn't match its fingerprint"
+            )
+        return plan
+
+    def __bool__(self) -> bool:
+        return bool(self.changes)
+
+    def __repr__(self) -> str:
+        return f"ProjectPlan({self.project_id!r}, {self.changes!r})"
+
+
+def apply_plan(
+    gl: gitlab.Gitlab, plan: ProjectPlan, journal: "Journal | None" = None
+) -> None:
+    """Write the plan, one request per resource.
+
+    With a journal, writes it already holds for the project are skipped and
+    every successful write is recorded before the next one is made.
+    """
+    # A lazy project gives access to the sub-resource managers without a request
+    project = gl.projects.get(plan.project_id, lazy=True)
+
+    for resource, changes in plan.changes.items():
+        data = plan.desired(resource)
+        if journal is not None and journal.is_applied(plan.project_id, resource, data):
+            logger.info(
+                f"Skipping {resource} for project {plan.project_id}, already applied"
+            )
+            continue
+
+        logger.info(f"Updating {resource} for project {plan.project_id}: {data}")
+
+        if resource == PROJECT:
+            gl.projects.update(plan.project_id, data)
+        elif resource == PUSH_RULE:
+            project.pushrules.update(new_data=data)
+        elif resource.startswith(f"{PROTECTED_BRANCHES}/"):
+            branch_name = resource.removeprefix(f"{PROTECTED_BRANCHES}/")
+            if all(change["current"] is None for change in changes.values()):
+                project.protectedbranches.create(
+                    protected_branch_create(branch_name, data)
+                )
+            else:
+                # Access levels are added and removed in place, so the branch
+                # stays protected throughout
+                changes = with_access_level_ids(project, branch_name, changes)
+                project.protectedbranches.update(
+                    branch_name, protected_branch_update(changes)
+                )
+        elif resource.startswith(f"{APPROVAL_RULES}/"):
+            rule_name = resource.removeprefix(f"{APPROVAL_RULES}/")
+            if all(change["current"] is None for change in changes.values()):
+                project.approvalrules.create({"name": rule_name, **data})
+            elif all(change["desired"] is None for change in changes.values()):
+                # Rules that aren't configured are removed
+                project.approvalrules.delete(approval_rule_id(changes))
+            else:
+                project.approvalrules.update(approval_rule_id(changes), data)
+        else:
+            raise ValueError(f"Unknown plan resource: {resource}")
+
+        if journal is not None:
+            journal.record_write(plan.project_id, resource, data)
+
+
+def with_access_level_ids(
+    project, branch_name: str, changes: Dict[str, Dict[str, Any]]
+) -> Dict[str, Dict[str, Any]]:
+    """Fill in access level ids that a GraphQL read couldn't provide."""
+    entries = [
+        entry
+        for attribute in ACCESS_LEVEL_ATTRIBUTES
+        for entry in changes.get(attribute, {}).get("entries") or []
+    ]
+    if all(entry["id"] is not None for entry in entries):
+        return changes
+
+    branch = project.protectedbranches.get(branch_name)
+    changes = {attribute: dict(change) for attribute, change in changes.items()}
+    for attribute in ACCESS_LEVEL_ATTRIBUTES:
+        if "entries" in changes.get(attribute, {}):
+            changes[attribute]["entries"] = access_level_entries(
+                getattr(branch, attribute)
+            )
+    return changes
+
+
+def read_current_state(gl: gitlab.Gitlab, plan: ProjectPlan) -> Dict:
+    """Re-read only the resources and attributes a plan will write."""
+    project = gl.projects.get(plan.project_id, lazy=True)
+
+    state = {}
+    for resource, changes in plan.changes.items():
+        if resource == PROJECT:
+            current = gl.projects.get(plan.project_id)
+            values = {attribute: getattr(current, attribute) for attribute in changes}
+        elif resource == PUSH_RULE:
+            current = project.pushrules.get()
+            values = {attribute: getattr(current, attribute) for attribute in changes}
+        elif resource.startswith(f"{PROTECTED_BRANCHES}/"):
+            branch_name = resource.removeprefix(f"{PROTECTED_BRANCHES}/")
+            try:
+                branch = project.protectedbranches.get(branch_name)
+            except gitlab.exceptions.GitlabGetError as e:
+                if e.response_code != 404:
+                    raise
+                branch = None
+            branch_state = protected_branch_state(branch)
+            values = {attribute: branch_state[attribute] for attribute in changes}
+        elif resource.startswith(f"{APPROVAL_RULES}/"):
+            rule_name = resource.removeprefix(f"{APPROVAL_RULES}/")
+            rules = {
+                rule.name: rule for rule in project.approvalrules.list(get_all=True)
+            }
+            rule_state = approval_rule_state(rules.get(rule_name))
+            values = {attribute: rule_state[attribute] for attribute in changes}
+        else:
+            raise ValueError(f"Unknown plan resource: {resource}")
+        state[resource] = values
+    return state
+
+
+def write_plan_file(filename: Path, plans: List[ProjectPlan], gitlab_url: str) -> None:
+    with open(filename, "w") as f:
+        json.dump(
+            {
+                "version": PLAN_FILE_VERSION,
+                "created_at": datetime.now(timezone.utc).isoformat(),
+                "gitlab_url": gitlab_url,
+                "projects": [plan.to_dict() for plan in plans],
+            },
+            f,
+            indent=2,
+        )
+
+
+def load_plan_file(filename: Path) -> Dict:
+    try:
+        with open(filename, "r") as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        raise FileNotFoundError(f"Plan file '{filename}' not found.")
+    except json.JSONDecodeError as e:
+        raise ValueError(f"Failed to parse plan file '{filename}' as JSON: {str(e)}")
+
+    if data.get("version") != PLAN_FILE_VERSION:
+        raise ValueError(
+            f"Unsupported plan file version '{data.get('version')}' in '{filename}'"
+        )
+
+    data["projects"] = [ProjectPlan.from_dict(plan) for plan in data["projects"]]
+    return data
+
+
+def apply_planned_project(gl: gitlab.Gitlab, plan: ProjectPlan) -> tuple[Dict, bool]:
+    row = {
+        "project": {"value": plan.project_name or plan.project_id},
+        "changes": {"value": ", ".join(sorted(plan.changes))},
+    }
+
+    try:
+        with span("verify_plan"):
+            current_state = read_current_state(gl, plan)
+        if fingerprint(current_state) != plan.fingerprint():
+            # Something else changed the project since the plan was made
+            row["status"] = {"value": "stale, skipped"}
+            return (row, False)
+
+        with span("apply_plan"):
+            apply_plan(gl, plan)
+        row["status"] = {"value": "applied"}
+        return (row, True)
+    except Exception as e:
+        logging.exception(e)
+        row["status"] = {"value": "failed"}
+        return (row, False)
+
+
+def apply_plans(
+    gl: gitlab.Gitlab, plans: List[ProjectPlan], concurrency: int = 1
+) -> tuple[List[Dict], int]:
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(
+            executor.map(lambda plan: apply_planned_project(gl, plan), plans)
+        )
+
+    rows = [row for row, _ in results]
+    change_count = sum(1 for _, applied in results if applied)
+    return (rows, change_count)
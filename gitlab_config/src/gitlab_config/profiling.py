@@ -0,0 +1,257 @@
+import json
+import math
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List
+from urllib.parse import urlsplit
+
+import requests
+from prettytable import PrettyTable
+
+# Path segments that follow one of these collections are names, not ids
+NAMED_COLLECTIONS = {"protected_branches", "branches", "tags", "files"}
+# Segments in an id position that are part of the endpoint itself
+LITERAL_SEGMENTS = {"all"}
+
+# python-gitlab retries these when obey_rate_limit / retry_transient_errors are set
+RETRIED_STATUS_CODES = {429, 500, 502, 503, 504}
+
+_active_profiler = None
+
+
+def endpoint_template(url: str) -> str:
+    """Collapse ids and names in a GitLab API URL, e.g. ``/projects/:id/push_rule``."""
+    path = urlsplit(url).path
+    if path.endswith("/api/graphql"):
+        return "/graphql"
+    path = path.split("/api/v4", 1)[-1]
+
+    segments = path.strip("/").split("/")
+    for i in range(1, len(segments), 2):
+        if segments[i] in LITERAL_SEGMENTS:
+            continue
+        segments[i] = ":name" if segments[i - 1] in NAMED_COLLECTIONS else ":id"
+    return "/" + "/".join(segments)
+
+
+def percentile(values: List[float], p: float) -> float:
+    """Nearest-rank percentile of values, which must be sorted."""
+    if not values:
+        return 0.0
+    return values[max(0, math.ceil(p / 100 * len(values)) - 1)]
+
+
+class Profiler:
+    """Collects per-request metrics and timed spans for one run.
+
+    Requests are observed through a response hook on the python-gitlab session,
+    so every attempt is counted, including the ones python-gitlab retries. Spans mark phases of the run (discovery, reconciling, rendering)
+    and, together with the requests, can be written as a Chrome trace.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.requests: List[Dict] = []
+        self.spans: List[Dict] = []
+        self._lock = threading.Lock()
+        self._thread_state = threading.local()
+
+    def instrument(self, session: requests.Session) -> None:
+        session.hooks["response"].append(self._on_response)
+
+    def _on_response(self, response: requests.Response, *args, **kwargs) -> None:
+        ended = time.perf_counter()
+        duration = response.elapsed.total_seconds()
+        request = response.request
+
+        if kwargs.get("stream"):
+            received = int(response.headers.get("Content-Length") or 0)
+        else:
+            received = len(response.content or b"")
+        sent = len(request.body or b"")
+
+        # A request for the same URL straight after a retryable failure on this
+        # thread is python-gitlab retrying it
+        key = (request.method, request.url)
+        retry = getattr(self._thread_state, "failed", None) == key
+        self._thread_state.failed = (
+            key if response.status_code in RETRIED_STATUS_CODES else None
+        )
+
+        with self._lock:
+            self.requests.append(
+                {
+                    "endpoint": f"{request.method} {endpoint_template(request.url)}",
+                    "status": response.status_code,
+                    "start": ended - duration,
+                    "duration": duration,
+                    "sent": sent,
+                    "received": received,
+                    "retry": retry,
+                    "thread": threading.get_ident(),
+                }
+            )
+
+    def add_span(self, name: str, start: float, end: float) -> None:
+        with self._lock:
+            self.spans.append(
+                {
+                    "name": name,
+                    "start": start,
+                    "duration": end - start,
+                    "thread": threading.get_ident(),
+                }
+            )
+
+    def summary(self) -> Dict:
+        wall_time = time.perf_counter() - self.started
+
+        endpoints = defaultdict(list)
+        for request in self.requests:
+            endpoints[request["endpoint"]].append(request)
+
+        phases = defaultdict(lambda: {"calls": 0, "total": 0.0})
+        for item in self.spans:
+            phases[item["name"]]["calls"] += 1
+            phases[item["name"]]["total"] += item["duration"]
+
+        durations = sorted(request["duration"] for request in self.requests)
+        return {
+            "wall_time": wall_time,
+            "requests": len(self.requests),
+            "bytes_sent": sum(request["sent"] for request in self.requests),
+            "bytes_received": sum(request["received"] for request in self.requests),
+            "throttled": sum(
+                1 for request in self.requests if request["status"] == 429
+            ),
+            "retries": sum(1 for request in self.requests if request["retry"]),
+            "p50": percentile(durations, 50),
+            "p95": percentile(durations, 95),
+            "p99": percentile(durations, 99),
+            "endpoints": {
+                endpoint: {
+                    "count": len(requests),
+                    "p50": percentile(sorted(r["duration"] for r in requests), 50),
+                    "p95": percentile(sorted(r["duration"] for r in requests), 95),
+                    "p99": percentile(sorted(r["duration"] for r in requests), 99),
+                    "received": sum(r["received"] for r in requests),
+                }
+                for endpoint, requests in endpoints.items()
+            },
+            "phases": dict(phases),
+        }
+
+    def print_report(self) -> None:
+        summary = self.summary()
+
+        table = PrettyTable()
+        table.align = "l"
+        table.field_names = [
+            "endpoint",
+            "requests",
+            "p50 ms",
+            "p95 ms",
+            "p99 ms",
+            "KB in",
+        ]
+        for endpoint, stats in sorted(
+            summary["endpoints"].items(), key=lambda item: -item[1]["count"]
+        ):
+            table.add_row(
+                [
+                    endpoint,
+                    stats["count"],
+                    f"{stats['p50'] * 1000:.0f}",
+                    f"{stats['p95'] * 1000:.0f}",
+                    f"{stats['p99'] * 1000:.0f}",
+                    f"{stats['received'] / 1024:.1f}",
+                ]
+            )
+        print(table)
+
+        # Spans on worker threads overlap, so phases can add up to more than
+        # the wall time when running concurrently
+        table = PrettyTable()
+        table.align = "l"
+        table.field_names = ["phase", "calls", "total s", "% of wall time"]
+        for name, phase in summary["phases"].items():
+            table.add_row(
+                [
+                    name,
+                    phase["calls"],
+                    f"{phase['total']:.2f}",
+                    f"{phase['total'] / summary['wall_time'] * 100:.0f}",
+                ]
+            )
+        print(table)
+
+        print(
+            f"{summary['requests']} requests in {summary['wall_time']:.2f}s, "
+            f"latency p50 {summary['p50'] * 1000:.0f}ms / p95 {summary['p95'] * 1000:.0f}ms / p99 {summary['p99'] * 1000:.0f}ms, "
+            f"{summary['bytes_sent'] / 1024:.1f} KB sent, {summary['bytes_received'] / 1024:.1f} KB received, "
+            f"{summary['throttled']} rate limited (429), {summary['retries']} retries"
+        )
+
+    def write_chrome_trace(self, filename: Path) -> None:
+        """Write a trace that chrome://tracing or https://ui.perfetto.dev can open."""
+
+        def event(name: str, category: str, item: Dict, args: Dict | None = None):
+            return {
+                "name": name,
+                "cat": category,
+                "ph": "X",
+                "ts": (item["start"] - self.started) * 1_000_000,
+                "dur": item["duration"] * 1_000_000,
+                "pid": 1,
+                "tid": item["thread"],
+                "args": args or {},
+            }
+
+        events = [event(span["name"], "phase", span) for span in self.spans]
+        events += [
+            event(
+                request["endpoint"],
+                "http",
+                request,
+                {"status": request["status"], "bytes": request["received"]},
+            )
+            for request in self.requests
+        ]
+
+        with open(filename, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+
+def enable(profiler: Profiler | None) -> None:
+    global _active_profiler
+    _active_profiler = profiler
+
+
+@contextmanager
+def span(name: str) -> Iterator[None]:
+    """Time the enclosed block as a phase of the run. Free when not profiling."""
+    profiler = _active_profiler
+    if profiler is None:
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        profiler.add_span(name, start, time.perf_counter())
+
+
+def timed(iterable: Iterable, name: str) -> Iterator:
+    """Yield from iterable, timing each step as a span, e.g. paging through discovery."""
+    iterator = iter(iterable)
+    while True:
+        with span(name):
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+        yield item
@@ -1,15 +1,124 @@
 import logging
-from typing import Dict, List
+from collections import deque
+from collections.abc import Callable, Iterable, Sized
+from concurrent.futures import Future, ThreadPoolExecutor
+from itertools import batched
+from typing import Any, Dict
 
 import gitlab
 from gitlab.v4.objects.projects import Project
 
 from rich.console import Console
 from gitlab_config.colors import Colors, color_cell, colorize
+from gitlab_config.config import ConfigIndex, managed_fields
+from gitlab_config.graphql import (
+    GRAPHQL_BATCH_SIZE,
+    ProjectSnapshot,
+    get_project_snapshots,
+    resolve_usernames,
+)
+from gitlab_config.journal import Journal
+from gitlab_config.plan import (
+    ACCESS_LEVEL_ATTRIBUTES,
+    APPROVAL_RULE_ATTRIBUTES,
+    APPROVAL_RULES,
+    PROJECT,
+    PROTECTED_BRANCH_ATTRIBUTES,
+    PROTECTED_BRANCHES,
+    PUSH_RULE,
+    ProjectPlan,
+    access_level_description,
+    access_level_entries,
+    access_level_values,
+    apply_plan,
+    approval_rule_resource,
+    approval_rule_state,
+    approval_rule_values,
+    protected_branch_resource,
+    protected_branch_state,
+)
+from gitlab_config.profiling import span
 
 console = Console()
 logger = logging.getLogger(__name__)
 
+# API resources, besides the project itself, that a managed field has to read.
+# Only the resources needed by a project's managed fields are fetched.
+FIELD_RESOURCES = {
+    "merge_access_levels": {PROTECTED_BRANCHES},
+    "push_access_levels": {PROTECTED_BRANCHES},
+    "allow_force_push": {PROTECTED_BRANCHES},
+    "prevent_secrets": {PUSH_RULE},
+    "approval_rules": {APPROVAL_RULES},
+}
+
+# Approval rules GitLab maintains itself, which are never managed
+UNMANAGED_RULE_TYPES = {"code_owner", "report_approver"}
+
+
+def required_resources(fields: Iterable[str]) -> set[str]:
+    resources = set()
+    for field in fields:
+        resources |= FIELD_RESOURCES.get(field, set())
+    return resources
+
+
+def output_columns(config: Dict) -> list[str]:
+    """Every column a project's row can have, for reports with a fixed header."""
+    fields = managed_fields(config)
+    columns = ["project", "default_branch"]
+    if PROTECTED_BRANCHES in required_resources(fields):
+        columns.append("protected branches")
+    return columns + fields
+
+
+def get_push_rules(project: Project):
+    """The project's push rules, or None where push rules aren't available."""
+    try:
+        return project.pushrules.get()
+    except gitlab.exceptions.GitlabGetError as e:
+        # Push rules are a Premium feature, other instances answer with a 404
+        if e.response_code != 404:
+            raise
+        logger.info(f"Push rules are not available for project {project.id}")
+        return None
+
+
+def get_approval_rules(project: Project) -> list:
+    return [
+        rule
+        for rule in project.approvalrules.list(get_all=True)
+        if getattr(rule, "rule_type", "regular") not in UNMANAGED_RULE_TYPES
+    ]
+
+
+def approval_rule_usernames(config: Dict) -> set[str]:
+    """Usernames of the approvers anywhere in the config."""
+    return {
+        username
+        for fields in config.values()
+        if isinstance(fields, dict)
+        for rule in fields.get("approval_rules") or []
+        for username in rule.get("users", [])
+    }
+
+
+def resolve_approvers(gl: gitlab.Gitlab, config: Dict) -> Dict[str, int]:
+    """User ids of every approver in the config, looked up once per run."""
+    usernames = approval_rule_usernames(config)
+    if not usernames:
+        return {}
+
+    with span("resolve_approvers"):
+        user_ids = resolve_usernames(gl, sorted(usernames))
+    missing = usernames - set(user_ids)
+    if missing:
+        console.print(
+            f"Approvers not found, they are left out of approval rules: {', '.join(sorted(missing))}",
+            style="yellow",
+        )
+    return user_ids
+
 
 # WIP, there must be a way to generalize the management of rpoject fields
 def manage_project_setting(
@@ -28,17 +137,45 @@ def manage_project_setting(
     }
 
 
-def manage_project_settings(project: Project, config: Dict, fix: bool = False) -> Dict:
-    # Fetch the project by ID to get detailed information, including the default branch
-
-    project_changed = False
-    managed_fields = config.get(project.name, config["default"])
+def output_cell(current: Any, expected: Any, changed: bool, fix: bool) -> Dict:
+    # When fixing, the cell shows the value the project ends up with. Cells hold
+    # raw values, colours are only added when the table is rendered.
+    value = expected if changed and fix else current
+    return {
+        "value": value,
+        "changed": changed,
+    }
 
-    project_changes = []
-    push_rule_changes = []
 
-    protected_branches = project.protectedbranches.list()
-    push_rules = project.pushrules.get()
+def manage_project_settings(
+    project: Project,
+    config: Dict,
+    fix: bool = False,
+    config_index: ConfigIndex | None = None,
+    user_ids: Dict[str, int] | None = None,
+) -> tuple[Dict, ProjectPlan]:
+    """Compare a project against its config and plan the changes needed.
+
+    Nothing is written here, ``fix`` only affects how the output is rendered.
+    The returned plan is empty when the project already matches its config.
+    Pass a ``config_index`` to reuse one compiled index across projects.
+    ``user_ids`` are the user ids of the approvers in the config, by username.
+    """
+    if config_index is None:
+        config_index = ConfigIndex(config)
+    managed_fields = config_index.resolve(project)
+    plan = ProjectPlan(project.id, project.name)
+
+    resources = required_resources(managed_fields)
+    protected_branches = None
+    if PROTECTED_BRANCHES in resources:
+        protected_branches = project.protectedbranches.list()
+    push_rules = None
+    if PUSH_RULE in resources:
+        push_rules = get_push_rules(project)
+    approval_rules = None
+    if APPROVAL_RULES in resources:
+        approval_rules = get_approval_rules(project)
 
     output_fields = {
         "project": {
@@ -47,10 +184,28 @@ def manage_project_settings(project: Project, config: Dict, fix: bool = False) -
         "default_branch": {
             "value": project.default_branch,
         },
-        "protected branches": {
-            "value": ", ".join([b.name for b in protected_branches]),
-        },
     }
+    default_protected_branch = None
+    if protected_branches is not None:
+        output_fields["protected branches"] = {
+            "value": ", ".join([b.name for b in protected_branches]),
+        }
+        for branch in protected_branches:
+            if branch.name != project.default_branch:
+                continue
+            # A protection inherited from the group takes precedence over the
+            # project's own
+            if default_protected_branch is None or getattr(branch, "inherited", False):
+                default_protected_branch = branch
+
+        if default_protected_branch is None:
+            print(
+                colorize(
+                    f"WARNING: The default branch for '{project.path}' is not protected! See: https://docs.gitlab.com/user/project/repository/branches/protected/",
+                    Colors.YELLOW,
+                )
+            )
+    default_branch_state = protected_branch_state(default_protected_branch)
 
     for field, expected in managed_fields.items():
         changed = False
@@ -58,185 +213,296 @@ def manage_project_settings(project: Project, config: Dict, fix: bool = False) -
         if field == "remove_source_branch_after_merge":
             if project.remove_source_branch_after_merge != expected:
                 changed = True
-                project_changes.append(
-                    f"remove_source_branch_after_merge: {project.remove_source_branch_after_merge} -> {expected}"
+                plan.add(
+                    PROJECT,
+                    field,
+                    project.remove_source_branch_after_merge,
+                    expected,
                 )
-                if fix:
-                    project.remove_source_branch_after_merge = expected
 
-            output_fields[field] = {
-                "value": color_cell(
-                    project.remove_source_branch_after_merge, changed, fix
-                ),
-                "changed": changed,
-            }
+            output_fields[field] = output_cell(
+                project.remove_source_branch_after_merge, expected, changed, fix
+            )
 
         if field == "only_allow_merge_if_pipeline_succeeds":
             if project.only_allow_merge_if_pipeline_succeeds is not expected:
                 changed = True
-                project_changes.append(
-                    f"only_allow_merge_if_pipeline_succeeds: {project.only_allow_merge_if_pipeline_succeeds} -> {expected}"
+                plan.add(
+                    PROJECT,
+                    field,
+                    project.only_allow_merge_if_pipeline_succeeds,
+                    expected,
                 )
-                if fix:
-                    project.only_allow_merge_if_pipeline_succeeds = expected
-            output_fields[field] = {
-                "value": color_cell(
-                    project.only_allow_merge_if_pipeline_succeeds, changed, fix
-                ),
-                "changed": changed,
-            }
+
+            output_fields[field] = output_cell(
+                project.only_allow_merge_if_pipeline_succeeds, expected, changed, fix
+            )
 
         # Set merge method to FF for projects with a singular 'main' branch only.
         # https://docs.gitlab.com/ee/user/project/merge_requests/methods/#fast-forward-merge
         if field == "merge_method":
             if project.merge_method != "ff" and project.default_branch == "main":
                 changed = True
-                project_changes.append(f"merge_method: {project.default_branch} -> ff")
-                if fix:
-                    project.merge_method = "ff"
+                plan.add(PROJECT, field, project.merge_method, "ff")
 
-            output_fields[field] = {
-                "value": color_cell(project.merge_method, changed, fix),
-                "changed": changed,
-            }
-
-        if field == "merge_access_levels":
-            merge_access_levels_default_branch = []
+            output_fields[field] = output_cell(project.merge_method, "ff", changed, fix)
 
-            default_protected_branch = None
-            for branch in protected_branches:
-                if branch.name == project.default_branch:
-                    default_protected_branch = project.branches.get(branch.name)
-
-                    for level in branch.merge_access_levels:
-                        merge_access_levels_default_branch.append(
-                            level["access_level_description"]
-                        )
+        # Protection of the default branch, each attribute is its own field
+        # https://docs.gitlab.com/user/project/repository/branches/protected/
+        if field in PROTECTED_BRANCH_ATTRIBUTES:
+            current = default_branch_state[field]
+            if field == "allow_force_push":
+                desired = expected
+            else:
+                desired = access_level_values(expected)
 
-            if default_protected_branch is None:
-                print(
-                    colorize(
-                        f"WARNING: The default branch for '{project.path}' is not protected! See: https://docs.gitlab.com/user/project/repository/branches/protected/",
-                        Colors.YELLOW,
-                    )
+            if project.default_branch is not None:
+                plan.expect(
+                    protected_branch_resource(project.default_branch), field, desired
                 )
-
-            try:
-                if (
-                    len(merge_access_levels_default_branch) != 1
-                    or merge_access_levels_default_branch[0]
-                    != "Developers + Maintainers"
-                ):
-                    changed = True
-                    project_changes.append(
-                        f"Merge rule: {project.squash_option} -> default_on"
+            if project.default_branch is not None and current != desired:
+                changed = True
+                entries = None
+                if field in ACCESS_LEVEL_ATTRIBUTES and default_protected_branch:
+                    entries = access_level_entries(
+                        getattr(default_protected_branch, field)
                     )
+                plan.add(
+                    protected_branch_resource(project.default_branch),
+                    field,
+                    current,
+                    desired,
+                    entries=entries,
+                )
 
-                    if fix:
-                        project.protectedbranches.delete(default_protected_branch.name)
-                        project.protectedbranches.create(
-                            {
-                                "name": default_protected_branch.name,
-                                "merge_access_level": gitlab.const.AccessLevel.DEVELOPER,
-                                "push_access_level": gitlab.const.AccessLevel.NO_ACCESS,
-                                "allow_force_push": False,
-                            }
-                        )
-            except TypeError as e:
-                logging.exception(e)
-
-            output_fields[field] = {
-                "value": ",".join(merge_access_levels_default_branch),
-                "changed": changed,
-            }
+            if field == "allow_force_push":
+                output_fields[field] = output_cell(current, desired, changed, fix)
+            elif changed and fix:
+                output_fields[field] = {
+                    "value": ",".join(
+                        access_level_description(level) for level in desired
+                    ),
+                    "changed": changed,
+                }
+            else:
+                levels = []
+                if default_protected_branch is not None:
+                    levels = getattr(default_protected_branch, field)
+                output_fields[field] = {
+                    "value": ",".join(
+                        level["access_level_description"] for level in levels
+                    ),
+                    "changed": changed,
+                }
 
         # Enable squash and merge by default (can be opted out of)
         # https://docs.gitlab.com/ee/user/project/merge_requests/squash_and_merge.html#set-default-squash-options-for-a-merge-request
         if field == "squash_option":
             if project.squash_option != expected:
                 changed = True
-                project_changes.append(
-                    f"squash_options: {project.squash_option} -> {expected}"
-                )
-                if fix:
-                    project.squash_option = expected
+                plan.add(PROJECT, field, project.squash_option, expected)
 
-            output_fields[field] = {
-                "value": color_cell(project.squash_option, changed, fix),
-                "changed": changed,
-            }
+            output_fields[field] = output_cell(
+                project.squash_option, expected, changed, fix
+            )
 
         if field == "merge_requests_template":
             if project.merge_requests_template != expected:
                 changed = True
-                project_changes.append(
-                    "merge_requests_template: updated from template file"
-                )
+                plan.add(PROJECT, field, project.merge_requests_template, expected)
 
-                if fix:
-                    project.merge_requests_template = expected
+            template = expected if changed and fix else project.merge_requests_template
 
             # Curate the output so it doesn't break table
-            if project.merge_requests_template is None:
-                output = project.merge_requests_template
-            elif project.merge_requests_template != expected:
+            if template is None:
+                output = template
+            elif template != expected:
                 output = "Unexpected Template"
             else:
                 output = "Template matches configuration"
 
             output_fields[field] = {
-                "value": color_cell(output, changed, fix),
+                "value": output,
                 "changed": changed,
             }
 
         # Prevent pushing secret files
         # https://docs.gitlab.com/ee/user/project/repository/push_rules.html#prevent-pushing-secrets-to-the-repository
         if field == "prevent_secrets":
+            if push_rules is None:
+                output_fields[field] = {"value": "not available", "changed": False}
+                continue
+
             if push_rules.prevent_secrets is not expected:
                 changed = True
-                push_rule_changes.append(
-                    f"prevent_secrets: {push_rules.prevent_secrets} -> {expected}"
-                )
-                if fix:
-                    push_rules.prevent_secrets = expected
-
-            output_fields[field] = {
-                "value": color_cell(push_rules.prevent_secrets, changed, fix),
-                "changed": changed,
+                plan.add(PUSH_RULE, field, push_rules.prevent_secrets, expected)
+
+            output_fields[field] = output_cell(
+                push_rules.prevent_secrets, expected, changed, fix
+            )
+
+        # Merge request approval rules, matched by name. Rules that aren't
+        # configured are deleted, each rule is written on its own.
+        # https://docs.gitlab.com/api/merge_request_approvals/#project-approval-rules
+        if field == "approval_rules":
+            rules = {rule.name: rule for rule in approval_rules}
+            desired_rules = {
+                spec["name"]: approval_rule_values(spec, user_ids or {})
+                for spec in expected or []
             }
+            for name in dict.fromkeys([*rules, *desired_rules]):
+                current = approval_rule_state(rules.get(name))
+                desired = desired_rules.get(name, approval_rule_state(None))
+                # Updating or deleting a rule needs its id
+                entries = [{"id": rules[name].id}] if name in rules else None
+                for attribute in APPROVAL_RULE_ATTRIBUTES:
+                    if current[attribute] != desired[attribute]:
+                        changed = True
+                        plan.add(
+                            approval_rule_resource(name),
+                            attribute,
+                            current[attribute],
+                            desired[attribute],
+                            entries=entries,
+                        )
 
-        if push_rule_changes:
-            project_changed = True
-            if fix:
-                push_rules.save()
+            output_fields[field] = output_cell(
+                ", ".join(rules), ", ".join(desired_rules), changed, fix
+            )
 
-        if project_changes:
-            project_changed = True
-            if fix:
-                project.save()
+    return (output_fields, plan)
 
-    return (output_fields, project_changed)
+
+def manage_project(
+    gl: gitlab.Gitlab,
+    project_id: str,
+    config: Dict,
+    fix: bool = False,
+    progress: str = "",
+    snapshot: ProjectSnapshot | None = None,
+    journal: Journal | None = None,
+    config_index: ConfigIndex | None = None,
+    apply_changes: bool = True,
+    user_ids: Dict[str, int] | None = None,
+) -> tuple[Dict, ProjectPlan] | None:
+    try:
+        if user_ids is None:
+            user_ids = resolve_approvers(gl, config)
+        with span("get_project"):
+            project = snapshot or gl.projects.get(project_id)
+        print(f"Managing project {progress}: [{project.id}] {project.path}")
+        with span("manage_project_settings"):
+            row, plan = manage_project_settings(
+                project,
+                config,
+                fix=fix,
+                config_index=config_index,
+                user_ids=user_ids,
+            )
+        if fix and apply_changes and plan:
+            with span("apply_plan"):
+                apply_plan(gl, plan, journal=journal)
+        return (row, plan)
+    except Exception as e:
+        logging.exception(e)
+        return None
 
 
 def manage_projects(
     gl: gitlab.Gitlab,
-    project_ids: List[str],
+    project_ids: Iterable[str],
     config: Dict,
     fix: bool = False,
+    concurrency: int = 1,
+    graphql: bool = False,
+    on_result: Callable[[str, Dict, ProjectPlan], None] | None = None,
+    keep_rows: bool = True,
+    journal: Journal | None = None,
+    apply_changes: bool = True,
+    snapshots: Dict[str, ProjectSnapshot] | None = None,
 ) -> Dict:
+    """Manage every project, returning the output rows and the number of projects changed.
+
+    ``on_result`` is called with the project id, row and plan of every project
+    that was managed successfully, in project order. Callers that stream rows
+    from ``on_result`` can pass ``keep_rows=False`` so they aren't also held
+    in memory until the end.
+
+    With a ``journal``, writes are checkpointed so a resumed run never
+    applies them twice. With ``apply_changes=False`` rows are rendered as
+    with ``fix`` but the plans are left for the caller to apply.
+
+    ``snapshots`` are projects already read through GraphQL, keyed by string
+    project id, which are managed without being read again.
+    """
     rows = []
     change_count = 0
-    for i, project_id in enumerate(project_ids):
-        project = gl.projects.get(project_id)
-        print(
-            f"Managing project ({i + 1}/{len(project_ids)}): [{project.id}] {project.path}"
-        )
-        try:
-            row, changed = manage_project_settings(project, config, fix=fix)
+    config_index = ConfigIndex(config)
+    known_snapshots = snapshots or {}
+    user_ids = resolve_approvers(gl, config)
+
+    # project_ids may be a generator that is still paging through the API
+    total = len(project_ids) if isinstance(project_ids, Sized) else None
+
+    def collect(project_id: str, future: Future) -> None:
+        nonlocal change_count
+        result = future.result()
+        if result is None:
+            return
+        row, plan = result
+        if keep_rows:
             rows.append(row)
-            if changed:
-                change_count += 1
-        except Exception as e:
-            logging.exception(e)
+        if plan:
+            change_count += 1
+        if on_result is not None:
+            on_result(project_id, row, plan)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        # Futures are collected in submission order, so the table matches
+        # project_ids regardless of which worker finishes first.
+        pending = deque()
+        for batch in batched(enumerate(project_ids, start=1), GRAPHQL_BATCH_SIZE):
+            batch_snapshots = {
+                str(project_id): known_snapshots[str(project_id)]
+                for _, project_id in batch
+                if str(project_id) in known_snapshots
+            }
+            unread = [
+                project_id
+                for _, project_id in batch
+                if str(project_id) not in batch_snapshots
+            ]
+            if graphql and unread:
+                try:
+                    with span("graphql_batch"):
+                        batch_snapshots.update(get_project_snapshots(gl, unread))
+                except Exception as e:
+                    logger.warning(f"Falling back to REST for this batch: {e}")
+
+            for i, project_id in batch:
+                progress = f"({i}/{total})" if total is not None else f"({i})"
+                future = executor.submit(
+                    manage_project,
+                    gl,
+                    project_id,
+                    config,
+                    fix=fix,
+                    progress=progress,
+                    snapshot=batch_snapshots.get(str(project_id)),
+                    journal=journal,
+                    config_index=config_index,
+                    apply_changes=apply_changes,
+                    user_ids=user_ids,
+                )
+                pending.append((project_id, future))
+
+            # Keep roughly one batch in flight while the next one is listed
+            while pending and (
+                pending[0][1].done() or len(pending) > GRAPHQL_BATCH_SIZE
+            ):
+                collect(*pending.popleft())
+
+        while pending:
+            collect(*pending.popleft())
 
     return (rows, change_count)
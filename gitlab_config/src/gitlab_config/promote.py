@@ -0,0 +1,229 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+from typing import Any, Dict, List
+from urllib.parse import quote
+
+import gitlab
+
+from gitlab_config.plan import (
+    ACCESS_LEVEL_ATTRIBUTES,
+    PROTECTED_BRANCH_ATTRIBUTES,
+    PROTECTED_BRANCHES,
+    ProjectPlan,
+    access_level_entries,
+    apply_plan,
+    protected_branch_create,
+    protected_branch_state,
+    protected_branch_update,
+)
+
+logger = logging.getLogger(__name__)
+
+# A group-level setting replacing a single project write isn't worth it
+MIN_REPLACED_WRITES = 2
+
+
+class GroupPlan:
+    """A default branch protection set once on a top-level group.
+
+    Group protections apply to every project in the group and take precedence
+    over the projects' own, so the projects' matching changes are dropped.
+    """
+
+    def __init__(self, group, branch_name: str):
+        self.group = group
+        self.branch_name = branch_name
+        self.changes: Dict[str, Dict[str, Any]] = {}
+        self.replaced_writes = 0
+        # Plans of every project in the group
+        self.plans: List[ProjectPlan] = []
+
+    def desired(self) -> Dict[str, Any]:
+        return {
+            attribute: change["desired"] for attribute, change in self.changes.items()
+        }
+
+    def __bool__(self) -> bool:
+        return bool(self.changes)
+
+
+def get_group_protected_branch(gl: gitlab.Gitlab, group_id: int, branch_name: str):
+    try:
+        branch = gl.http_get(
+            f"/groups/{group_id}/protected_branches/{quote(branch_name, safe='')}"
+        )
+    except gitlab.exceptions.GitlabHttpError as e:
+        if e.response_code != 404:
+            raise
+        return None
+    return SimpleNamespace(**branch)
+
+
+def agreed_protection(resource: str, plans: List[ProjectPlan]) -> Dict | None:
+    """The protection every project expects for the branch, if they all agree.
+
+    Every attribute has to be managed for every project, otherwise the
+    group's protection would impose GitLab's defaults on the projects.
+    """
+    expected = [plan.expected.get(resource) for plan in plans]
+    if any(
+        protection is None or set(protection) != set(PROTECTED_BRANCH_ATTRIBUTES)
+        for protection in expected
+    ):
+        return None
+    if any(protection != expected[0] for protection in expected[1:]):
+        return None
+    return expected[0]
+
+
+def plan_group(gl: gitlab.Gitlab, group, plans: List[ProjectPlan]) -> GroupPlan | None:
+    resources = {
+        resource
+        for plan in plans
+        for resource in plan.expected
+        if resource.startswith(f"{PROTECTED_BRANCHES}/")
+    }
+    # Every project has to protect the same default branch
+    if len(resources) != 1:
+        return None
+    resource = resources.pop()
+
+    desired = agreed_protection(resource, plans)
+    if desired is None:
+        return None
+
+    drifted = [plan for plan in plans if resource in plan.changes]
+    if len(drifted) < MIN_REPLACED_WRITES:
+        return None
+
+    group_plan = GroupPlan(group, resource.removeprefix(f"{PROTECTED_BRANCHES}/"))
+    branch = get_group_protected_branch(gl, group.id, group_plan.branch_name)
+    current = protected_branch_state(branch)
+    for attribute, value in desired.items():
+        if current[attribute] == value:
+            continue
+        change = {"current": current[attribute], "desired": value}
+        if branch is not None and attribute in ACCESS_LEVEL_ATTRIBUTES:
+            change["entries"] = access_level_entries(getattr(branch, attribute))
+        group_plan.changes[attribute] = change
+
+    # When the group already has this protection, the projects' drift isn't
+    # explained by it, so they keep their own changes
+    if not group_plan:
+        return None
+
+    for plan in drifted:
+        del plan.changes[resource]
+    group_plan.replaced_writes = len(drifted)
+    group_plan.plans = plans
+    return group_plan
+
+
+def promote_plans(
+    gl: gitlab.Gitlab,
+    group_names_or_ids: List[str],
+    plans: Dict[Any, ProjectPlan],
+    project_paths: Dict[Any, str],
+) -> List[GroupPlan]:
+    """Move protected branch changes that every project of a group shares to the group.
+
+    ``plans`` are the plans of every project in the groups, keyed by project
+    id, and are modified in place.
+    """
+    group_plans = []
+    for group_name_or_id in group_names_or_ids:
+        group = gl.groups.get(group_name_or_id, simple=True)
+        if group.parent_id is not None:
+            logger.info(
+                f"Not promoting to {group.full_path}, only top-level groups can protect branches"
+            )
+            continue
+
+        prefix = f"{group.full_path}/"
+        group_projects = [
+            plan
+            for project_id, plan in plans.items()
+            if project_paths.get(project_id, "").startswith(prefix)
+        ]
+        if not group_projects:
+            continue
+
+        group_plan = plan_group(gl, group, group_projects)
+        if group_plan is not None:
+            group_plans.append(group_plan)
+    return group_plans
+
+
+def apply_group_plan(gl: gitlab.Gitlab, group_plan: GroupPlan) -> None:
+    path = f"/groups/{group_plan.group.id}/protected_branches"
+    logger.info(
+        f"Updating protected branch {group_plan.branch_name} of group {group_plan.group.full_path}: {group_plan.desired()}"
+    )
+    if all(change["current"] is None for change in group_plan.changes.values()):
+        gl.http_post(
+            path,
+            post_data=protected_branch_create(
+                group_plan.branch_name, group_plan.desired()
+            ),
+        )
+    else:
+        gl.http_patch(
+            f"{path}/{quote(group_plan.branch_name, safe='')}",
+            post_data=protected_branch_update(group_plan.changes),
+        )
+
+
+def apply_promotion(
+    gl: gitlab.Gitlab,
+    group_plans: List[GroupPlan],
+    plans: List[ProjectPlan],
+    concurrency: int = 1,
+) -> List[GroupPlan]:
+    """Write the group changes, then what remains of each project's plan.
+
+    When a group's change fails, its projects are left alone, since their
+    plans no longer hold the changes that were moved to the group. Returns
+    the group plans that failed.
+    """
+    failed = []
+    skipped = set()
+    for group_plan in group_plans:
+        try:
+            apply_group_plan(gl, group_plan)
+        except Exception as e:
+            logging.exception(e)
+            failed.append(group_plan)
+            skipped.update(plan.project_id for plan in group_plan.plans)
+
+    def apply_project(plan: ProjectPlan) -> None:
+        try:
+            apply_plan(gl, plan)
+        except Exception as e:
+            logging.exception(e)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(
+            executor.map(
+                apply_project,
+                [plan for plan in plans if plan and plan.project_id not in skipped],
+            )
+        )
+    return failed
+
+
+def group_plan_rows(group_plans: List[GroupPlan]) -> List[Dict]:
+    return [
+        {
+            "group": {"value": group_plan.group.full_path},
+            "protected branch": {"value": group_plan.branch_name},
+            "changes": {
+                "value": ", ".join(
+                    f"{attribute}: {change['current']} -> {change['desired']}"
+                    for attribute, change in group_plan.changes.items()
+                )
+            },
+            "project writes replaced": {"value": group_plan.replaced_writes},
+        }
+        for group_plan in group_plans
+    ]
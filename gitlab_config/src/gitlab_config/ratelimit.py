@@ -0,0 +1,150 @@
+import logging
+import threading
+import time
+from typing import Mapping
+
+from requests import PreparedRequest, Response
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+
+def _header(headers: Mapping[str, str], name: str) -> float | None:
+    try:
+        return float(headers[name])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+class AdaptiveRateLimiter:
+    """Paces requests to what the GitLab server says it will accept.
+
+    Two limits are adjusted from the ``RateLimit-*`` headers of every response:
+
+    * Requests in flight, using AIMD: grown by roughly one request per round
+      trip while responses are healthy and halved on a 429 or when the remaining
+      budget runs low.
+    * Request rate, using a token bucket refilled at the rate that spreads
+      ``RateLimit-Remaining`` over the time left until ``RateLimit-Reset``.
+      Requests are not paced until the server has reported a budget.
+
+    After a 429 every request waits until ``Retry-After`` (or the reset time)
+    has passed, so retries don't pile onto a server that is already refusing.
+    """
+
+    # Below this share of the window's budget, back off before the server has to
+    LOW_BUDGET_RATIO = 0.1
+
+    def __init__(self, max_concurrency: int = 1, min_rate: float = 0.5):
+        self.max_concurrency = max(1, max_concurrency)
+        self.min_rate = min_rate
+
+        self.concurrency_limit = float(self.max_concurrency)
+        self.rate: float | None = None
+        self.in_flight = 0
+        self.throttled = 0
+
+        self._tokens = 1.0
+        self._refilled_at = time.monotonic()
+        self._paused_until = 0.0
+        self._condition = threading.Condition()
+
+    def _refill(self, now: float) -> None:
+        if self.rate is not None:
+            self._tokens = min(
+                max(self.concurrency_limit, 1.0),
+                self._tokens + (now - self._refilled_at) * self.rate,
+            )
+        self._refilled_at = now
+
+    def acquire(self) -> None:
+        with self._condition:
+            while True:
+                now = time.monotonic()
+                self._refill(now)
+
+                if now < self._paused_until:
+                    wait = self._paused_until - now
+                elif self.in_flight >= int(self.concurrency_limit):
+                    # Woken up by release()
+                    wait = None
+                elif self.rate is not None and self._tokens < 1:
+                    wait = (1 - self._tokens) / self.rate
+                else:
+                    break
+
+                self._condition.wait(timeout=wait)
+
+            self.in_flight += 1
+            if self.rate is not None:
+                self._tokens -= 1
+
+    def release(
+        self, status_code: int | None = None, headers: Mapping[str, str] | None = None
+    ) -> None:
+        with self._condition:
+            self.in_flight -= 1
+            if status_code is not None:
+                self._update(status_code, headers or {})
+            self._condition.notify_all()
+
+    def _decrease(self) -> None:
+        self.concurrency_limit = max(1.0, self.concurrency_limit / 2)
+        if self.rate is not None:
+            self.rate = max(self.min_rate, self.rate / 2)
+
+    def _update(self, status_code: int, headers: Mapping[str, str]) -> None:
+        now = time.monotonic()
+        remaining = _header(headers, "RateLimit-Remaining")
+        limit = _header(headers, "RateLimit-Limit")
+        reset = _header(headers, "RateLimit-Reset")
+        # RateLimit-Reset is a unix timestamp
+        until_reset = max(reset - time.time(), 1.0) if reset is not None else None
+
+        if status_code == 429:
+            self.throttled += 1
+            self._decrease()
+            retry_after = _header(headers, "Retry-After")
+            pause = retry_after if retry_after is not None else until_reset or 1.0
+            self._paused_until = max(self._paused_until, now + pause)
+            logger.warning(
+                f"Rate limited, pausing for {pause:.1f}s with {int(self.concurrency_limit)} requests in flight"
+            )
+            return
+
+        if remaining is None or until_reset is None:
+            return
+
+        budget_rate = max(self.min_rate, remaining / until_reset)
+        if limit and remaining < limit * self.LOW_BUDGET_RATIO:
+            self._decrease()
+            self.rate = min(self.rate or budget_rate, budget_rate)
+            return
+
+        # Additive increase: about one more request in flight per round trip
+        self.concurrency_limit = min(
+            float(self.max_concurrency),
+            self.concurrency_limit + 1 / self.concurrency_limit,
+        )
+        self.rate = (
+            budget_rate if self.rate is None else min(self.rate + 1, budget_rate)
+        )
+
+
+class RateLimitedAdapter(HTTPAdapter):
+    """Passes every request on a session through an AdaptiveRateLimiter."""
+
+    def __init__(self, limiter: AdaptiveRateLimiter, **kwargs):
+        kwargs.setdefault("pool_maxsize", limiter.max_concurrency)
+        super().__init__(**kwargs)
+        self.limiter = limiter
+
+    def send(self, request: PreparedRequest, **kwargs) -> Response:
+        self.limiter.acquire()
+        try:
+            response = super().send(request, **kwargs)
+        except Exception:
+            self.limiter.release()
+            raise
+        self.limiter.release(response.status_code, response.headers)
+        return response
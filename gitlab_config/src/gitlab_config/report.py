@@ -0,0 +1,171 @@
+import abc
+import csv
+import json
+import sys
+from pathlib import Path
+from typing import Any, Dict, List, TextIO
+
+from prettytable import PrettyTable
+
+from gitlab_config.colors import Colors, color_cell, colorize
+
+OUTPUT_FORMATS = ("table", "jsonl", "csv")
+
+# Colours of the status column written by the apply subcommand
+STATUS_COLORS = {
+    "applied": Colors.GREEN,
+    "stale, skipped": Colors.YELLOW,
+    "failed": Colors.RED,
+}
+
+
+def render_cell(column: str, cell: Dict, fix: bool) -> str:
+    """Colour a raw cell for the terminal table."""
+    if column == "status" and cell["value"] in STATUS_COLORS:
+        return colorize(cell["value"], STATUS_COLORS[cell["value"]])
+    if "changed" in cell:
+        return color_cell(cell["value"], cell["changed"], fix)
+    return cell["value"]
+
+
+def print_table(rows: List[Dict], fix: bool = False) -> None:
+    if not rows:
+        return
+
+    # Projects managing different fields have different columns
+    columns = list(dict.fromkeys(column for row in rows for column in row))
+
+    table = PrettyTable()
+    table.align = "l"
+    table.field_names = columns
+
+    for row in rows:
+        table.add_row(
+            [
+                render_cell(column, row[column], fix) if column in row else ""
+                for column in columns
+            ]
+        )
+
+    print(table)
+
+
+def row_changed(row: Dict) -> bool:
+    return any(cell.get("changed") for cell in row.values())
+
+
+class StreamingReport(abc.ABC):
+    def __init__(self, file: TextIO, fix: bool, close_file: bool = False):
+        self.file = file
+        self.fix = fix
+        self.close_file = close_file
+
+    @abc.abstractmethod
+    def write(self, project_id: Any, row: Dict) -> None:
+        """Writes the row of one project."""
+
+    def close(self) -> None:
+        if self.close_file:
+            self.file.close()
+
+
+class JsonlReport(StreamingReport):
+    """Writes one JSON object per project as soon as the project is done."""
+
+    def write(self, project_id: Any, row: Dict) -> None:
+        record = {
+            "project_id": project_id,
+            "changed": row_changed(row),
+            "fix": self.fix,
+            "fields": row,
+        }
+        self.file.write(json.dumps(record, default=str) + "\n")
+        self.file.flush()
+
+
+class CsvReport(StreamingReport):
+    """Writes one CSV line per project as soon as the project is done.
+
+    Projects managing different fields have different columns, so the header
+    is every column a project can have, given up front. Cells a project doesn't
+    have are left empty, the names of the fields that drifted are listed in
+    ``changed_fields``.
+    """
+
+    def __init__(
+        self, file: TextIO, fix: bool, columns: List[str], close_file: bool = False
+    ):
+        super().__init__(file, fix, close_file=close_file)
+        self.columns = columns
+        self.writer = None
+
+    def write(self, project_id: Any, row: Dict) -> None:
+        if self.writer is None:
+            fieldnames = ["project_id", "changed", *self.columns, "changed_fields"]
+            self.writer = csv.DictWriter(self.file, fieldnames=fieldnames, restval="")
+            self.writer.writeheader()
+
+        self.writer.writerow(
+            {
+                "project_id": project_id,
+                "changed": row_changed(row),
+                **{
+                    column: "" if cell["value"] is None else cell["value"]
+                    for column, cell in row.items()
+                },
+                "changed_fields": ";".join(
+                    column for column, cell in row.items() if cell.get("changed")
+                ),
+            }
+        )
+        self.file.flush()
+
+
+def read_reports(filenames: List[Path]) -> List[Dict]:
+    """Records of one or more jsonl reports, ordered by project id.
+
+    A project found in several reports keeps its last record.
+    """
+    records = {}
+    for filename in filenames:
+        with open(filename, "r") as f:
+            for line_number, line in enumerate(f, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError as e:
+                    raise ValueError(
+                        f"Failed to parse line {line_number} of '{filename}' as JSON: {str(e)}"
+                    )
+                records[str(record["project_id"])] = record
+
+    def project_order(record):
+        project_id = str(record["project_id"])
+        return (0, int(project_id), "") if project_id.isdigit() else (1, 0, project_id)
+
+    return sorted(records.values(), key=project_order)
+
+
+REPORT_WRITERS = {"jsonl": JsonlReport, "csv": CsvReport}
+
+
+def open_report(
+    output: str, filename: Path | None, fix: bool, columns: List[str]
+) -> StreamingReport | None:
+    """Open a streaming report, or return None for the table, which is printed at the end.
+
+    Without a filename the report goes to the current stdout. ``columns`` are
+    every column a row can have.
+    """
+    if output == "table":
+        return None
+
+    options = {"fix": fix}
+    if output == "csv":
+        options["columns"] = columns
+    if filename is None:
+        return REPORT_WRITERS[output](sys.stdout, **options)
+    return REPORT_WRITERS[output](
+        open(filename, "w", newline=""), close_file=True, **options
+    )
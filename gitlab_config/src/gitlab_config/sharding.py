@@ -0,0 +1,34 @@
+import zlib
+from argparse import ArgumentTypeError
+from typing import NamedTuple
+
+
+class Shard(NamedTuple):
+    """One of ``count`` shards, numbered from 1 like CI's parallel job index."""
+
+    index: int
+    count: int
+
+    def __str__(self) -> str:
+        return f"{self.index}/{self.count}"
+
+
+def parse_shard(value: str) -> Shard:
+    try:
+        index, count = (int(part) for part in value.split("/"))
+    except ValueError:
+        raise ArgumentTypeError(f"Shard must look like i/N, e.g. 1/4, not '{value}'")
+    if count < 1 or not 1 <= index <= count:
+        raise ArgumentTypeError(f"Shard index must be between 1 and N, not '{value}'")
+    return Shard(index, count)
+
+
+def in_shard(project_id: int | str, shard: Shard | None) -> bool:
+    """Whether the project belongs to the shard.
+
+    The project id is hashed, so the same project always lands in the same
+    shard whichever job, group order or subcommand discovered it.
+    """
+    if shard is None:
+        return True
+    return zlib.crc32(str(project_id).encode()) % shard.count == shard.index - 1
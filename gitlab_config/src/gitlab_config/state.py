@@ -0,0 +1,216 @@
+import hashlib
+import json
+import sqlite3
+from collections.abc import Iterable, Iterator
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List
+
+from gitlab_config.sharding import Shard
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    scope TEXT PRIMARY KEY,
+    started_at TEXT NOT NULL,
+    config_hash TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS projects (
+    scope TEXT NOT NULL,
+    project_id TEXT NOT NULL,
+    last_activity_at TEXT,
+    audited_at TEXT NOT NULL,
+    drifted INTEGER NOT NULL,
+    row TEXT NOT NULL,
+    PRIMARY KEY (scope, project_id)
+);
+"""
+
+
+def config_hash(config: Dict) -> str:
+    # The token isn't part of what is audited, rotating it shouldn't force a full run
+    audited = {key: value for key, value in config.items() if key != "GITLAB_TOKEN"}
+    encoded = json.dumps(audited, sort_keys=True, default=str).encode()
+    return hashlib.sha256(encoded).hexdigest()
+
+
+def groups_scope(
+    group_names_or_ids: List[str],
+    recurse: bool,
+    shard: Shard | None = None,
+    filters: Dict | None = None,
+) -> str:
+    groups = ",".join(sorted(str(group) for group in group_names_or_ids))
+    scope = f"groups:{groups}:recursive={recurse}"
+    if shard is not None:
+        scope += f":shard={shard}"
+    if filters:
+        scope += ":" + json.dumps(filters, sort_keys=True)
+    return scope
+
+
+def utcnow() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+class StateStore:
+    """Remembers audit results between runs so unchanged projects can be skipped.
+
+    Results are kept per scope (the groups a run was asked for) and are only
+    reused while the config they were audited with is unchanged.
+    """
+
+    def __init__(self, filename: Path):
+        self.filename = filename
+        self.connection = sqlite3.connect(filename)
+        self.connection.executescript(SCHEMA)
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def last_run(self, scope: str, config: Dict) -> str | None:
+        """Start time of the last completed run of this scope with this config."""
+        result = self.connection.execute(
+            "SELECT started_at, config_hash FROM runs WHERE scope = ?", (scope,)
+        ).fetchone()
+        if result is None or result[1] != config_hash(config):
+            return None
+        return result[0]
+
+    def finish_run(self, scope: str, started_at: str, config: Dict) -> None:
+        with self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO runs (scope, started_at, config_hash) VALUES (?, ?, ?)",
+                (scope, started_at, config_hash(config)),
+            )
+
+    def clear(self, scope: str) -> None:
+        with self.connection:
+            self.connection.execute("DELETE FROM projects WHERE scope = ?", (scope,))
+
+    def record(
+        self,
+        scope: str,
+        project_id: str,
+        row: Dict,
+        drifted: bool,
+        last_activity_at: str | None = None,
+    ) -> None:
+        with self.connection:
+            # Columns are named, state files from older versions have more of them
+            self.connection.execute(
+                "INSERT OR REPLACE INTO projects (scope, project_id, last_activity_at, audited_at, drifted, row) VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    scope,
+                    str(project_id),
+                    last_activity_at,
+                    utcnow(),
+                    int(drifted),
+                    json.dumps(row, default=str),
+                ),
+            )
+
+    def mark_drifted(self, scope: str, project_id: str) -> None:
+        """Have the project audited again by the next run, keeping its last row."""
+        with self.connection:
+            updated = self.connection.execute(
+                "UPDATE projects SET drifted = 1 WHERE scope = ? AND project_id = ?",
+                (scope, str(project_id)),
+            ).rowcount
+        if not updated:
+            self.record(
+                scope, project_id, {"project": {"value": str(project_id)}}, drifted=True
+            )
+
+    def drifted_project_ids(self, scope: str) -> List[str]:
+        return [
+            project_id
+            for (project_id,) in self.connection.execute(
+                "SELECT project_id FROM projects WHERE scope = ? AND drifted = 1 ORDER BY rowid",
+                (scope,),
+            )
+        ]
+
+    def rows(self, scope: str, exclude: set[str]) -> List[tuple[str, Dict]]:
+        """(project id, row) of the scope's projects, other than the excluded ids."""
+        return [
+            (project_id, json.loads(row))
+            for project_id, row in self.connection.execute(
+                "SELECT project_id, row FROM projects WHERE scope = ? ORDER BY rowid",
+                (scope,),
+            )
+            if project_id not in exclude
+        ]
+
+
+class IncrementalAudit:
+    """Ties one ``groups --incremental`` run to the state store.
+
+    Only projects with activity since the last completed run are listed, plus
+    any that still drifted at the end of it or failed to be audited. Every
+    other project of the scope reuses its stored result.
+
+    GitLab doesn't count a change to a project's settings as activity, so
+    drift introduced that way is only found by a full audit.
+    """
+
+    def __init__(self, store: StateStore, scope: str, config: Dict, fix: bool):
+        self.store = store
+        self.scope = scope
+        self.config = config
+        self.fix = fix
+
+        self.started_at = utcnow()
+        self.last_run = store.last_run(scope, config)
+        self.discovered = {}
+        # Every project handed out for auditing, including stored drifted ones
+        self.listed = set()
+        self.audited = set()
+
+        if self.last_run is None:
+            # First run of this scope, or the config changed: audit everything
+            store.clear(scope)
+
+    def filters(self) -> Dict:
+        if self.last_run is None:
+            return {}
+        return {"last_activity_after": self.last_run}
+
+    def project_ids(self, projects: Iterable) -> Iterator:
+        for project in projects:
+            self.discovered[str(project.id)] = project
+            self.listed.add(str(project.id))
+            yield project.id
+
+        if self.last_run is not None:
+            for project_id in self.store.drifted_project_ids(self.scope):
+                if project_id not in self.discovered:
+                    self.listed.add(project_id)
+                    yield project_id
+
+    def record(self, project_id: str, row: Dict, plan) -> None:
+        project = self.discovered.get(str(project_id))
+        self.audited.add(str(project_id))
+        self.store.record(
+            self.scope,
+            project_id,
+            row,
+            # Fixed projects no longer drift, so they don't need re-auditing
+            drifted=bool(plan) and not self.fix,
+            last_activity_at=getattr(project, "last_activity_at", None),
+        )
+
+    def reused_rows(self) -> List[tuple[str, Dict]]:
+        if self.last_run is None:
+            return []
+        return self.store.rows(self.scope, exclude=self.listed)
+
+    def failed(self) -> List[str]:
+        """Projects that were listed for auditing but have no result."""
+        return sorted(self.listed - self.audited)
+
+    def finish(self) -> None:
+        # Projects whose audit failed would otherwise only be audited again
+        # after new activity
+        for project_id in self.failed():
+            self.store.mark_drifted(self.scope, project_id)
+        self.store.finish_run(self.scope, self.started_at, self.config)
@@ -0,0 +1,110 @@
+from types import SimpleNamespace
+
+import pytest
+
+from gitlab_config.config import ConfigIndex, managed_fields
+
+DEFAULT = {"squash_option": "default_on", "prevent_secrets": True}
+
+
+def make_project(project_id=1, full_path="acme/platform/api"):
+    return SimpleNamespace(
+        id=project_id,
+        name=full_path.rsplit("/", 1)[-1],
+        path_with_namespace=full_path,
+    )
+
+
+class TestConfigIndex:
+    def test_default_without_overrides(self):
+        index = ConfigIndex({"GITLAB_URL": "https://gitlab.com", "default": DEFAULT})
+
+        assert index.resolve(make_project()) == DEFAULT
+
+    def test_precedence(self):
+        config = {
+            "default": DEFAULT,
+            "acme": {"squash_option": "acme"},
+            "acme/platform": {"squash_option": "platform"},
+            "acme/*/api": {"squash_option": "glob"},
+            "acme/platform/api": {"squash_option": "path"},
+            1: {"squash_option": "id"},
+        }
+        index = ConfigIndex(config)
+
+        assert index.resolve(make_project(1))["squash_option"] == "id"
+        assert index.resolve(make_project(2))["squash_option"] == "path"
+        assert index.resolve(make_project(3, "acme/web/api"))["squash_option"] == "glob"
+        assert (
+            index.resolve(make_project(4, "acme/platform/db"))["squash_option"]
+            == "platform"
+        )
+        assert index.resolve(make_project(5, "acme/db"))["squash_option"] == "acme"
+        assert index.resolve(make_project(6, "other/db")) == DEFAULT
+
+    def test_same_name_in_different_groups_does_not_collide(self):
+        index = ConfigIndex(
+            {"default": DEFAULT, "acme/api": {"squash_option": "never"}}
+        )
+
+        assert index.resolve(make_project(1, "acme/api"))["squash_option"] == "never"
+        assert index.resolve(make_project(2, "other/api")) == DEFAULT
+
+    def test_merge_with_default_inherits_from_groups(self):
+        index = ConfigIndex(
+            {
+                "default": DEFAULT,
+                "acme": {
+                    "config_merge_method": "merge_with_default",
+                    "prevent_secrets": False,
+                },
+                "acme/platform/api": {
+                    "config_merge_method": "merge_with_default",
+                    "squash_option": "always",
+                },
+            }
+        )
+
+        assert index.resolve(make_project()) == {
+            "squash_option": "always",
+            "prevent_secrets": False,
+        }
+
+    def test_replace_default_stops_inheritance(self):
+        index = ConfigIndex(
+            {
+                "default": DEFAULT,
+                "acme": {"prevent_secrets": False},
+            }
+        )
+
+        assert index.resolve(make_project()) == {"prevent_secrets": False}
+
+    def test_resolved_configs_are_shared(self):
+        index = ConfigIndex({"default": DEFAULT, "acme": {"prevent_secrets": False}})
+
+        first = index.resolve(make_project(1, "acme/a"))
+        second = index.resolve(make_project(2, "acme/b"))
+
+        assert first is second
+
+    def test_invalid_merge_method(self):
+        with pytest.raises(ValueError, match="config_merge_method"):
+            ConfigIndex({"default": DEFAULT, "acme": {"config_merge_method": "both"}})
+
+
+def test_managed_fields_cover_every_override():
+    config = {
+        "GITLAB_URL": "https://gitlab.com",
+        "default": DEFAULT,
+        "acme": {
+            "config_merge_method": "merge_with_default",
+            "merge_access_levels": "Maintainers",
+        },
+    }
+
+    assert managed_fields(config) == [
+        "squash_option",
+        "prevent_secrets",
+        "merge_access_levels",
+    ]
@@ -0,0 +1,211 @@
+import gitlab
+
+from benchmarks.simulator import ROOT_GROUP_PATH, GitLabSimulator
+from gitlab_config.groups import (
+    ProjectRecord,
+    drop_nested_groups,
+    get_projects_for_groups,
+)
+
+
+def project_json(project_id, group_path="acme"):
+    return {
+        "id": project_id,
+        "path_with_namespace": f"{group_path}/project-{project_id}",
+        "default_branch": "main",
+        "last_activity_at": "2026-01-01T00:00:00Z",
+        "description": "Not kept",
+    }
+
+
+def make_gitlab(mocker, projects_by_group):
+    """A Gitlab whose groups list the given project ids, counting what is consumed."""
+    mock_gitlab = mocker.Mock()
+    groups = {
+        path: mocker.Mock(id=group_id, full_path=path)
+        for group_id, path in enumerate(projects_by_group, start=1)
+    }
+    for group in groups.values():
+        group.descendant_groups.list.return_value = []
+    mock_gitlab.groups.get.side_effect = lambda group_id, **kwargs: (
+        groups[group_id]
+        if group_id in groups
+        else next(group for group in groups.values() if group.id == group_id)
+    )
+    consumed = []
+
+    def http_list(path, query_data, iterator):
+        group_id = int(path.split("/")[2])
+        group_path = next(g.full_path for g in groups.values() if g.id == group_id)
+        for project_id in projects_by_group[group_path]:
+            consumed.append(project_id)
+            yield project_json(project_id, group_path)
+
+    mock_gitlab.http_list.side_effect = http_list
+    return mock_gitlab, consumed
+
+
+class TestGetProjectsForGroups:
+    def test_lists_with_keyset_pagination(self, mocker):
+        mock_gitlab, _ = make_gitlab(mocker, {"acme": [1, 2]})
+
+        projects = list(get_projects_for_groups(mock_gitlab, ["acme"], recurse=True))
+
+        assert [project.id for project in projects] == [1, 2]
+        mock_gitlab.http_list.assert_called_once_with(
+            "/groups/1/projects",
+            query_data={
+                "pagination": "keyset",
+                "per_page": 100,
+                "archived": False,
+                "order_by": "id",
+                "sort": "asc",
+                "include_subgroups": False,
+                "simple": True,
+            },
+            iterator=True,
+        )
+
+    def test_projects_are_compact_records(self, mocker):
+        mock_gitlab, _ = make_gitlab(mocker, {"acme": [1]})
+
+        (project,) = get_projects_for_groups(mock_gitlab, ["acme"])
+
+        assert isinstance(project, ProjectRecord)
+        assert not hasattr(project, "__dict__")
+        assert project.path_with_namespace == "acme/project-1"
+        assert project.last_activity_at == "2026-01-01T00:00:00Z"
+
+    def test_filters_are_passed_to_the_api(self, mocker):
+        mock_gitlab, _ = make_gitlab(mocker, {"acme": [1]})
+
+        list(
+            get_projects_for_groups(
+                mock_gitlab, ["acme"], last_activity_after="2026-01-01T00:00:00Z"
+            )
+        )
+
+        assert (
+            mock_gitlab.http_list.call_args.kwargs["query_data"]["last_activity_after"]
+            == "2026-01-01T00:00:00Z"
+        )
+
+    def test_limit_stops_paging(self, mocker):
+        mock_gitlab, consumed = make_gitlab(mocker, {"acme": range(1, 1000)})
+
+        projects = list(get_projects_for_groups(mock_gitlab, ["acme"], limit=3))
+
+        assert [project.id for project in projects] == [1, 2, 3]
+        assert consumed == [1, 2, 3]
+
+    def test_is_lazy_and_deduplicates(self, mocker):
+        mock_gitlab, _ = make_gitlab(mocker, {"first": [1, 2], "second": [2, 3]})
+
+        projects = get_projects_for_groups(mock_gitlab, ["first", "second"])
+        mock_gitlab.groups.get.assert_not_called()
+
+        assert [project.id for project in projects] == [1, 2, 3]
+
+
+def make_named_group(mocker, group_id, full_path):
+    return mocker.Mock(id=group_id, full_path=full_path)
+
+
+class TestDropNestedGroups:
+    def test_drops_subgroups_of_other_roots_and_repeats(self, mocker):
+        acme = make_named_group(mocker, 1, "acme")
+        team = make_named_group(mocker, 2, "acme/team")
+        other = make_named_group(mocker, 3, "acme-other")
+        repeated = make_named_group(mocker, 1, "acme")
+
+        assert drop_nested_groups([team, acme, other, repeated]) == [acme, other]
+
+
+class TestGetProjectsForGroupsConcurrently:
+    def test_overlapping_groups_are_listed_once(self):
+        with GitLabSimulator(projects=60, subgroups=5) as simulator:
+            gl = gitlab.Gitlab(simulator.url, private_token="token")
+            projects = list(
+                get_projects_for_groups(
+                    gl, [ROOT_GROUP_PATH, f"{ROOT_GROUP_PATH}/team-001"], recurse=True
+                )
+            )
+            endpoints = simulator.stats()["endpoints"]
+
+        assert len(projects) == len({project.id for project in projects})
+        # The root group and its 5 subgroups, team-001 isn't listed again
+        assert endpoints["GET /groups/:id/projects"] == 6
+
+    def test_matches_sequential_listing(self):
+        with GitLabSimulator(projects=60, subgroups=5) as simulator:
+            gl = gitlab.Gitlab(simulator.url, private_token="token")
+            sequential = [
+                project.id
+                for project in get_projects_for_groups(
+                    gl, [ROOT_GROUP_PATH], recurse=True
+                )
+            ]
+            concurrent = [
+                project.id
+                for project in get_projects_for_groups(
+                    gl,
+                    [ROOT_GROUP_PATH, f"{ROOT_GROUP_PATH}/team-001"],
+                    recurse=True,
+                    concurrency=8,
+                )
+            ]
+
+        assert sorted(concurrent) == sorted(sequential)
+        assert len(concurrent) == len(set(concurrent))
+
+    def test_filters_are_applied_server_side(self):
+        with GitLabSimulator(projects=300, subgroups=5) as simulator:
+            gl = gitlab.Gitlab(simulator.url, private_token="token")
+            projects = list(
+                get_projects_for_groups(
+                    gl,
+                    [ROOT_GROUP_PATH],
+                    recurse=True,
+                    concurrency=4,
+                    topic="pci",
+                    visibility="public",
+                )
+            )
+            expected = [
+                project["id"]
+                for project in simulator.gitlab.projects.values()
+                if "pci" in project["topics"]
+                and project["visibility"] == "public"
+                and not project["archived"]
+            ]
+
+        assert expected
+        assert sorted(project.id for project in projects) == sorted(expected)
+
+    def test_limit_stops_listing_groups(self):
+        with GitLabSimulator(projects=400, subgroups=3) as simulator:
+            gl = gitlab.Gitlab(simulator.url, private_token="token")
+            projects = list(
+                get_projects_for_groups(
+                    gl, [ROOT_GROUP_PATH], recurse=True, limit=3, concurrency=4
+                )
+            )
+            endpoints = simulator.stats()["endpoints"]
+
+        assert len(projects) == 3
+        # One page of 3 projects for each of the 4 groups read ahead, not
+        # every page of every group
+        assert endpoints["GET /groups/:id/projects"] <= 4
+
+    def test_yields_groups_in_order_up_to_the_limit(self, mocker):
+        mock_gitlab, _ = make_gitlab(mocker, {"first": [3, 1], "second": [1, 2]})
+
+        projects = get_projects_for_groups(
+            mock_gitlab, ["first", "second"], limit=3, concurrency=4
+        )
+
+        assert [project.id for project in projects] == [3, 1, 2]
+        assert (
+            mock_gitlab.http_list.call_args.kwargs["query_data"]["include_subgroups"]
+            is False
+        )
@@ -0,0 +1,103 @@
+import json
+
+import pytest
+
+from benchmarks.simulator import COMPLIANT_SETTINGS, GitLabSimulator
+from gitlab_config.journal import Journal
+from gitlab_config.main import main
+from gitlab_config.plan import PROJECT, ProjectPlan, apply_plan
+
+HEADER = {"command": "projects", "targets": ["1", "2"]}
+
+
+def make_plan(project_id):
+    plan = ProjectPlan(project_id, f"project-{project_id}")
+    plan.add(PROJECT, "squash_option", "default_off", "default_on")
+    return plan
+
+
+def test_resume_restores_completed_projects_and_writes(tmp_path):
+    filename = tmp_path / "journal.jsonl"
+    journal = Journal.create(filename, HEADER)
+    journal.record_write(1, PROJECT, {"squash_option": "default_on"})
+    journal.record_project(1, {"project": {"value": "project-1"}}, make_plan(1))
+    journal.record_write(2, PROJECT, {"squash_option": "default_on"})
+    journal.close()
+
+    journal = Journal.resume(filename)
+    assert journal.header == HEADER
+    assert journal.is_completed("1")
+    assert not journal.is_completed(2)
+    assert journal.completed_plan(1).changes == make_plan(1).changes
+    assert journal.is_applied(2, PROJECT, {"squash_option": "default_on"})
+    assert not journal.is_applied(2, PROJECT, {"squash_option": "default_off"})
+
+
+def test_resume_ignores_a_partially_written_last_entry(tmp_path):
+    filename = tmp_path / "journal.jsonl"
+    journal = Journal.create(filename, HEADER)
+    journal.record_project(1, {"project": {"value": "project-1"}}, None)
+    journal.close()
+    with open(filename, "a") as f:
+        f.write('{"type": "project", "project_id": "2", "ro')
+
+    journal = Journal.resume(filename)
+    journal.record_project(3, {"project": {"value": "project-3"}}, None)
+    journal.close()
+
+    lines = [json.loads(line) for line in filename.read_text().splitlines()]
+    assert [line.get("project_id") for line in lines] == [None, "1", "3"]
+
+
+def test_create_refuses_to_overwrite_a_journal(tmp_path):
+    filename = tmp_path / "journal.jsonl"
+    Journal.create(filename, HEADER).close()
+
+    with pytest.raises(FileExistsError):
+        Journal.create(filename, HEADER)
+    assert Journal.resume(filename).header == HEADER
+
+
+def test_resume_rejects_other_files(tmp_path):
+    filename = tmp_path / "journal.jsonl"
+    filename.write_text('{"type": "project"}\n')
+    with pytest.raises(ValueError):
+        Journal.resume(filename)
+
+
+def test_apply_plan_skips_journaled_writes(mocker, tmp_path):
+    mock_gitlab = mocker.Mock()
+    journal = Journal.create(tmp_path / "journal.jsonl", HEADER)
+    journal.record_write(1, PROJECT, {"squash_option": "default_on"})
+
+    apply_plan(mock_gitlab, make_plan(1), journal=journal)
+    mock_gitlab.projects.update.assert_not_called()
+
+    apply_plan(mock_gitlab, make_plan(2), journal=journal)
+    mock_gitlab.projects.update.assert_called_once_with(
+        2, {"squash_option": "default_on"}
+    )
+    assert journal.is_applied(2, PROJECT, {"squash_option": "default_on"})
+
+
+def test_resumed_run_skips_finished_projects(tmp_path, capsys):
+    journal_file = str(tmp_path / "journal.jsonl")
+    with GitLabSimulator(projects=3, subgroups=1, drift=1.0) as simulator:
+        config = {
+            "GITLAB_URL": simulator.url,
+            "GITLAB_TOKEN": "token",
+            "default": {"squash_option": COMPLIANT_SETTINGS["squash_option"]},
+        }
+        main(["projects", "1", "2", "3", "--fix", "--journal", journal_file], config)
+        requests = simulator.stats()["requests"]
+        capsys.readouterr()
+
+        main(["projects", "1", "2", "3", "--fix", "--resume", journal_file], config)
+
+        assert simulator.stats()["requests"] == requests
+        out = capsys.readouterr().out
+        assert "already done" in out
+        assert "Changes have been applied to 3/3 projects" in out
+
+        with pytest.raises(SystemExit):
+            main(["projects", "1", "2", "--fix", "--resume", journal_file], config)
@@ -1,11 +1,29 @@
+import io
+import json
+from types import SimpleNamespace
+
 import pytest
 
 from gitlab_config.main import main
+from gitlab_config.plan import ProjectPlan
+
+
+class Yields:
+    """Matches any iterable that yields the expected items."""
+
+    def __init__(self, expected):
+        self.expected = list(expected)
+
+    def __eq__(self, other):
+        return list(other) == self.expected
+
+    def __repr__(self):
+        return f"Yields({self.expected!r})"
 
 
 class TestProjectsSubcommand:
     def test_projects_basic_args(self, mocker, mock_manage_projects_response):
-        mock_gitlab = mocker.patch("gitlab_config.main.gitlab.Gitlab")
+        mock_gitlab = mocker.patch("gitlab_config.client.gitlab.Gitlab")
         mock_manage_projects = mocker.patch("gitlab_config.main.manage_projects")
         mock_manage_projects.return_value = mock_manage_projects_response
 
@@ -13,11 +31,21 @@ class TestProjectsSubcommand:
         main(args)
 
         mock_manage_projects.assert_called_once_with(
-            mock_gitlab.return_value, ["123", "456"], mocker.ANY, fix=False
+            mock_gitlab.return_value,
+            ["123", "456"],
+            mocker.ANY,
+            fix=False,
+            concurrency=1,
+            graphql=False,
+            on_result=None,
+            keep_rows=True,
+            journal=None,
+            apply_changes=True,
+            snapshots={},
         )
 
     def test_projects_with_fix_flag(self, mocker):
-        mock_gitlab = mocker.patch("gitlab_config.main.gitlab.Gitlab")
+        mock_gitlab = mocker.patch("gitlab_config.client.gitlab.Gitlab")
         mock_manage_projects = mocker.patch("gitlab_config.main.manage_projects")
         mock_manage_projects.return_value = (
             [
@@ -39,11 +67,21 @@ class TestProjectsSubcommand:
         main(args)
 
         mock_manage_projects.assert_called_once_with(
-            mock_gitlab.return_value, ["123"], mocker.ANY, fix=True
+            mock_gitlab.return_value,
+            ["123"],
+            mocker.ANY,
+            fix=True,
+            concurrency=1,
+            graphql=False,
+            on_result=None,
+            keep_rows=True,
+            journal=None,
+            apply_changes=True,
+            snapshots={},
         )
 
     def test_projects_single_id(self, mocker):
-        mock_gitlab = mocker.patch("gitlab_config.main.gitlab.Gitlab")
+        mock_gitlab = mocker.patch("gitlab_config.client.gitlab.Gitlab")
         mock_manage_projects = mocker.patch("gitlab_config.main.manage_projects")
         mock_manage_projects.return_value = (
             [
@@ -65,11 +103,21 @@ class TestProjectsSubcommand:
         main(args)
 
         mock_manage_projects.assert_called_once_with(
-            mock_gitlab.return_value, ["999"], mocker.ANY, fix=False
+            mock_gitlab.return_value,
+            ["999"],
+            mocker.ANY,
+            fix=False,
+            concurrency=1,
+            graphql=False,
+            on_result=None,
+            keep_rows=True,
+            journal=None,
+            apply_changes=True,
+            snapshots={},
         )
 
     def test_projects_multiple_ids(self, mocker):
-        mock_gitlab = mocker.patch("gitlab_config.main.gitlab.Gitlab")
+        mock_gitlab = mocker.patch("gitlab_config.client.gitlab.Gitlab")
         mock_manage_projects = mocker.patch("gitlab_config.main.manage_projects")
         mock_manage_projects.return_value = (
             [
@@ -91,13 +139,38 @@ class TestProjectsSubcommand:
         main(args)
 
         mock_manage_projects.assert_called_once_with(
-            mock_gitlab.return_value, ["1", "2", "3", "4", "5"], mocker.ANY, fix=False
+            mock_gitlab.return_value,
+            ["1", "2", "3", "4", "5"],
+            mocker.ANY,
+            fix=False,
+            concurrency=1,
+            graphql=False,
+            on_result=None,
+            keep_rows=True,
+            journal=None,
+            apply_changes=True,
+            snapshots={},
+        )
+
+    def test_projects_from_stdin(self, mocker, monkeypatch):
+        mocker.patch("gitlab_config.client.gitlab.Gitlab")
+        mock_manage_projects = mocker.patch(
+            "gitlab_config.main.manage_projects", return_value=([], 0)
         )
+        monkeypatch.setattr("sys.stdin", io.StringIO("456\n\n# comment\n789\n"))
+
+        main(["projects", "123", "--from-file", "-"])
+
+        assert mock_manage_projects.call_args.args[1] == ["123", "456", "789"]
+
+    def test_projects_need_targets(self):
+        with pytest.raises(SystemExit):
+            main(["projects"], {})
 
 
 class TestGroupsSubcommand:
     def test_groups_basic_args(self, mocker):
-        mock_gitlab = mocker.patch("gitlab_config.main.gitlab.Gitlab")
+        mock_gitlab = mocker.patch("gitlab_config.client.gitlab.Gitlab")
         mock_get_projects_for_groups = mocker.patch(
             "gitlab_config.main.get_projects_for_groups"
         )
@@ -126,14 +199,28 @@ class TestGroupsSubcommand:
         main(args)
 
         mock_get_projects_for_groups.assert_called_once_with(
-            mock_gitlab.return_value, ["acme-org"], limit=None, recurse=False
+            mock_gitlab.return_value,
+            ["acme-org"],
+            limit=None,
+            recurse=False,
+            concurrency=1,
         )
         mock_manage_projects.assert_called_once_with(
-            mock_gitlab.return_value, [123, 456], mocker.ANY, fix=False
+            mock_gitlab.return_value,
+            Yields([123, 456]),
+            mocker.ANY,
+            fix=False,
+            concurrency=1,
+            graphql=False,
+            on_result=None,
+            keep_rows=True,
+            journal=None,
+            apply_changes=True,
+            snapshots=None,
         )
 
     def test_groups_with_fix_flag(self, mocker):
-        mock_gitlab = mocker.patch("gitlab_config.main.gitlab.Gitlab")
+        mock_gitlab = mocker.patch("gitlab_config.client.gitlab.Gitlab")
         mock_get_projects_for_groups = mocker.patch(
             "gitlab_config.main.get_projects_for_groups"
         )
@@ -159,11 +246,21 @@ class TestGroupsSubcommand:
         main(args)
 
         mock_manage_projects.assert_called_once_with(
-            mock_gitlab.return_value, [123], mocker.ANY, fix=True
+            mock_gitlab.return_value,
+            Yields([123]),
+            mocker.ANY,
+            fix=True,
+            concurrency=1,
+            graphql=False,
+            on_result=None,
+            keep_rows=True,
+            journal=None,
+            apply_changes=True,
+            snapshots=None,
         )
 
     def test_groups_with_recursive_flag(self, mocker):
-        mock_gitlab = mocker.patch("gitlab_config.main.gitlab.Gitlab")
+        mock_gitlab = mocker.patch("gitlab_config.client.gitlab.Gitlab")
         mock_get_projects_for_groups = mocker.patch(
             "gitlab_config.main.get_projects_for_groups"
         )
@@ -189,11 +286,15 @@ class TestGroupsSubcommand:
         main(args)
 
         mock_get_projects_for_groups.assert_called_once_with(
-            mock_gitlab.return_value, ["parent-group"], limit=None, recurse=True
+            mock_gitlab.return_value,
+            ["parent-group"],
+            limit=None,
+            recurse=True,
+            concurrency=1,
         )
 
     def test_groups_with_limit(self, mocker):
-        mock_gitlab = mocker.patch("gitlab_config.main.gitlab.Gitlab")
+        mock_gitlab = mocker.patch("gitlab_config.client.gitlab.Gitlab")
         mock_get_projects_for_groups = mocker.patch(
             "gitlab_config.main.get_projects_for_groups"
         )
@@ -222,11 +323,15 @@ class TestGroupsSubcommand:
         main(args)
 
         mock_get_projects_for_groups.assert_called_once_with(
-            mock_gitlab.return_value, ["test-group"], limit=5, recurse=False
+            mock_gitlab.return_value,
+            ["test-group"],
+            limit=5,
+            recurse=False,
+            concurrency=1,
         )
 
     def test_groups_all_flags_combined(self, mocker):
-        mock_gitlab = mocker.patch("gitlab_config.main.gitlab.Gitlab")
+        mock_gitlab = mocker.patch("gitlab_config.client.gitlab.Gitlab")
         mock_get_projects_for_groups = mocker.patch(
             "gitlab_config.main.get_projects_for_groups"
         )
@@ -263,14 +368,28 @@ class TestGroupsSubcommand:
         main(args)
 
         mock_get_projects_for_groups.assert_called_once_with(
-            mock_gitlab.return_value, ["acme-org", "012345678"], limit=10, recurse=True
+            mock_gitlab.return_value,
+            ["acme-org", "012345678"],
+            limit=10,
+            recurse=True,
+            concurrency=1,
         )
         mock_manage_projects.assert_called_once_with(
-            mock_gitlab.return_value, [123, 456], mocker.ANY, fix=True
+            mock_gitlab.return_value,
+            Yields([123, 456]),
+            mocker.ANY,
+            fix=True,
+            concurrency=1,
+            graphql=False,
+            on_result=None,
+            keep_rows=True,
+            journal=None,
+            apply_changes=True,
+            snapshots=None,
         )
 
     def test_groups_multiple_groups(self, mocker):
-        mock_gitlab = mocker.patch("gitlab_config.main.gitlab.Gitlab")
+        mock_gitlab = mocker.patch("gitlab_config.client.gitlab.Gitlab")
         mock_get_projects_for_groups = mocker.patch(
             "gitlab_config.main.get_projects_for_groups"
         )
@@ -304,12 +423,24 @@ class TestGroupsSubcommand:
             ["group1", "group2", "group3"],
             limit=None,
             recurse=False,
+            concurrency=1,
         )
 
+    def test_graphql_warns_about_fields_read_through_rest(self, mocker, capsys):
+        mocker.patch("gitlab_config.client.gitlab.Gitlab")
+        mocker.patch("gitlab_config.main.get_projects_for_groups", return_value=[])
+        mocker.patch("gitlab_config.main.manage_projects", return_value=([], 0))
+
+        main(["groups", "acme-org", "--graphql"])
+
+        out = capsys.readouterr().out
+        assert "squash_option, merge_method, prevent_secrets can't be read" in out
+        assert "remove_source_branch_after_merge" not in out
+
 
 class TestArgumentCombinations:
     def test_projects_short_fix_flag(self, mocker):
-        mock_gitlab = mocker.patch("gitlab_config.main.gitlab.Gitlab")
+        mock_gitlab = mocker.patch("gitlab_config.client.gitlab.Gitlab")
         mock_manage_projects = mocker.patch("gitlab_config.main.manage_projects")
         mock_manage_projects.return_value = (
             [
@@ -331,11 +462,21 @@ class TestArgumentCombinations:
         main(args)
 
         mock_manage_projects.assert_called_once_with(
-            mock_gitlab.return_value, ["123"], mocker.ANY, fix=True
+            mock_gitlab.return_value,
+            ["123"],
+            mocker.ANY,
+            fix=True,
+            concurrency=1,
+            graphql=False,
+            on_result=None,
+            keep_rows=True,
+            journal=None,
+            apply_changes=True,
+            snapshots={},
         )
 
     def test_groups_short_recursive_flag(self, mocker):
-        mock_gitlab = mocker.patch("gitlab_config.main.gitlab.Gitlab")
+        mock_gitlab = mocker.patch("gitlab_config.client.gitlab.Gitlab")
         mock_get_projects_for_groups = mocker.patch(
             "gitlab_config.main.get_projects_for_groups"
         )
@@ -361,11 +502,15 @@ class TestArgumentCombinations:
         main(args)
 
         mock_get_projects_for_groups.assert_called_once_with(
-            mock_gitlab.return_value, ["test-group"], limit=None, recurse=True
+            mock_gitlab.return_value,
+            ["test-group"],
+            limit=None,
+            recurse=True,
+            concurrency=1,
         )
 
     def test_groups_short_fix_flag(self, mocker):
-        mock_gitlab = mocker.patch("gitlab_config.main.gitlab.Gitlab")
+        mock_gitlab = mocker.patch("gitlab_config.client.gitlab.Gitlab")
         mock_get_projects_for_groups = mocker.patch(
             "gitlab_config.main.get_projects_for_groups"
         )
@@ -391,11 +536,21 @@ class TestArgumentCombinations:
         main(args)
 
         mock_manage_projects.assert_called_once_with(
-            mock_gitlab.return_value, [789], mocker.ANY, fix=True
+            mock_gitlab.return_value,
+            Yields([789]),
+            mocker.ANY,
+            fix=True,
+            concurrency=1,
+            graphql=False,
+            on_result=None,
+            keep_rows=True,
+            journal=None,
+            apply_changes=True,
+            snapshots=None,
         )
 
     def test_groups_mixed_short_long_flags(self, mocker):
-        mock_gitlab = mocker.patch("gitlab_config.main.gitlab.Gitlab")
+        mock_gitlab = mocker.patch("gitlab_config.client.gitlab.Gitlab")
         mock_get_projects_for_groups = mocker.patch(
             "gitlab_config.main.get_projects_for_groups"
         )
@@ -421,11 +576,223 @@ class TestArgumentCombinations:
         main(args)
 
         mock_get_projects_for_groups.assert_called_once_with(
-            mock_gitlab.return_value, ["test-group"], limit=3, recurse=True
+            mock_gitlab.return_value,
+            ["test-group"],
+            limit=3,
+            recurse=True,
+            concurrency=1,
+        )
+        mock_manage_projects.assert_called_once_with(
+            mock_gitlab.return_value,
+            Yields([999]),
+            mocker.ANY,
+            fix=True,
+            concurrency=1,
+            graphql=False,
+            on_result=None,
+            keep_rows=True,
+            journal=None,
+            apply_changes=True,
+            snapshots=None,
+        )
+
+    def test_groups_with_concurrency(self, mocker):
+        mock_gitlab = mocker.patch("gitlab_config.client.gitlab.Gitlab")
+        mock_get_projects_for_groups = mocker.patch(
+            "gitlab_config.main.get_projects_for_groups"
+        )
+        mock_get_projects_for_groups.return_value = [mocker.Mock(id=999)]
+        mock_manage_projects = mocker.patch("gitlab_config.main.manage_projects")
+        mock_manage_projects.return_value = (
+            [
+                {
+                    "project": {
+                        "value": "acme-website",
+                        "changed": False,
+                    },
+                }
+            ],
+            0,
         )
+
+        args = ["groups", "test-group", "--concurrency", "8"]
+        main(args)
+
         mock_manage_projects.assert_called_once_with(
-            mock_gitlab.return_value, [999], mocker.ANY, fix=True
+            mock_gitlab.return_value,
+            Yields([999]),
+            mocker.ANY,
+            fix=False,
+            concurrency=8,
+            graphql=False,
+            on_result=None,
+            keep_rows=True,
+            journal=None,
+            apply_changes=True,
+            snapshots=None,
+        )
+
+
+class TestPlanFiles:
+    def test_plan_out_writes_drifted_projects(self, mocker, tmp_path):
+        mocker.patch("gitlab_config.client.gitlab.Gitlab")
+        mock_manage_projects = mocker.patch("gitlab_config.main.manage_projects")
+
+        def manage_projects(*args, on_result=None, **kwargs):
+            row = {"project": {"value": "acme-website", "changed": True}}
+            plan = ProjectPlan(123, "acme-website")
+            plan.add("project", "merge_method", "merge", "ff")
+            on_result("123", row, plan)
+            return ([row], 1)
+
+        mock_manage_projects.side_effect = manage_projects
+        plan_file = tmp_path / "plan.json"
+
+        main(["projects", "123", "--plan-out", str(plan_file)])
+
+        plan = json.loads(plan_file.read_text())
+        assert [project["project_id"] for project in plan["projects"]] == [123]
+
+    def test_plan_out_rejects_fix(self, tmp_path):
+        with pytest.raises(SystemExit):
+            main(
+                ["projects", "123", "--fix", "--plan-out", str(tmp_path / "plan.json")]
+            )
+
+    def test_apply_subcommand(self, mocker):
+        mock_gitlab = mocker.patch("gitlab_config.client.gitlab.Gitlab")
+        plans = [ProjectPlan(123, "acme-website")]
+        mocker.patch(
+            "gitlab_config.main.load_plan_file",
+            return_value={"gitlab_url": "https://gitlab.com", "projects": plans},
+        )
+        mock_apply_plans = mocker.patch("gitlab_config.main.apply_plans")
+        mock_apply_plans.return_value = (
+            [{"project": {"value": "acme-website"}, "status": {"value": "applied"}}],
+            1,
         )
+        mock_manage_projects = mocker.patch("gitlab_config.main.manage_projects")
+
+        main(["apply", "plan.json", "--concurrency", "4"])
+
+        mock_apply_plans.assert_called_once_with(
+            mock_gitlab.return_value, plans, concurrency=4
+        )
+        mock_manage_projects.assert_not_called()
+
+
+class TestIncremental:
+    def run(self, mocker, state_file, projects, drifted, failed=()):
+        mocker.patch("gitlab_config.client.gitlab.Gitlab")
+        mock_get_projects = mocker.patch(
+            "gitlab_config.main.get_projects_for_groups", return_value=iter(projects)
+        )
+        mock_manage_projects = mocker.patch("gitlab_config.main.manage_projects")
+        audited = []
+
+        def manage_projects(gl, project_ids, config, on_result=None, **kwargs):
+            rows = []
+            for project_id in project_ids:
+                audited.append(str(project_id))
+                if str(project_id) in failed:
+                    # manage_project logs the error and returns no result
+                    continue
+                row = {"project": {"value": str(project_id)}}
+                plan = ProjectPlan(project_id)
+                if str(project_id) in drifted:
+                    plan.add("project", "merge_method", "merge", "ff")
+                rows.append(row)
+                on_result(project_id, row, plan)
+            return (rows, 0)
+
+        mock_manage_projects.side_effect = manage_projects
+        config = {
+            "GITLAB_URL": "https://gitlab.com",
+            "GITLAB_TOKEN": "token",
+            "default": {},
+        }
+        main(
+            ["groups", "acme", "--incremental", "--state-file", str(state_file)],
+            config,
+        )
+        return mock_get_projects, audited
+
+    def test_second_run_only_audits_active_and_drifted_projects(
+        self, mocker, tmp_path, capsys
+    ):
+        state_file = tmp_path / "state.db"
+        first = [SimpleNamespace(id=1), SimpleNamespace(id=2), SimpleNamespace(id=3)]
+        mock_get_projects, audited = self.run(mocker, state_file, first, drifted={"2"})
+        assert audited == ["1", "2", "3"]
+        assert "last_activity_after" not in mock_get_projects.call_args.kwargs
+
+        mock_get_projects, audited = self.run(
+            mocker,
+            state_file,
+            [SimpleNamespace(id=3, last_activity_at="2026-01-02T00:00:00Z")],
+            drifted=set(),
+        )
+        # Project 3 had activity, project 2 drifted last time
+        assert audited == ["3", "2"]
+        assert "last_activity_after" in mock_get_projects.call_args.kwargs
+        # Project 1's stored result is reused in the output
+        assert "reused results for 1" in capsys.readouterr().out
+
+    def test_failed_projects_are_audited_again(self, mocker, tmp_path, capsys):
+        state_file = tmp_path / "state.db"
+        first = [SimpleNamespace(id=1), SimpleNamespace(id=2)]
+        self.run(mocker, state_file, first, drifted=set(), failed={"2"})
+        assert "1 projects couldn't be audited" in capsys.readouterr().out
+
+        _, audited = self.run(mocker, state_file, [], drifted=set())
+        assert audited == ["2"]
+        assert "reused results for 1" in capsys.readouterr().out
+
+    def test_incremental_rejects_limit(self):
+        with pytest.raises(SystemExit):
+            main(["groups", "acme", "--incremental", "--limit", "5"], {})
+
+    def test_incremental_rejects_resume(self):
+        with pytest.raises(SystemExit):
+            main(["groups", "acme", "--incremental", "--resume", "run.journal"], {})
+
+
+class TestProjectFilters:
+    def test_filters_are_passed_to_discovery(self, mocker):
+        mocker.patch("gitlab_config.client.gitlab.Gitlab")
+        mock_get_projects = mocker.patch(
+            "gitlab_config.main.get_projects_for_groups", return_value=iter([])
+        )
+        mocker.patch("gitlab_config.main.manage_projects", return_value=([], 0))
+
+        main(
+            [
+                "groups",
+                "acme",
+                "--topic",
+                "pci",
+                "--topic",
+                "payments",
+                "--visibility",
+                "public",
+                "--with-merge-requests-enabled",
+                "--search",
+                "api",
+                "--last-activity-after",
+                "2026-01-31",
+            ]
+        )
+
+        kwargs = mock_get_projects.call_args.kwargs
+        assert kwargs["topic"] == "pci,payments"
+        assert kwargs["visibility"] == "public"
+        assert kwargs["with_merge_requests_enabled"] is True
+        assert kwargs["search"] == "api"
+        assert kwargs["last_activity_after"] == "2026-01-31T00:00:00"
+
+    def test_invalid_timestamp_is_rejected(self):
+        with pytest.raises(SystemExit):
+            main(["groups", "acme", "--last-activity-after", "last week"], {})
 
 
 class TestErrorCases:
@@ -441,6 +808,10 @@ class TestErrorCases:
         with pytest.raises(SystemExit):
             main(["projects"])
 
+    def test_apply_no_plan_file(self):
+        with pytest.raises(SystemExit):
+            main(["apply"])
+
     def test_groups_no_names(self):
         with pytest.raises(SystemExit):
             main(["groups"])
@@ -448,3 +819,10 @@ class TestErrorCases:
     def test_groups_invalid_limit_value(self):
         with pytest.raises(SystemExit):
             main(["groups", "test-group", "--limit", "not-a-number"])
+
+    @pytest.mark.parametrize("concurrency", ["0", "-2", "many"])
+    def test_invalid_concurrency(self, concurrency, capsys):
+        with pytest.raises(SystemExit):
+            main(["groups", "test-group", "--concurrency", concurrency])
+
+        assert "Expected a positive number" in capsys.readouterr().err
@@ -0,0 +1,334 @@
+import gitlab
+
+from gitlab_config.plan import (
+    PROJECT,
+    PUSH_RULE,
+    ProjectPlan,
+    apply_plan,
+    apply_plans,
+    approval_rule_resource,
+    load_plan_file,
+    protected_branch_resource,
+    write_plan_file,
+)
+from gitlab_config.projects import manage_project_settings
+
+
+def make_project(mocker, **attributes):
+    project = mocker.Mock(
+        id=1,
+        name="acme-website",
+        path="acme-website",
+        path_with_namespace="acme/acme-website",
+        default_branch="main",
+        remove_source_branch_after_merge=False,
+        only_allow_merge_if_pipeline_succeeds=False,
+        merge_method="ff",
+        squash_option="default_off",
+        merge_requests_template=None,
+    )
+    project.configure_mock(**attributes)
+    project.protectedbranches.list.return_value = [
+        mocker.Mock(
+            merge_access_levels=[
+                {
+                    "id": 7,
+                    "access_level": 40,
+                    "access_level_description": "Maintainers",
+                }
+            ],
+            push_access_levels=[
+                {"access_level": 40, "access_level_description": "Maintainers"}
+            ],
+            allow_force_push=False,
+        )
+    ]
+    # Mock reserves the name keyword, so it has to be set afterwards
+    project.protectedbranches.list.return_value[0].name = "main"
+    project.pushrules.get.return_value = mocker.Mock(prevent_secrets=False)
+    return project
+
+
+class TestManageProjectSettings:
+    def test_drift_is_planned_per_resource(self, mocker):
+        project = make_project(mocker)
+        config = {
+            "default": {
+                "remove_source_branch_after_merge": True,
+                "only_allow_merge_if_pipeline_succeeds": True,
+                "squash_option": "default_on",
+                "prevent_secrets": True,
+                "merge_access_levels": "Developers + Maintainers",
+            }
+        }
+
+        row, plan = manage_project_settings(project, config, fix=True)
+
+        assert plan.desired(PROJECT) == {
+            "remove_source_branch_after_merge": True,
+            "only_allow_merge_if_pipeline_succeeds": True,
+            "squash_option": "default_on",
+        }
+        assert plan.desired(PUSH_RULE) == {"prevent_secrets": True}
+        assert plan.desired(protected_branch_resource("main")) == {
+            "merge_access_levels": [30],
+        }
+        # Planning never writes
+        project.save.assert_not_called()
+        project.pushrules.get.return_value.save.assert_not_called()
+
+    def test_fixed_access_levels_show_the_desired_levels(self, mocker):
+        project = make_project(mocker)
+        config = {"default": {"merge_access_levels": "Developers + Maintainers"}}
+
+        audited, _ = manage_project_settings(project, config)
+        fixed, _ = manage_project_settings(project, config, fix=True)
+
+        assert audited["merge_access_levels"] == {
+            "value": "Maintainers",
+            "changed": True,
+        }
+        assert fixed["merge_access_levels"] == {
+            "value": "Developers + Maintainers",
+            "changed": True,
+        }
+
+    def test_matching_project_has_empty_plan(self, mocker):
+        project = make_project(mocker, squash_option="default_on")
+
+        row, plan = manage_project_settings(
+            project, {"default": {"squash_option": "default_on"}}
+        )
+
+        assert not plan
+        assert row["squash_option"]["changed"] is False
+
+    def test_only_resources_of_managed_fields_are_read(self, mocker):
+        project = make_project(mocker)
+
+        row, _ = manage_project_settings(
+            project, {"default": {"squash_option": "default_on"}}
+        )
+
+        project.protectedbranches.list.assert_not_called()
+        project.pushrules.get.assert_not_called()
+        assert "protected branches" not in row
+
+    def test_unavailable_push_rules_are_not_planned(self, mocker):
+        project = make_project(mocker)
+        project.pushrules.get.side_effect = gitlab.exceptions.GitlabGetError(
+            response_code=404
+        )
+
+        row, plan = manage_project_settings(
+            project, {"default": {"prevent_secrets": True}}
+        )
+
+        assert not plan
+        assert row["prevent_secrets"] == {"value": "not available", "changed": False}
+        project.protectedbranches.list.assert_not_called()
+
+    def test_approval_rules_are_planned_per_rule(self, mocker):
+        project = make_project(mocker)
+        approvers = mocker.Mock(
+            id=11,
+            approvals_required=1,
+            applies_to_all_protected_branches=True,
+            users=[{"id": 3, "username": "jane.doe"}],
+            rule_type="regular",
+        )
+        approvers.name = "Approvers"
+        legacy = mocker.Mock(
+            id=12,
+            approvals_required=2,
+            applies_to_all_protected_branches=True,
+            users=[],
+            rule_type="regular",
+        )
+        legacy.name = "Legacy"
+        project.approvalrules.list.return_value = [approvers, legacy]
+        config = {
+            "default": {
+                "approval_rules": [
+                    {"name": "Approvers", "users": ["jane.doe", "john.smith"]},
+                    {"name": "Security", "approvals_required": 2, "users": []},
+                ]
+            }
+        }
+
+        row, plan = manage_project_settings(
+            project, config, user_ids={"jane.doe": 3, "john.smith": 4}
+        )
+
+        assert sorted(plan.changes) == [
+            approval_rule_resource("Approvers"),
+            approval_rule_resource("Legacy"),
+            approval_rule_resource("Security"),
+        ]
+        assert plan.changes[approval_rule_resource("Approvers")] == {
+            "user_ids": {"current": [3], "desired": [3, 4], "entries": [{"id": 11}]}
+        }
+        assert plan.desired(approval_rule_resource("Legacy")) == {
+            "approvals_required": None,
+            "applies_to_all_protected_branches": None,
+            "user_ids": None,
+        }
+        assert plan.desired(approval_rule_resource("Security")) == {
+            "approvals_required": 2,
+            "applies_to_all_protected_branches": True,
+            "user_ids": [],
+        }
+        assert row["approval_rules"]["changed"] is True
+        project.protectedbranches.list.assert_not_called()
+
+
+class TestApplyPlan:
+    def test_one_write_per_resource(self, mocker):
+        mock_gitlab = mocker.Mock()
+        project = mock_gitlab.projects.get.return_value
+        plan = ProjectPlan(1)
+        plan.add(PROJECT, "squash_option", "default_off", "default_on")
+        plan.add(PROJECT, "merge_method", "merge", "ff")
+        plan.add(PUSH_RULE, "prevent_secrets", False, True)
+
+        apply_plan(mock_gitlab, plan)
+
+        mock_gitlab.projects.get.assert_called_once_with(1, lazy=True)
+        mock_gitlab.projects.update.assert_called_once_with(
+            1, {"squash_option": "default_on", "merge_method": "ff"}
+        )
+        project.pushrules.update.assert_called_once_with(
+            new_data={"prevent_secrets": True}
+        )
+        project.protectedbranches.create.assert_not_called()
+
+    def test_unprotected_branch_is_created(self, mocker):
+        mock_gitlab = mocker.Mock()
+        project = mock_gitlab.projects.get.return_value
+        plan = ProjectPlan(1)
+        resource = protected_branch_resource("release/1.0")
+        plan.add(resource, "merge_access_levels", None, [30])
+        plan.add(resource, "allow_force_push", None, False)
+
+        apply_plan(mock_gitlab, plan)
+
+        project.protectedbranches.delete.assert_not_called()
+        project.protectedbranches.create.assert_called_once_with(
+            {"name": "release/1.0", "merge_access_level": 30, "allow_force_push": False}
+        )
+
+    def test_protected_branch_is_updated_in_place(self, mocker):
+        mock_gitlab = mocker.Mock()
+        project = make_project(mocker)
+        _, plan = manage_project_settings(
+            project,
+            {
+                "default": {
+                    "merge_access_levels": "Developers + Maintainers",
+                    "allow_force_push": True,
+                }
+            },
+        )
+        lazy_project = mock_gitlab.projects.get.return_value
+
+        apply_plan(mock_gitlab, plan)
+
+        lazy_project.protectedbranches.delete.assert_not_called()
+        lazy_project.protectedbranches.create.assert_not_called()
+        lazy_project.protectedbranches.get.assert_not_called()
+        lazy_project.protectedbranches.update.assert_called_once_with(
+            "main",
+            {
+                "allowed_to_merge": [{"id": 7, "_destroy": True}, {"access_level": 30}],
+                "allow_force_push": True,
+            },
+        )
+
+    def test_access_level_ids_are_read_when_missing(self, mocker):
+        mock_gitlab = mocker.Mock()
+        project = mock_gitlab.projects.get.return_value
+        project.protectedbranches.get.return_value = mocker.Mock(
+            push_access_levels=[{"id": 9, "access_level": 40}]
+        )
+        plan = ProjectPlan(1)
+        plan.add(
+            protected_branch_resource("main"),
+            "push_access_levels",
+            [40],
+            [0],
+            entries=[{"id": None, "access_level": 40}],
+        )
+
+        apply_plan(mock_gitlab, plan)
+
+        project.protectedbranches.update.assert_called_once_with(
+            "main",
+            {"allowed_to_push": [{"id": 9, "_destroy": True}, {"access_level": 0}]},
+        )
+
+    def test_approval_rules_are_created_updated_and_deleted(self, mocker):
+        mock_gitlab = mocker.Mock()
+        project = mock_gitlab.projects.get.return_value
+        plan = ProjectPlan(1)
+        plan.add(approval_rule_resource("Security"), "approvals_required", None, 2)
+        plan.add(approval_rule_resource("Security"), "user_ids", None, [4])
+        plan.add(
+            approval_rule_resource("Approvers"),
+            "user_ids",
+            [3],
+            [3, 4],
+            entries=[{"id": 11}],
+        )
+        plan.add(
+            approval_rule_resource("Legacy"),
+            "approvals_required",
+            2,
+            None,
+            entries=[{"id": 12}],
+        )
+
+        apply_plan(mock_gitlab, plan)
+
+        project.approvalrules.create.assert_called_once_with(
+            {"name": "Security", "approvals_required": 2, "user_ids": [4]}
+        )
+        project.approvalrules.update.assert_called_once_with(11, {"user_ids": [3, 4]})
+        project.approvalrules.delete.assert_called_once_with(12)
+
+
+class TestPlanFiles:
+    def test_round_trip(self, tmp_path):
+        plan = ProjectPlan(1, "acme-website")
+        plan.add(PROJECT, "squash_option", "default_off", "default_on")
+        plan_file = tmp_path / "plan.json"
+
+        write_plan_file(plan_file, [plan], "https://gitlab.com")
+        loaded = load_plan_file(plan_file)
+
+        assert loaded["gitlab_url"] == "https://gitlab.com"
+        assert loaded["projects"][0].changes == plan.changes
+        assert loaded["projects"][0].fingerprint() == plan.fingerprint()
+
+    def test_stale_project_is_skipped(self, mocker):
+        mock_gitlab = mocker.Mock()
+        mock_gitlab.projects.get.return_value = mocker.Mock(squash_option="always")
+        plan = ProjectPlan(1, "acme-website")
+        plan.add(PROJECT, "squash_option", "default_off", "default_on")
+
+        rows, change_count = apply_plans(mock_gitlab, [plan])
+
+        assert change_count == 0
+        mock_gitlab.projects.update.assert_not_called()
+
+    def test_unchanged_project_is_applied(self, mocker):
+        mock_gitlab = mocker.Mock()
+        mock_gitlab.projects.get.return_value = mocker.Mock(squash_option="default_off")
+        plan = ProjectPlan(1, "acme-website")
+        plan.add(PROJECT, "squash_option", "default_off", "default_on")
+
+        rows, change_count = apply_plans(mock_gitlab, [plan])
+
+        assert change_count == 1
+        mock_gitlab.projects.update.assert_called_once_with(
+            1, {"squash_option": "default_on"}
+        )
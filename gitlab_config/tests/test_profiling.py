@@ -0,0 +1,83 @@
+import json
+from datetime import timedelta
+from types import SimpleNamespace
+
+import pytest
+
+from benchmarks.simulator import COMPLIANT_SETTINGS, GitLabSimulator
+from gitlab_config.main import main
+from gitlab_config.profiling import Profiler, endpoint_template, percentile
+
+
+@pytest.mark.parametrize(
+    "url, template",
+    [
+        ("https://gitlab.com/api/v4/projects/123", "/projects/:id"),
+        ("https://gitlab.com/api/v4/projects/123/push_rule", "/projects/:id/push_rule"),
+        (
+            "https://gitlab.com/api/v4/projects/acme%2Fweb/protected_branches/main",
+            "/projects/:id/protected_branches/:name",
+        ),
+        (
+            "https://gitlab.com/api/v4/groups/7/projects?pagination=keyset",
+            "/groups/:id/projects",
+        ),
+        ("https://gitlab.com/api/v4/groups/7/members/all", "/groups/:id/members/all"),
+        ("https://gitlab.com/api/graphql", "/graphql"),
+    ],
+)
+def test_endpoint_template(url, template):
+    assert endpoint_template(url) == template
+
+
+def test_percentile():
+    values = sorted(range(1, 101))
+    assert percentile(values, 50) == 50
+    assert percentile(values, 99) == 99
+    assert percentile([], 95) == 0.0
+
+
+def response(status_code, url="https://gitlab.com/api/v4/projects/1"):
+    return SimpleNamespace(
+        status_code=status_code,
+        elapsed=timedelta(milliseconds=10),
+        content=b"{}",
+        headers={},
+        request=SimpleNamespace(method="GET", url=url, body=None),
+    )
+
+
+def test_counts_429s_and_retries():
+    profiler = Profiler()
+    profiler._on_response(response(429))
+    profiler._on_response(response(200))
+    profiler._on_response(response(200))
+
+    summary = profiler.summary()
+    assert summary["requests"] == 3
+    assert summary["throttled"] == 1
+    assert summary["retries"] == 1
+    assert summary["bytes_received"] == 6
+
+
+def test_profile_run_against_simulator(tmp_path, capsys):
+    trace_file = tmp_path / "trace.json"
+    with GitLabSimulator(projects=5, subgroups=1) as simulator:
+        config = {
+            "GITLAB_URL": simulator.url,
+            "GITLAB_TOKEN": "token",
+            "default": {**COMPLIANT_SETTINGS},
+        }
+        main(
+            ["--profile-trace", str(trace_file), "groups", "-r", "bench"],
+            config,
+        )
+
+    out = capsys.readouterr().out
+    assert "GET /projects/:id/push_rule" in out
+    assert "manage_project_settings" in out
+
+    events = json.loads(trace_file.read_text())["traceEvents"]
+    categories = {event["cat"] for event in events}
+    assert categories == {"http", "phase"}
+    assert {"discovery", "rendering"} <= {event["name"] for event in events}
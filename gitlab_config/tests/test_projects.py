@@ -0,0 +1,81 @@
+from gitlab_config.projects import manage_projects
+
+
+class TestManageProjects:
+    def test_rows_keep_project_order(self, mocker):
+        mock_gitlab = mocker.Mock()
+        mock_gitlab.projects.get.side_effect = lambda project_id: mocker.Mock(
+            id=project_id, path=f"project-{project_id}"
+        )
+        mocker.patch(
+            "gitlab_config.projects.manage_project_settings",
+            side_effect=lambda project, config, fix, **kwargs: (
+                {"project": {"value": project.path}},
+                project.id % 2 == 0,
+            ),
+        )
+
+        rows, change_count = manage_projects(
+            mock_gitlab, [1, 2, 3, 4, 5, 6], {}, concurrency=4
+        )
+
+        assert [row["project"]["value"] for row in rows] == [
+            f"project-{i}" for i in range(1, 7)
+        ]
+        assert change_count == 3
+
+    def test_failing_project_is_isolated(self, mocker):
+        mock_gitlab = mocker.Mock()
+
+        def get_project(project_id):
+            if project_id == 2:
+                raise Exception("boom")
+            return mocker.Mock(id=project_id, path=f"project-{project_id}")
+
+        mock_gitlab.projects.get.side_effect = get_project
+        mocker.patch(
+            "gitlab_config.projects.manage_project_settings",
+            side_effect=lambda project, config, fix, **kwargs: (
+                {"project": {"value": project.path}},
+                True,
+            ),
+        )
+
+        rows, change_count = manage_projects(mock_gitlab, [1, 2, 3], {}, concurrency=2)
+
+        assert [row["project"]["value"] for row in rows] == ["project-1", "project-3"]
+        assert change_count == 2
+
+    def test_graphql_snapshot_skips_rest_reads(self, mocker):
+        mock_gitlab = mocker.Mock()
+        mock_gitlab.http_post.return_value = {
+            "data": {
+                "projects": {
+                    "nodes": [
+                        {
+                            "id": "gid://gitlab/Project/1",
+                            "name": "acme-website",
+                            "path": "acme-website",
+                            "fullPath": "acme/acme-website",
+                            "removeSourceBranchAfterMerge": True,
+                            "onlyAllowMergeIfPipelineSucceeds": False,
+                            "repository": {"rootRef": "main"},
+                            "branchRules": {"nodes": []},
+                        }
+                    ]
+                }
+            }
+        }
+        config = {
+            "default": {
+                "remove_source_branch_after_merge": True,
+                "only_allow_merge_if_pipeline_succeeds": True,
+            }
+        }
+
+        rows, change_count = manage_projects(mock_gitlab, [1], config, graphql=True)
+
+        assert mock_gitlab.http_post.call_count == 1
+        mock_gitlab.projects.get.assert_called_once_with(1, lazy=True)
+        assert rows[0]["only_allow_merge_if_pipeline_succeeds"]["changed"] is True
+        assert change_count == 1
@@ -0,0 +1,99 @@
+from types import SimpleNamespace
+
+import gitlab
+
+from gitlab_config.plan import PROJECT, ProjectPlan, protected_branch_resource
+from gitlab_config.promote import GroupPlan, apply_promotion, promote_plans
+
+RESOURCE = protected_branch_resource("main")
+PROTECTION = {
+    "merge_access_levels": [30],
+    "push_access_levels": [0],
+    "allow_force_push": False,
+}
+
+
+def make_plan(project_id, protection=PROTECTION, drifted=True):
+    plan = ProjectPlan(project_id)
+    for attribute, desired in protection.items():
+        if drifted:
+            plan.add(RESOURCE, attribute, None, desired)
+        else:
+            plan.expect(RESOURCE, attribute, desired)
+    return plan
+
+
+def promote(mocker, plans):
+    mock_gitlab = mocker.Mock()
+    mock_gitlab.groups.get.return_value = SimpleNamespace(
+        id=1, full_path="acme", parent_id=None
+    )
+    mock_gitlab.http_get.return_value = {
+        "name": "main",
+        "merge_access_levels": [{"id": 5, "access_level": 40}],
+        "push_access_levels": [{"id": 6, "access_level": 0}],
+        "allow_force_push": False,
+    }
+    paths = {plan.project_id: f"acme/project-{plan.project_id}" for plan in plans}
+    plans_by_id = {plan.project_id: plan for plan in plans}
+    return promote_plans(mock_gitlab, ["acme"], plans_by_id, paths)
+
+
+class TestPromotePlans:
+    def test_agreeing_projects_are_promoted(self, mocker):
+        plans = [make_plan(1), make_plan(2), make_plan(3, drifted=False)]
+
+        group_plans = promote(mocker, plans)
+
+        assert len(group_plans) == 1
+        assert group_plans[0].replaced_writes == 2
+        # Only the drifted attribute is written to the group
+        assert group_plans[0].desired() == {"merge_access_levels": [30]}
+        assert not any(plans)
+
+    def test_disagreeing_projects_keep_their_changes(self, mocker):
+        plans = [
+            make_plan(1),
+            make_plan(2, {**PROTECTION, "allow_force_push": True}),
+        ]
+
+        assert promote(mocker, plans) == []
+        assert all(plans)
+
+    def test_partially_managed_protection_is_not_promoted(self, mocker):
+        plans = [
+            make_plan(1, {"merge_access_levels": [30]}),
+            make_plan(2, {"merge_access_levels": [30]}),
+        ]
+
+        assert promote(mocker, plans) == []
+
+
+class TestApplyPromotion:
+    def test_failed_group_skips_its_projects(self, mocker):
+        mock_apply_plan = mocker.patch("gitlab_config.promote.apply_plan")
+        mock_gitlab = mocker.Mock()
+        mock_gitlab.http_patch.side_effect = [
+            gitlab.exceptions.GitlabHttpError("403 Forbidden", 403),
+            {},
+        ]
+        group_plans = []
+        plans = []
+        for group_id, group_path in enumerate(["acme", "other"], start=1):
+            group_plan = GroupPlan(
+                SimpleNamespace(id=group_id, full_path=group_path), "main"
+            )
+            group_plan.changes["allow_force_push"] = {
+                "current": True,
+                "desired": False,
+            }
+            plan = ProjectPlan(group_id)
+            plan.add(PROJECT, "squash_option", "default_off", "default_on")
+            group_plan.plans = [plan]
+            group_plans.append(group_plan)
+            plans.append(plan)
+
+        failed = apply_promotion(mock_gitlab, group_plans, plans)
+
+        assert failed == [group_plans[0]]
+        mock_apply_plan.assert_called_once_with(mock_gitlab, plans[1])
@@ -0,0 +1,120 @@
+import math
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+from gitlab_config.ratelimit import AdaptiveRateLimiter, RateLimitedAdapter
+
+
+class RateLimitedServer(ThreadingHTTPServer):
+    """Allows `limit` requests per one second window, like GitLab's RateLimit headers."""
+
+    daemon_threads = True
+
+    def __init__(self, limit):
+        super().__init__(("127.0.0.1", 0), RateLimitedHandler)
+        self.limit = limit
+        self.lock = threading.Lock()
+        self.window = None
+        self.used = 0
+        self.throttled = 0
+
+
+class RateLimitedHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            window = math.floor(time.time())
+            if window != server.window:
+                server.window, server.used = window, 0
+            server.used += 1
+            remaining = server.limit - server.used
+            if remaining < 0:
+                server.throttled += 1
+
+        self.send_response(429 if remaining < 0 else 200)
+        self.send_header("RateLimit-Limit", str(server.limit))
+        self.send_header("RateLimit-Remaining", str(max(remaining, 0)))
+        self.send_header("RateLimit-Reset", str(window + 1))
+        if remaining < 0:
+            self.send_header("Retry-After", "1")
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"{}")
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = RateLimitedServer(limit=20)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def get_until_ok(session, url):
+    while session.get(url).status_code == 429:
+        pass
+
+
+class TestAdaptiveRateLimiter:
+    def test_429_halves_concurrency_and_pauses(self):
+        limiter = AdaptiveRateLimiter(max_concurrency=8)
+        limiter.acquire()
+        limiter.release(429, {"Retry-After": "2"})
+
+        assert limiter.concurrency_limit == 4
+        assert limiter.throttled == 1
+        assert limiter._paused_until > time.monotonic() + 1
+
+    def test_healthy_responses_grow_concurrency_up_to_max(self):
+        limiter = AdaptiveRateLimiter(max_concurrency=4)
+        limiter.concurrency_limit = 1.0
+        headers = {
+            "RateLimit-Limit": "10000",
+            "RateLimit-Remaining": "9000",
+            "RateLimit-Reset": str(time.time() + 60),
+        }
+        for _ in range(12):
+            limiter.acquire()
+            limiter.release(200, headers)
+
+        assert limiter.concurrency_limit == 4
+        assert limiter.rate == pytest.approx(150, rel=0.1)
+
+    def test_low_budget_backs_off_before_429(self):
+        limiter = AdaptiveRateLimiter(max_concurrency=8)
+        limiter.acquire()
+        limiter.release(
+            200,
+            {
+                "RateLimit-Limit": "1000",
+                "RateLimit-Remaining": "10",
+                "RateLimit-Reset": str(time.time() + 10),
+            },
+        )
+
+        assert limiter.concurrency_limit == 4
+        assert limiter.rate == pytest.approx(1, rel=0.1)
+
+    def test_paces_against_stub_server(self, server):
+        limiter = AdaptiveRateLimiter(max_concurrency=8)
+        session = requests.Session()
+        session.mount("http://", RateLimitedAdapter(limiter))
+        url = f"http://127.0.0.1:{server.server_port}/api/v4/projects"
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            list(executor.map(lambda _: get_until_ok(session, url), range(40)))
+
+        # Without the limiter 8 workers burn through the budget and keep hitting
+        # 429s until each window resets. With it the budget is spread over the window.
+        assert server.throttled <= 8
+        assert limiter.in_flight == 0
@@ -0,0 +1,88 @@
+import csv
+import io
+import json
+
+from benchmarks.simulator import COMPLIANT_SETTINGS, GitLabSimulator
+from gitlab_config.colors import Colors
+from gitlab_config.main import main
+from gitlab_config.report import CsvReport, JsonlReport, print_table, render_cell
+
+ROW = {
+    "project": {"value": "acme-website"},
+    "squash_option": {"value": "default_off", "changed": True},
+    "merge_requests_template": {"value": None, "changed": False},
+}
+
+
+def test_render_cell_colours_at_render_time():
+    assert render_cell("project", ROW["project"], fix=False) == "acme-website"
+    assert render_cell("squash_option", ROW["squash_option"], fix=False).startswith(
+        Colors.YELLOW
+    )
+    assert render_cell("squash_option", ROW["squash_option"], fix=True).startswith(
+        Colors.GREEN
+    )
+    assert render_cell("status", {"value": "failed"}, fix=True).startswith(Colors.RED)
+
+
+def test_table_with_different_columns_per_project(capsys):
+    print_table(
+        [ROW, {"project": {"value": "acme-api"}, "prevent_secrets": {"value": True}}]
+    )
+
+    header = capsys.readouterr().out.splitlines()[1]
+    assert "merge_requests_template" in header and "prevent_secrets" in header
+
+
+def test_jsonl_report():
+    file = io.StringIO()
+    JsonlReport(file, fix=False).write(123, ROW)
+
+    record = json.loads(file.getvalue())
+    assert record == {"project_id": 123, "changed": True, "fix": False, "fields": ROW}
+    assert "\033" not in file.getvalue()
+
+
+def test_csv_report():
+    file = io.StringIO()
+    report = CsvReport(file, fix=False, columns=[*ROW, "merge_access_levels"])
+    report.write(123, ROW)
+    # Later rows keep columns the first row doesn't have
+    report.write(
+        456,
+        {
+            "project": {"value": "other"},
+            "merge_access_levels": {"value": "Maintainers", "changed": True},
+        },
+    )
+
+    rows = list(csv.DictReader(io.StringIO(file.getvalue())))
+    assert rows[0] == {
+        "project_id": "123",
+        "changed": "True",
+        "project": "acme-website",
+        "squash_option": "default_off",
+        "merge_requests_template": "",
+        "merge_access_levels": "",
+        "changed_fields": "squash_option",
+    }
+    assert rows[1]["project"] == "other"
+    assert rows[1]["squash_option"] == ""
+    assert rows[1]["merge_access_levels"] == "Maintainers"
+
+
+def test_streamed_report_keeps_stdout_clean(capsys):
+    with GitLabSimulator(projects=4, subgroups=1, drift=1.0) as simulator:
+        config = {
+            "GITLAB_URL": simulator.url,
+            "GITLAB_TOKEN": "token",
+            "default": {"squash_option": COMPLIANT_SETTINGS["squash_option"]},
+        }
+        main(["projects", "1", "2", "--output", "jsonl"], config)
+
+    out, err = capsys.readouterr()
+    records = [json.loads(line) for line in out.splitlines()]
+    assert [record["project_id"] for record in records] == ["1", "2"]
+    assert all(record["changed"] for record in records)
+    assert "Managing project" in err
+    assert "Changes would be applied to 2/2 projects" in err
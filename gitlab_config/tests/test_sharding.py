@@ -0,0 +1,71 @@
+import json
+from argparse import ArgumentTypeError
+
+import pytest
+
+from gitlab_config.main import main
+from gitlab_config.sharding import Shard, in_shard, parse_shard
+
+
+def test_every_project_lands_in_exactly_one_shard():
+    project_ids = range(1, 1001)
+    shards = [Shard(index, 4) for index in range(1, 5)]
+
+    counts = [
+        sum(1 for project_id in project_ids if in_shard(project_id, shard))
+        for shard in shards
+    ]
+
+    assert sum(counts) == 1000
+    for project_id in project_ids:
+        assert sum(in_shard(project_id, shard) for shard in shards) == 1
+    # Roughly even split
+    assert min(counts) > 200
+
+
+def test_shard_ignores_id_type():
+    assert in_shard(123, Shard(2, 3)) == in_shard("123", Shard(2, 3))
+
+
+@pytest.mark.parametrize("value", ["0/4", "5/4", "1", "a/b", "1/0"])
+def test_parse_shard_rejects_invalid(value):
+    with pytest.raises(ArgumentTypeError):
+        parse_shard(value)
+
+
+def test_projects_subcommand_only_manages_its_shard(mocker):
+    mocker.patch("gitlab_config.client.gitlab.Gitlab")
+    mock_manage_projects = mocker.patch("gitlab_config.main.manage_projects")
+    mock_manage_projects.return_value = ([], 0)
+    project_ids = [str(project_id) for project_id in range(1, 21)]
+
+    managed = []
+    for index in (1, 2):
+        main(["projects", *project_ids, "--shard", f"{index}/2"])
+        managed.append(mock_manage_projects.call_args.args[1])
+
+    assert sorted(managed[0] + managed[1], key=int) == project_ids
+    assert not set(managed[0]) & set(managed[1])
+
+
+def test_merge_reports(tmp_path, capsys):
+    def record(project_id, changed):
+        return {
+            "project_id": project_id,
+            "changed": changed,
+            "fix": False,
+            "fields": {"project": {"value": f"project-{project_id}"}},
+        }
+
+    shard_1 = tmp_path / "shard-1.jsonl"
+    shard_1.write_text(json.dumps(record(10, True)) + "\n")
+    shard_2 = tmp_path / "shard-2.jsonl"
+    shard_2.write_text(
+        "\n".join(json.dumps(r) for r in [record(2, False), record(7, True)]) + "\n"
+    )
+
+    main(["merge-reports", str(shard_1), str(shard_2)], {})
+
+    out = capsys.readouterr().out
+    assert out.index("project-2") < out.index("project-7") < out.index("project-10")
+    assert "Changes would be applied to 2/3 projects" in out
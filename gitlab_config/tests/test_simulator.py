@@ -0,0 +1,137 @@
+import re
+
+import pytest
+
+from benchmarks.simulator import (
+    APPROVAL_RULE_NAME,
+    COMPLIANT_SETTINGS,
+    ROOT_GROUP_PATH,
+    GitLabSimulator,
+)
+from gitlab_config.main import main
+
+
+@pytest.fixture
+def simulator():
+    with GitLabSimulator(projects=40, subgroups=3, drift=0.5) as simulator:
+        yield simulator
+
+
+@pytest.fixture
+def config(simulator):
+    return {
+        "GITLAB_URL": simulator.url,
+        "GITLAB_TOKEN": "token",
+        "default": {
+            **COMPLIANT_SETTINGS,
+            "merge_access_levels": "Developers + Maintainers",
+        },
+    }
+
+
+def active_drifted_projects(simulator):
+    projects = simulator.gitlab.projects
+    return [
+        project_id
+        for project_id in simulator.gitlab.drifted_project_ids()
+        if not projects[project_id]["archived"]
+    ]
+
+
+def test_dry_run_makes_no_writes(simulator, config):
+    assert active_drifted_projects(simulator)
+
+    main(["groups", "-r", ROOT_GROUP_PATH, "--concurrency", "4"], config)
+
+    assert simulator.stats()["writes"] == 0
+
+
+def test_fix_brings_every_project_in_line(simulator, config, capsys):
+    main(["groups", "-r", ROOT_GROUP_PATH, "--fix", "--concurrency", "4"], config)
+    assert active_drifted_projects(simulator) == []
+
+    writes = simulator.stats()["writes"]
+    capsys.readouterr()
+    main(["groups", "-r", ROOT_GROUP_PATH], config)
+
+    assert simulator.stats()["writes"] == writes
+    assert "Changes would be applied to 0/" in capsys.readouterr().out
+
+
+def test_approval_rules_share_the_settings_pass(simulator, config, capsys):
+    config["default"] = {
+        **config["default"],
+        "approval_rules": [
+            {
+                "name": APPROVAL_RULE_NAME,
+                "approvals_required": 1,
+                "users": ["user-1", "user-2"],
+            }
+        ],
+    }
+
+    main(["groups", "-r", ROOT_GROUP_PATH, "--fix", "--concurrency", "4"], config)
+
+    endpoints = simulator.stats()["endpoints"]
+    # Approvers are looked up once, and each project is read once for both
+    assert endpoints["POST /graphql"] == 1
+    assert (
+        endpoints["GET /projects/:id"] == endpoints["GET /projects/:id/approval_rules"]
+    )
+    for project in simulator.gitlab.projects.values():
+        if project["archived"]:
+            continue
+        (rule,) = project["__approval_rules"]
+        assert rule["approvals_required"] == 1
+        assert [user["username"] for user in rule["users"]] == ["user-1", "user-2"]
+
+    capsys.readouterr()
+    main(["groups", "-r", ROOT_GROUP_PATH], config)
+    assert "Changes would be applied to 0/" in capsys.readouterr().out
+
+
+def test_promote_protects_the_branch_once_on_the_group(simulator, config, capsys):
+    config["default"] = {
+        **config["default"],
+        "push_access_levels": "No one",
+        "allow_force_push": False,
+    }
+
+    # Projects with changes are counted the same way with or without --promote
+    main(["groups", "-r", ROOT_GROUP_PATH], config)
+    (summary,) = re.findall(r"applied to \d+/\d+", capsys.readouterr().out)
+    main(["groups", "-r", ROOT_GROUP_PATH, "--promote"], config)
+    assert summary in capsys.readouterr().out
+
+    main(["groups", "-r", ROOT_GROUP_PATH, "--promote", "--fix"], config)
+
+    endpoints = simulator.stats()["endpoints"]
+    assert endpoints["POST /groups/:id/protected_branches"] == 1
+    assert "PATCH /projects/:id/protected_branches/:name" not in endpoints
+    assert active_drifted_projects(simulator) == []
+
+    capsys.readouterr()
+    main(["groups", "-r", ROOT_GROUP_PATH], config)
+    assert "Changes would be applied to 0/" in capsys.readouterr().out
+
+
+def test_projects_by_path_are_resolved_in_batches(tmp_path, capsys):
+    with GitLabSimulator(projects=150, subgroups=3) as simulator:
+        paths = [
+            project["path_with_namespace"]
+            for project in simulator.gitlab.projects.values()
+        ]
+        targets = tmp_path / "projects.txt"
+        targets.write_text("# from another tool\n" + "\n".join(paths[1:]) + "\n")
+        config = {
+            "GITLAB_URL": simulator.url,
+            "GITLAB_TOKEN": "token",
+            "default": {"remove_source_branch_after_merge": True},
+        }
+
+        main(["projects", paths[0], "--from-file", str(targets)], config)
+
+        endpoints = simulator.stats()["endpoints"]
+        assert endpoints["POST /graphql"] == 2
+        assert "GET /projects/:id" not in endpoints
+        assert "/150 projects" in capsys.readouterr().out
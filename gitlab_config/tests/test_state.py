@@ -0,0 +1,34 @@
+from gitlab_config.state import StateStore, groups_scope
+
+CONFIG = {"GITLAB_TOKEN": "secret", "default": {"merge_method": "ff"}}
+
+
+def test_last_run_requires_the_same_config(tmp_path):
+    store = StateStore(tmp_path / "state.db")
+    scope = groups_scope(["acme"], recurse=True)
+    assert store.last_run(scope, CONFIG) is None
+
+    store.finish_run(scope, "2026-01-01T00:00:00+00:00", CONFIG)
+    assert store.last_run(scope, CONFIG) == "2026-01-01T00:00:00+00:00"
+    # Rotating the token doesn't invalidate stored results
+    assert store.last_run(scope, {**CONFIG, "GITLAB_TOKEN": "new"}) is not None
+    assert store.last_run(scope, {**CONFIG, "default": {}}) is None
+
+
+def test_groups_scope_ignores_group_order():
+    assert groups_scope(["b", "a"], False) == groups_scope(["a", "b"], False)
+    assert groups_scope(["a"], False) != groups_scope(["a"], True)
+
+
+def test_record_and_reuse_rows(tmp_path):
+    store = StateStore(tmp_path / "state.db")
+    store.record("s", 1, {"project": {"value": "one"}}, drifted=False)
+    store.record("s", 2, {"project": {"value": "two"}}, drifted=True)
+    store.record("other", 3, {"project": {"value": "three"}}, drifted=True)
+
+    assert store.drifted_project_ids("s") == ["2"]
+    assert store.rows("s", exclude={"2"}) == [("1", {"project": {"value": "one"}})]
+
+    store.clear("s")
+    assert store.rows("s", exclude=set()) == []
+    assert store.drifted_project_ids("other") == ["3"]
@@ -8,9 +8,9 @@ import sys
 from dotenv import load_dotenv
 
 
-def main(gitlab_token):
+def main(gitlab_token, gitlab_url="https://gitlab.com"):
     resp = requests.get(  # nosec B113
-        "https://gitlab.com/api/v4/runners",
+        "{}/api/v4/runners".format(gitlab_url),
         headers={"PRIVATE-TOKEN": gitlab_token},
         params={"per_page": 100},
     )
@@ -33,7 +33,7 @@ def main(gitlab_token):
             )
 
             r = requests.delete(  # nosec B113
-                "https://gitlab.com/api/v4/runners/{}".format(runner["id"]),
+                "{}/api/v4/runners/{}".format(gitlab_url, runner["id"]),
                 headers={"PRIVATE-TOKEN": gitlab_token},
             )
 
@@ -57,9 +57,10 @@ if __name__ == "__main__":
     load_dotenv()
 
     gitlab_token = os.environ.get("GITLAB_TOKEN")
+    gitlab_url = os.environ.get("GITLAB_URL", "https://gitlab.com")
 
     if gitlab_token is None:
         print("Gitlab token is not set")
         print("Please set GITLAB_TOKEN in your environment")
     else:
-        main(gitlab_token)
+        main(gitlab_token, gitlab_url)